@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate_fabric
+import generate_topology as gt
+
+# 基准测试：按规模生成合成 fat-tree CSV，在独立子进程中逐阶段计时，
+# 记录峰值内存（RSS）与输出大小，并与保存的基线比较以发现性能回退
+
+CASES = {
+    'small': generate_fabric.FabricSpec(cores=4, pods=2, spines=4, leaves=8, uplinks=8, hosts=4),
+    'medium': generate_fabric.FabricSpec(cores=16, pods=8, spines=8, leaves=32, uplinks=16, hosts=8),
+    'large': generate_fabric.FabricSpec(cores=32, pods=16, spines=16, leaves=32, uplinks=32, hosts=8),
+    'xlarge': generate_fabric.FabricSpec(cores=64, pods=32, spines=16, leaves=32, uplinks=32, hosts=16),
+}
+STAGES = ('ingest', 'cache_hit', 'partition', 'layout', 'payloads', 'render', 'write')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baseline.json')
+
+
+def run_stages(csv_path, work_dir, repeat):
+    """在当前进程中逐阶段运行流水线，每个阶段取 repeat 次中的最短耗时。"""
+    times = {stage: float('inf') for stage in STAGES}
+    output = os.path.join(work_dir, 'topology.html')
+
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        times[stage] = min(times[stage], time.perf_counter() - start)
+        return result
+
+    for _ in range(repeat):
+        report = gt.IngestReport()
+        graph = timed('ingest', lambda: gt.build_graph(gt.read_port_rows(csv_path, report)))
+        cache = gt.ParseCache(os.path.join(work_dir, 'cache'))
+        cache.store(cache.key_for(csv_path), graph)
+        timed('cache_hit', gt.load_graph, csv_path, cache)
+        partition = timed('partition', gt.partition_pods, graph)
+        layout = timed('layout', gt.layout_topology, graph, partition)
+        payloads = timed('payloads', gt.build_payloads, graph, partition, layout)
+        html = timed('render', gt.render_html, graph, partition, layout, payloads=payloads)
+        timed('write', gt.write_html, html, output)
+    return {
+        'rows': report.rows,
+        'links': graph.num_links,
+        'pods': len(partition.pods_only),
+        'seconds': {stage: round(t, 4) for stage, t in times.items()},
+        'total_seconds': round(sum(times.values()), 4),
+        'peak_rss_mb': gt.peak_rss_mb(),
+        'output_bytes': os.path.getsize(output),
+    }
+
+
+def run_case(name, work_dir, repeat):
+    """生成 CSV 后在子进程中计时，避免各规模之间的峰值内存相互影响。"""
+    csv_path = os.path.join(work_dir, f'Ports-{name}.csv')
+    generate_fabric.write_fabric_csv(csv_path, CASES[name])
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-case', csv_path, work_dir, str(repeat)],
+        stdout=subprocess.PIPE, check=True)
+    result = json.loads(proc.stdout)
+    result['csv_bytes'] = os.path.getsize(csv_path)
+    return result
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """返回回退描述列表：耗时、峰值内存或输出大小超过基线 (1 + tolerance) 倍时记为回退。"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        checks = [(f'{stage} 耗时', result['seconds'][stage], base['seconds'].get(stage), min_delta)
+                  for stage in STAGES]
+        checks.append(('峰值内存(MB)', result['peak_rss_mb'], base.get('peak_rss_mb'), 1.0))
+        checks.append(('输出大小(B)', result['output_bytes'], base.get('output_bytes'), 0))
+        for label, value, expected, floor in checks:
+            if value is None or expected is None:
+                continue
+            if value > expected * (1 + tolerance) and value - expected > floor:
+                regressions.append(f'{name}: {label} {value} > 基线 {expected}（+{(value / expected - 1) * 100:.0f}%）'
+                                   if expected else f'{name}: {label} {value} > 基线 {expected}')
+    return regressions
+
+
+def print_table(results):
+    header = ['规模', '链路', 'POD'] + list(STAGES) + ['合计(s)', '峰值(MB)', '输出(KB)']
+    print(' | '.join(header))
+    for name, r in results.items():
+        cells = [name, str(r['links']), str(r['pods'])]
+        cells += [f"{r['seconds'][stage]:.3f}" for stage in STAGES]
+        cells += [f"{r['total_seconds']:.3f}", str(r['peak_rss_mb']), f"{r['output_bytes'] / 1024:.1f}"]
+        print(' | '.join(cells))
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='generate_topology.py 分阶段性能基准')
+    parser.add_argument('--cases', dest='cases', nargs='+', choices=list(CASES), default=list(CASES), help='要运行的规模')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='每个规模重复次数，各阶段取最短耗时')
+    parser.add_argument('--baseline', dest='baseline', default=DEFAULT_BASELINE, help='基线 JSON 路径')
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true', help='将本次结果写为基线（覆盖同名规模）')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.25, help='允许超出基线的比例')
+    parser.add_argument('--min-delta', dest='min_delta', type=float, default=0.005, help='耗时超出基线的绝对值低于此秒数时不计为回退')
+    parser.add_argument('--json', dest='json', default=None, help='将本次结果另存为 JSON')
+    parser.add_argument('--run-case', dest='run_case', nargs=3, metavar=('CSV', 'WORK_DIR', 'REPEAT'), help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.run_case:
+        csv_path, work_dir, repeat = args.run_case
+        print(json.dumps(run_stages(csv_path, work_dir, int(repeat))))
+        return 0
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='topology-bench-') as work_dir:
+        for name in args.cases:
+            case_dir = os.path.join(work_dir, name)
+            os.makedirs(case_dir)
+            results[name] = run_case(name, case_dir, args.repeat)
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    if args.save_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f'已保存基线: {args.baseline}')
+        return 0
+    if not baseline:
+        print(f'提示: 未找到基线 {args.baseline}，可用 --save-baseline 生成')
+        return 0
+    regressions = compare(results, baseline, args.tolerance, args.min_delta)
+    for line in regressions:
+        print(f'回退: {line}')
+    print('与基线相比无回退' if not regressions else f'共 {len(regressions)} 项回退')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import csv
+import argparse
+import bz2
+import gzip
+import io
+import lzma
+import random
+import sys
+from dataclasses import dataclass
+
+# 按参数生成 UFM 格式的 fat-tree 端口 CSV，用于性能测试与演示（见 benchmark.py）
+# 命名与现网一致：Core 为 IBCR，Spine 为 IBSP，Leaf 为 IBLF，Spine/Leaf/主机名称带 PODn
+
+
+@dataclass
+class FabricSpec:
+    cores: int = 4
+    pods: int = 3
+    spines: int = 4  # 每个 POD 的 Spine 数
+    leaves: int = 8  # 每个 POD 的 Leaf 数
+    uplinks: int = 8  # 每个 Leaf 的上行链路数，轮流分配到本 POD 的各 Spine
+    core_links: int = 1  # 每对 Spine-Core 之间的链路数
+    hosts: int = 4  # 每个 Leaf 下连的主机端口数
+    down: int = 0  # 每个 Leaf 未连接（Peer Node 为空）的端口数
+    site: str = 'MDC-A1'
+    seed: int = 1
+    shuffle: bool = True
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(cores=args.cores, pods=args.pods, spines=args.spines, leaves=args.leaves,
+                   uplinks=args.uplinks, core_links=args.core_links, hosts=args.hosts,
+                   down=args.down, site=args.site, seed=args.seed, shuffle=not args.no_shuffle)
+
+
+def core_name(spec, i):
+    return f'{spec.site}-IBCR-{i + 1:03d}'
+
+
+def spine_name(spec, pod, i):
+    return f'{spec.site}-POD{pod}-G01-U{i + 1:02d}-IBSP-{i + 1:03d}'
+
+
+def leaf_name(spec, pod, i):
+    return f'{spec.site}-POD{pod}-G02-U{i + 1:02d}-IBLF-{i + 1:03d}'
+
+
+def fabric_rows(spec):
+    """返回 (System, Port, Peer Node, Peer Port) 行列表；每条链路两端各导出一行，与 UFM 一致。"""
+    rows = []
+    next_port = {}
+
+    def port(device):
+        n = next_port.get(device, 1)
+        next_port[device] = n + 1
+        return str(n)
+
+    def link(a, b):
+        pa, pb = port(a), port(b)
+        rows.append((a, pa, b, pb))
+        rows.append((b, pb, a, pa))
+
+    cores = [core_name(spec, i) for i in range(spec.cores)]
+    for pod in range(1, spec.pods + 1):
+        spines = [spine_name(spec, pod, i) for i in range(spec.spines)]
+        for spine in spines:
+            for core in cores:
+                for _ in range(spec.core_links):
+                    link(spine, core)
+        for j in range(spec.leaves):
+            leaf = leaf_name(spec, pod, j)
+            for u in range(spec.uplinks):
+                link(leaf, spines[u % len(spines)])
+            for h in range(spec.hosts):
+                host = f'{spec.site}-POD{pod}-GPU-{j + 1:03d}-{h + 1:02d}'
+                leaf_port = port(leaf)
+                rows.append((leaf, leaf_port, host, 'HCA-1'))
+                rows.append((host, 'HCA-1', leaf, leaf_port))
+            for _ in range(spec.down):
+                rows.append((leaf, port(leaf), '', ''))
+    if spec.shuffle:
+        random.Random(spec.seed).shuffle(rows)
+    return rows
+
+
+def open_output(path):
+    if path == '-':
+        return io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8-sig', newline='')
+    lower = path.lower()
+    if lower.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8-sig', newline='')
+    if lower.endswith('.xz'):
+        return lzma.open(path, 'wt', encoding='utf-8-sig', newline='')
+    if lower.endswith('.bz2'):
+        return bz2.open(path, 'wt', encoding='utf-8-sig', newline='')
+    return open(path, 'w', encoding='utf-8-sig', newline='')
+
+
+def write_fabric_csv(path, spec):
+    """写出 CSV（按扩展名压缩，- 为标准输出），返回写入的行数。"""
+    rows = fabric_rows(spec)
+    f = open_output(path)
+    try:
+        writer = csv.writer(f)
+        writer.writerow(['System', 'Port', 'Peer Node', 'Peer Port'])
+        writer.writerows(rows)
+    finally:
+        if path == '-':
+            f.flush()
+            f.detach()
+        else:
+            f.close()
+    return len(rows)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='生成 UFM 格式的 fat-tree 端口 CSV（合成数据）')
+    parser.add_argument('--output', dest='output', default='Ports-synthetic.csv', help='输出 CSV 路径，.gz/.xz/.bz2 结尾时压缩，- 表示标准输出')
+    parser.add_argument('--cores', dest='cores', type=int, default=4, help='Core 数量')
+    parser.add_argument('--pods', dest='pods', type=int, default=3, help='POD 数量')
+    parser.add_argument('--spines', dest='spines', type=int, default=4, help='每个 POD 的 Spine 数量')
+    parser.add_argument('--leaves', dest='leaves', type=int, default=8, help='每个 POD 的 Leaf 数量')
+    parser.add_argument('--uplinks', dest='uplinks', type=int, default=8, help='每个 Leaf 的上行链路数（轮流连到本 POD 各 Spine）')
+    parser.add_argument('--core-links', dest='core_links', type=int, default=1, help='每对 Spine-Core 之间的链路数')
+    parser.add_argument('--hosts', dest='hosts', type=int, default=4, help='每个 Leaf 下连的主机端口数')
+    parser.add_argument('--down', dest='down', type=int, default=0, help='每个 Leaf 未连接的端口数')
+    parser.add_argument('--site', dest='site', default='MDC-A1', help='设备名前缀')
+    parser.add_argument('--seed', dest='seed', type=int, default=1, help='打乱行顺序的随机种子')
+    parser.add_argument('--no-shuffle', dest='no_shuffle', action='store_true', help='按生成顺序输出，不打乱行')
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    spec = FabricSpec.from_args(args)
+    if spec.cores < 1 or spec.pods < 1 or spec.spines < 1 or spec.leaves < 0:
+        print('错误: Core、POD、Spine 数量至少为 1', file=sys.stderr)
+        return 1
+    rows = write_fabric_csv(args.output, spec)
+    print(f'已生成: {args.output}（{rows} 行端口记录）', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,28 +1,125 @@
 import csv
 import re
 import json
+import struct
 import argparse
+import base64
+import bz2
+import cProfile
 import glob
+import gzip
+import hashlib
+import io
+import lzma
 import os
+import pstats
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from html import escape
+from itertools import chain, combinations, islice, product
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from collections import defaultdict
-
-# 参数配置
-parser = argparse.ArgumentParser(description='根据 UFM 端口信息生成 CLOS 拓扑 HTML')
-parser.add_argument('--csv', dest='csv', default=None, help='指定端口 CSV 路径')
-parser.add_argument('--csv-glob', dest='csv_glob', default='Ports-*.csv', help='CSV 文件匹配模式，未指定 --csv 时选取最新的一个')
-parser.add_argument('--output', dest='output', default='topology.html', help='输出 HTML 文件名')
-parser.add_argument('--layer-gap', dest='layer_gap', type=int, default=900, help='三层之间的垂直间距')
-parser.add_argument('--node-gap', dest='node_gap', type=int, default=200, help='Core 同层节点间距')
-parser.add_argument('--spine-gap', dest='spine_gap', type=int, default=350, help='Spine 同层节点间距')
-parser.add_argument('--leaf-gap', dest='leaf_gap', type=int, default=350, help='Leaf 同层节点间距')
-parser.add_argument('--label-width', dest='label_width', type=int, default=150, help='节点标签最大宽度（px）')
-parser.add_argument('--pod-spacing', dest='pod_spacing', type=int, default=None, help='ALL 视图中各 POD 的水平间距；未指定时自动计算')
-parser.add_argument('--pod-margin', dest='pod_margin', type=int, default=200, help='自动计算 POD 间距时的额外边距')
-parser.add_argument('--max-chains', dest='max_chains', type=int, default=15, help='链路详细信息条数上限')
-parser.add_argument('--debug', dest='debug', action='store_true', help='启用调试输出')
-parser.add_argument('--debug-target-leaf', dest='debug_target_leaf', default='', help='调试：仅在 --debug 时输出该 Leaf 的链路情况')
-args = parser.parse_args()
+from urllib.parse import unquote, urlsplit
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows 无 resource 模块，不记录进程峰值内存
+    resource = None
+
+# 流水线阶段：解析 CSV -> 构建图 -> POD 划分 -> 布局 -> 序列化 -> 渲染 HTML
+# 各阶段均可单独调用，返回的对象可复用（例如只解析一次、以不同布局参数多次渲染）
+
+POD_COLORS = [
+    "#f1c40f33",
+    "#a2d5f2cc",
+    "#b8e994cc",
+    "#f7cac9cc",
+    "#f9e79fcc",
+    "#d2b4fccc",
+    "#f5cba7cc"]
+
+LAYER_STYLES = {
+    'core': {'color': '#e74c3c', 'size': 50},
+    'spine': {'color': '#3498db', 'size': 45},
+    'leaf': {'color': '#27ae60', 'size': 40},
+}
+POD_CONTAINER_HEIGHT = 350
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='根据 UFM 端口信息生成 CLOS 拓扑 HTML')
+    parser.add_argument('--csv', dest='csv', default=None, help='指定端口 CSV 路径，支持 .gz/.xz/.bz2 压缩文件，- 表示标准输入')
+    parser.add_argument('--csv-glob', dest='csv_glob', default='Ports-*.csv', help='CSV 文件匹配模式，未指定 --csv 时选取最新的一个')
+    parser.add_argument('--output', dest='output', default='topology.html', help='输出 HTML 文件名')
+    parser.add_argument('--layer-gap', dest='layer_gap', type=int, default=900, help='三层之间的垂直间距')
+    parser.add_argument('--node-gap', dest='node_gap', type=int, default=200, help='Core 同层节点间距')
+    parser.add_argument('--spine-gap', dest='spine_gap', type=int, default=350, help='Spine 同层节点间距')
+    parser.add_argument('--leaf-gap', dest='leaf_gap', type=int, default=350, help='Leaf 同层节点间距')
+    parser.add_argument('--label-width', dest='label_width', type=int, default=150, help='节点标签最大宽度（px）')
+    parser.add_argument('--pod-spacing', dest='pod_spacing', type=int, default=None, help='ALL 视图中各 POD 的水平间距；未指定时自动计算')
+    parser.add_argument('--pod-margin', dest='pod_margin', type=int, default=200, help='自动计算 POD 间距时的额外边距')
+    parser.add_argument('--bundle', dest='bundle', action='store_true', help='捆绑模式：同一设备对之间的平行链路聚合为一条边，点击或放大后展开为逐端口链路')
+    parser.add_argument('--bundle-zoom', dest='bundle_zoom', type=float, default=1.5, help='捆绑模式下自动展开可视区域内捆绑边的缩放阈值')
+    parser.add_argument('--max-chains', dest='max_chains', type=int, default=15, help='路径查询返回的路径条数上限（命令行与页面中的路径查询）')
+    parser.add_argument('--max-hops', dest='max_hops', type=int, default=4, help='路径查询的最大跳数')
+    parser.add_argument('--query-paths', dest='query_paths', nargs=2, metavar=('SRC', 'DST'), default=None, help='查询两台设备间的路径（按跳数从少到多，最多 --max-chains 条）并输出 ECMP 统计，不生成页面')
+    parser.add_argument('--via', dest='via', default=None, help='与 --query-paths 一起使用：路径必须经过的设备（如某台 Spine 或 Core）')
+    parser.add_argument('--query-ecmp', dest='query_ecmp', nargs=2, metavar=('SRC', 'DST'), default=None, help='统计两台设备间的等价最短路径数，不生成页面')
+    parser.add_argument('--focus', dest='focus', default=None, help='聚焦：只导出该交换机 --hops 跳内的邻域子图，生成独立的小页面 <输出名>-<设备名>.html')
+    parser.add_argument('--hops', dest='hops', type=int, default=2, help='与 --focus 一起使用：邻域的跳数')
+    parser.add_argument('--ecmp-pod', dest='ecmp_pod', default=None, help='统计指定 POD 内所有 Leaf 对之间的 ECMP 路径数，不生成页面')
+    parser.add_argument('--analytics', dest='analytics', action='store_true', help='分析：统计各交换机上/下行链路、超售比与扇出均衡，POD 内 Leaf 对的 ECMP 路径数以及缺失/多余的链路，并在页面中加入按指标着色的选项')
+    parser.add_argument('--analytics-json', dest='analytics_json', default=None, help='将分析结果写入该 JSON 文件（指定即启用 --analytics）')
+    parser.add_argument('--analytics-csv', dest='analytics_csv', default=None, help='将逐交换机的分析指标写入该 CSV 文件（指定即启用 --analytics）')
+    parser.add_argument('--validate', dest='validate', action='store_true', help='布线校验：检查不对称对端、重复端口、被重复连接的端口、未识别层级的设备、同层链路与跨 POD 的 Leaf-Spine 链路，输出报告后退出（有错误时退出码 3）')
+    parser.add_argument('--validate-report', dest='validate_report', default=None, help='校验报告 JSON 路径（默认与输出同名的 .validation.json）')
+    parser.add_argument('--strict', dest='strict', action='store_true', help='与 --validate 一起使用：只有警告时也以退出码 4 失败')
+    parser.add_argument('--history-db', dest='history_db', default=None, help='SQLite 历史库路径：生成页面（含监视模式）时将本次导出存为一个快照，未变化的链路记录不重复存储')
+    parser.add_argument('--snapshot-time', dest='snapshot_time', default=None, help='存入历史库的快照时间（ISO 格式，默认取 CSV 文件修改时间，UTC）')
+    parser.add_argument('--snapshot', dest='snapshot', default=None, help='从历史库渲染快照而不读取 CSV：快照编号、latest，或时间（取不晚于该时间的最近快照）')
+    parser.add_argument('--list-snapshots', dest='list_snapshots', action='store_true', help='列出历史库中的快照')
+    parser.add_argument('--port-history', dest='port_history', nargs=2, metavar=('DEVICE', 'PORT'), default=None, help='查询端口在各快照中的对端及变更时间')
+    parser.add_argument('--device-history', dest='device_history', default=None, help='查询设备在各快照中的全部链路')
+    parser.add_argument('--diff', dest='diff', nargs=2, metavar=('OLD_CSV', 'NEW_CSV'), default=None, help='比较两份导出：输出变更报告，并只重新生成有变化的 POD 载荷')
+    parser.add_argument('--diff-report', dest='diff_report', default=None, help='差异报告 JSON 路径（默认与输出同名的 .diff.json）')
+    parser.add_argument('--save-state', dest='save_state', action='store_true', help='保存各 POD 载荷到状态文件，供后续 --diff 复用')
+    parser.add_argument('--state-file', dest='state_file', default=None, help='载荷状态文件路径（默认 <输出文件>.state）')
+    parser.add_argument('--shard', dest='shard', action='store_true', help='分片输出：生成外壳 HTML，并将 Core 与每个 POD 的载荷写入 <输出名>_data/ 目录，页面按需加载')
+    parser.add_argument('--compress', dest='compress', action='store_true', help='载荷以 gzip + base64 内嵌，浏览器端用 DecompressionStream 解压（仍为单个离线文件）')
+    parser.add_argument('--export', dest='export', nargs='+', choices=list(EXPORT_FORMATS), default=None, help='同时导出 Core/Spine/Leaf 链路图：jsonl（每行一条链路）、graphml、dot，文件名为 <输出名>.<格式>，流式写出')
+    parser.add_argument('--offline', dest='offline', action='store_true', help='离线模式：将本地 Cytoscape 构建内联进 HTML，页面不访问 CDN')
+    parser.add_argument('--cytoscape-js', dest='cytoscape_js', default=None, help='本地 cytoscape.min.js 路径或所在目录（指定即启用 --offline；默认查找脚本目录与缓存目录下的 assets/）')
+    parser.add_argument('--rules', dest='rules', default=None, help='设备分类规则 JSON 文件：层级、POD、机柜与排的正则（见 README），规则摘要计入解析缓存键')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='不使用解析缓存')
+    parser.add_argument('--rebuild-cache', dest='rebuild_cache', action='store_true', help='忽略已有缓存，重新解析并写入缓存')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None, help='解析缓存目录（默认 ~/.cache/ufm-topology）')
+    parser.add_argument('--cache-max-mb', dest='cache_max_mb', type=int, default=256, help='解析缓存总大小上限（MB），超出时淘汰最久未用的条目')
+    parser.add_argument('--watch', dest='watch', action='store_true', help='监视模式：持续轮询 --csv-glob（或 --csv），出现内容有变化的新导出时增量重新生成页面')
+    parser.add_argument('--watch-interval', dest='watch_interval', type=float, default=5.0, help='监视模式的轮询间隔（秒）')
+    parser.add_argument('--serve', dest='serve', action='store_true', help='服务模式：启动本地 HTTP 服务，提供页面外壳与按 POD 获取的 JSON 接口，不写出 HTML 文件')
+    parser.add_argument('--host', dest='host', default='127.0.0.1', help='服务模式监听地址')
+    parser.add_argument('--port', dest='port', type=int, default=8000, help='服务模式监听端口')
+    parser.add_argument('--serve-cache', dest='serve_cache', type=int, default=64, help='服务模式下内存中缓存的已序列化响应数（LRU）')
+    parser.add_argument('--batch', dest='batch', nargs='+', metavar='INPUT', default=None, help='批量模式：输入为目录（递归查找 CSV 及其压缩文件）或 glob 模式，多进程并行生成每份导出的页面及索引页')
+    parser.add_argument('--batch-dir', dest='batch_dir', default='topology_batch', help='批量模式的输出目录')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=None, help='批量模式的工作进程数（默认 CPU 核数）')
+    parser.add_argument('--profile', dest='profile', action='store_true', help='性能剖析：输出各阶段耗时与内存峰值，以 cProfile 与 tracemalloc 运行并保存 <输出名>.prof')
+    parser.add_argument('--metrics-json', dest='metrics_json', default=None, help='将各阶段耗时、内存峰值、每个 POD 的元素数与输出大小写入该 JSON 文件')
+    parser.add_argument('--debug', dest='debug', action='store_true', help='启用调试输出')
+    parser.add_argument('--debug-target-leaf', dest='debug_target_leaf', default='', help='调试：仅在 --debug 时输出该 Leaf 的链路情况')
+    return parser
+
 
 def pick_latest_csv(pattern: str):
     files = glob.glob(pattern)
@@ -31,354 +128,2260 @@ def pick_latest_csv(pattern: str):
     files.sort(key=lambda p: os.path.getmtime(p))
     return files[-1]
 
-csv_path = args.csv or pick_latest_csv(args.csv_glob) or 'Ports-20250731.csv'
-if args.debug:
-    print(f'使用的CSV: {csv_path}')
 
+# 设备层级编码，设备在驻留（intern）时按分类规则分类一次
+LAYER_UNKNOWN = 0
+LAYER_CORE = 1
+LAYER_SPINE = 2
+LAYER_LEAF = 3
+LAYER_NAMES = ('unknown', 'core', 'spine', 'leaf')
+
+
+# 设备分类规则（--rules 指定的 JSON 文件）：层级、POD、机柜与排均为对设备名的正则搜索。
+# 层级的值可为单个正则或列表；未在文件中给出的键沿用默认值（与现网命名一致）
+DEFAULT_RULES_SPEC = {
+    'layers': {'core': 'IBCR', 'spine': 'IBSP', 'leaf': 'IBLF'},
+    'pod': r'POD\d+',  # POD1 不会匹配 POD10 的设备（\d+ 取完整编号）
+    'rack': None,
+    'row': None,
+    'ignore_case': False,
+}
+
+
+class ClassificationRules:
+    """编译后的设备分类规则，classify() 返回 (层级编码, POD, 机柜, 排)。
+
+    层级按 core、spine、leaf 的顺序尝试，第一个匹配的生效；POD/机柜/排取正则的第一个捕获组
+    （没有捕获组时取整个匹配），未匹配为空字符串。digest 参与解析缓存键，规则变化后缓存自动失效。
+    """
+
+    def __init__(self, spec=None):
+        spec = dict(DEFAULT_RULES_SPEC, **(spec or {}))
+        unknown = set(spec) - set(DEFAULT_RULES_SPEC)
+        if unknown:
+            raise ValueError(f'未知的规则项: {", ".join(sorted(unknown))}')
+        unknown = set(spec['layers']) - set(LAYER_NAMES[1:])
+        if unknown:
+            raise ValueError(f'未知的层级: {", ".join(sorted(unknown))}（可用 core、spine、leaf）')
+        flags = re.IGNORECASE if spec['ignore_case'] else 0
+        try:
+            self.layer_patterns = []
+            for code in (LAYER_CORE, LAYER_SPINE, LAYER_LEAF):
+                patterns = spec['layers'].get(LAYER_NAMES[code]) or []
+                if isinstance(patterns, str):
+                    patterns = [patterns]
+                if patterns:
+                    self.layer_patterns.append((code, re.compile('|'.join(f'(?:{p})' for p in patterns), flags)))
+            self.pod, self.rack, self.row = (re.compile(spec[key], flags) if spec[key] else None
+                                             for key in ('pod', 'rack', 'row'))
+        except re.error as e:
+            raise ValueError(f'正则无效: {e}') from None
+        self.digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def load(cls, path=None):
+        if path is None:
+            return DEFAULT_RULES
+        with open(path, encoding='utf-8') as f:
+            spec = json.load(f)
+        if not isinstance(spec, dict):
+            raise ValueError(f'{path} 应为 JSON 对象')
+        return cls(spec)
+
+    @staticmethod
+    def _token(pattern, name):
+        m = pattern.search(name) if pattern is not None else None
+        if m is None:
+            return ''
+        return m.group(1) if pattern.groups else m.group(0)
+
+    def classify(self, name):
+        layer = LAYER_UNKNOWN
+        for code, pattern in self.layer_patterns:
+            if pattern.search(name):
+                layer = code
+                break
+        return layer, self._token(self.pod, name), self._token(self.rack, name), self._token(self.row, name)
+
+
+DEFAULT_RULES = ClassificationRules()
+
+
+def pod_sort_key(pod):
+    # 名称中的数字按数值比较：POD2 排在 POD10 之前，自定义规则的 POD 名称不必是 PODn
+    return [int(token) if token.isdigit() else token for token in re.split(r'(\d+)', pod)]
+
+
+@dataclass
+class LayoutOptions:
+    layer_gap: int = 900
+    node_gap: int = 200
+    spine_gap: int = 350
+    leaf_gap: int = 350
+    pod_spacing: Optional[int] = None  # 若为 None，自动计算
+    pod_margin: int = 200
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(layer_gap=args.layer_gap, node_gap=args.node_gap,
+                   spine_gap=args.spine_gap, leaf_gap=args.leaf_gap,
+                   pod_spacing=args.pod_spacing, pod_margin=args.pod_margin)
+
+
+class TopologyGraph:
+    """紧凑的拓扑图：设备名与端口名驻留为整数 ID，链路按列存放在 array 中。
+
+    每条记录对应 CSV 中的一行 (System, Port) -> (Peer Node, Peer Port)，
+    重复的 (System, Port) 以最后一行为准（与原 port_map 的覆盖语义一致）。
+    out_offsets/out_links 与 in_offsets/in_links 是按源设备、目的设备排序的 CSR 邻接索引。
+    device_layer/device_pod/device_rack/device_row 是驻留时的分类结果（见 ClassificationRules），
+    后续各阶段只读这些列，不再检查设备名。
+    """
+
+    # 由列数组派生的索引，可随图一起序列化（见 ParseCache）
+    INDEX_FIELDS = ('peer_link', 'out_offsets', 'out_links', 'in_offsets', 'in_links',
+                    'in_chain', 'leaf_spine_links', 'core_spine_links')
+
+    def __init__(self, device_names, device_layer, port_names,
+                 src, src_port, dst, dst_port, device_pod=None, device_rack=None, device_row=None, index=None):
+        self.device_names = device_names
+        self.device_ids = {name: i for i, name in enumerate(device_names)}
+        self.device_layer = device_layer
+        # 全为空字符串的列序列化后可能为空列表，按设备数补齐
+        self.device_pod = device_pod or [''] * len(device_names)
+        self.device_rack = device_rack or [''] * len(device_names)
+        self.device_row = device_row or [''] * len(device_names)
+        self.port_names = port_names
+        self.src = src
+        self.src_port = src_port
+        self.dst = dst
+        self.dst_port = dst_port
+        if index is None:
+            self.peer_link = array('i', [-1]) * len(src)
+            self._index()
+        else:
+            for name in self.INDEX_FIELDS:
+                setattr(self, name, index[name])
+
+    @property
+    def num_links(self):
+        return len(self.src)
+
+    def _index(self):
+        n_dev = len(self.device_names)
+        n_port = len(self.port_names)
+        src, src_port, dst, dst_port = self.src, self.src_port, self.dst, self.dst_port
+        # peer_link[i]：以记录 i 的对端端口为起点的记录（用于追溯三设备链路），不存在为 -1
+        by_endpoint = {src[i] * n_port + src_port[i]: i for i in range(len(src))}
+        peer_link = self.peer_link
+        for i in range(len(src)):
+            peer_link[i] = by_endpoint.get(dst[i] * n_port + dst_port[i], -1)
+        del by_endpoint
+        self.out_offsets, self.out_links = _csr(src, n_dev)
+        self.in_offsets, self.in_links = _csr(dst, n_dev)
+
+        layer = self.device_layer
+        # 追溯三设备链路：参与任一含已识别层级设备的链路的设备才计入拓扑
+        in_chain = bytearray(n_dev)
+        for i in range(len(src)):
+            j = peer_link[i]
+            if j < 0:
+                continue
+            a, b, c = src[i], dst[i], dst[j]
+            if layer[a] or layer[b] or layer[c]:
+                in_chain[a] = in_chain[b] = in_chain[c] = 1
+        self.in_chain = in_chain
+
+        # 所有 leaf-spine 直连边与 core-spine 边（保留端口信息，正反向只保留先出现的一条）
+        self.leaf_spine_links = array('i')
+        self.core_spine_links = array('i')
+        for i in range(len(src)):
+            pair = {layer[src[i]], layer[dst[i]]}
+            if pair == {LAYER_LEAF, LAYER_SPINE}:
+                bucket = self.leaf_spine_links
+            elif pair == {LAYER_CORE, LAYER_SPINE}:
+                bucket = self.core_spine_links
+            else:
+                continue
+            j = peer_link[i]
+            if j >= 0 and j < i and peer_link[j] == i:
+                continue
+            bucket.append(i)
+
+    def devices_in_layer(self, layer_code):
+        names = self.device_names
+        ids = [d for d in range(len(names))
+               if self.device_layer[d] == layer_code and self.in_chain[d]]
+        ids.sort(key=names.__getitem__)
+        return ids
+
+    @property
+    def core_list(self):
+        return [self.device_names[d] for d in self.devices_in_layer(LAYER_CORE)]
+
+    @property
+    def spine_list(self):
+        return [self.device_names[d] for d in self.devices_in_layer(LAYER_SPINE)]
+
+    @property
+    def leaf_list(self):
+        return [self.device_names[d] for d in self.devices_in_layer(LAYER_LEAF)]
+
+    def device_class(self, name):
+        """设备驻留时的分类结果 (层级编码, POD, 机柜, 排)，可直接作为 GraphBuilder 的 classify。"""
+        d = self.device_ids[name]
+        return self.device_layer[d], self.device_pod[d], self.device_rack[d], self.device_row[d]
+
+    def link(self, i):
+        """返回记录 i 的 (System, Port, Peer Node, Peer Port) 字符串元组。"""
+        names, ports = self.device_names, self.port_names
+        return (names[self.src[i]], ports[self.src_port[i]],
+                names[self.dst[i]], ports[self.dst_port[i]])
+
+    def links_of(self, dev_id):
+        """设备作为 System 或 Peer Node 出现的所有记录下标。"""
+        out = self.out_links[self.out_offsets[dev_id]:self.out_offsets[dev_id + 1]]
+        inc = self.in_links[self.in_offsets[dev_id]:self.in_offsets[dev_id + 1]]
+        return list(out) + [i for i in inc if self.src[i] != dev_id]
+
+
+def _csr(keys, n):
+    # 计数排序生成 CSR：offsets[k]..offsets[k+1] 为 keys 等于 k 的记录下标
+    offsets = array('i', [0]) * (n + 1)
+    for k in keys:
+        offsets[k + 1] += 1
+    for k in range(n):
+        offsets[k + 1] += offsets[k]
+    cursor = array('i', offsets)
+    links = array('i', [0]) * len(keys)
+    for i, k in enumerate(keys):
+        links[cursor[k]] = i
+        cursor[k] += 1
+    return offsets, links
+
+
+class GraphBuilder:
+    """逐行接收端口记录，驻留设备名/端口名并写入列数组，最后生成 TopologyGraph。
+
+    classify(设备名) 在设备首次出现时调用一次，默认为 DEFAULT_RULES.classify。
+    """
+
+    def __init__(self, classify=None):
+        self.classify = classify or DEFAULT_RULES.classify
+        self.device_names = []
+        self.device_ids = {}
+        self.device_layer = array('b')
+        self.device_pod = []
+        self.device_rack = []
+        self.device_row = []
+        self.port_names = []
+        self.port_ids = {}
+        self.src = array('i')
+        self.src_port = array('i')
+        self.dst = array('i')
+        self.dst_port = array('i')
+        self._records = {}  # (设备ID, 端口ID) -> 记录下标，仅构建期使用
+        self.duplicates = []
+
+    def device_id(self, name):
+        dev_id = self.device_ids.get(name)
+        if dev_id is None:
+            dev_id = self.device_ids[name] = len(self.device_names)
+            self.device_names.append(name)
+            layer, pod, rack, row = self.classify(name)
+            self.device_layer.append(layer)
+            self.device_pod.append(pod)
+            self.device_rack.append(rack)
+            self.device_row.append(row)
+        return dev_id
+
+    def port_id(self, name):
+        port_id = self.port_ids.get(name)
+        if port_id is None:
+            port_id = self.port_ids[name] = len(self.port_names)
+            self.port_names.append(name)
+        return port_id
+
+    def add(self, sys_name, port, peer, peer_port):
+        a, pa = self.device_id(sys_name), self.port_id(port)
+        b, pb = self.device_id(peer), self.port_id(peer_port)
+        i = self._records.get((a, pa))
+        if i is None:
+            self._records[(a, pa)] = len(self.src)
+            self.src.append(a)
+            self.src_port.append(pa)
+            self.dst.append(b)
+            self.dst_port.append(pb)
+        else:
+            names, ports = self.device_names, self.port_names
+            self.duplicates.append((sys_name, port, names[self.dst[i]], ports[self.dst_port[i]], peer, peer_port))
+            self.dst[i] = b
+            self.dst_port[i] = pb
+
+    def build(self):
+        self._records = {}
+        return TopologyGraph(self.device_names, self.device_layer, self.port_names,
+                             self.src, self.src_port, self.dst, self.dst_port,
+                             self.device_pod, self.device_rack, self.device_row)
+
+
+@dataclass
+class PodIndex:
+    """一次遍历建立的 POD 索引：设备与链路按所属 POD 分桶（桶下标与 pods_only 对应）。"""
+    pods_only: List[str]
+    pod_of: array  # 设备ID -> POD 下标，不属于任何 POD 为 -1
+    spine_ids: List[List[int]]
+    leaf_ids: List[List[int]]
+    leaf_spine_links: List[array]
+    core_spine_links: List[array]
+
+
+@dataclass
+class PodPartition:
+    """POD 划分阶段的结果：与布局无关的 POD 成员；各 POD 的链路见 pod_index。"""
+    pod_names: List[str]  # 含 "ALL"
+    pods_only: List[str]
+    pod_color_map: Dict[str, str]
+    pod_index: PodIndex
+    pod_spines: Dict[str, List[str]]
+    pod_leaves: Dict[str, List[str]]
+
+
+@dataclass
+class TopologyLayout:
+    """布局阶段的结果：各层纵坐标以及按列存放的节点横坐标（与 core_list / pod_spines / pod_leaves 一一对应）。"""
+    options: LayoutOptions
+    layer_y: Dict[str, float]
+    core_list: List[str]
+    core_x: List[float]
+    pod_x: Dict[str, float]
+    pod_spine_x: Dict[str, List[float]]
+    pod_leaf_x: Dict[str, List[float]]
+    pod_container_width_map: Dict[str, float] = field(default_factory=dict)
+    pod_spacing_effective: float = 0
+
+
+CSV_COLUMNS = ('System', 'Port', 'Peer Node', 'Peer Port')
+
+
+@dataclass
+class IngestReport:
+    """CSV 读取统计：有效行数、未连接端口数以及格式错误的行（保留前若干条样例）。"""
+    rows: int = 0
+    disconnected: int = 0
+    malformed: int = 0
+    samples: List[str] = field(default_factory=list)
+    max_samples: int = 20
+    # 重复出现的 (System, Port)：(System, Port, 被覆盖的对端, 对端端口, 保留的对端, 对端端口)
+    duplicates: List[tuple] = field(default_factory=list)
+
+    def add_malformed(self, line_no, reason):
+        self.malformed += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append(f'第 {line_no} 行: {reason}')
+
+
+def open_port_csv(csv_path):
+    # 按扩展名透明解压；'-' 表示从标准输入读取。utf-8-sig 自动去除 BOM
+    if csv_path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    if csv_path.endswith('.gz'):
+        return gzip.open(csv_path, 'rt', encoding='utf-8-sig', newline='')
+    if csv_path.endswith('.xz'):
+        return lzma.open(csv_path, 'rt', encoding='utf-8-sig', newline='')
+    if csv_path.endswith('.bz2'):
+        return bz2.open(csv_path, 'rt', encoding='utf-8-sig', newline='')
+    return open(csv_path, encoding='utf-8-sig', newline='')
+
+
+# 1. 解析 CSV：流式逐行产出 (System, Port, Peer Node, Peer Port)，不在内存中保留整行数据
+def read_port_rows(csv_path, report=None):
+    report = report if report is not None else IngestReport()
+    f = open_port_csv(csv_path)
+    try:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        header = [h.strip() for h in header]
+        missing = [c for c in CSV_COLUMNS if c not in header]
+        if missing:
+            raise ValueError(f'{csv_path} 缺少必需的列: {", ".join(missing)}')
+        i_sys, i_port, i_peer, i_peer_port = (header.index(c) for c in CSV_COLUMNS)
+        width = max(i_sys, i_port, i_peer, i_peer_port) + 1
+        for row in reader:
+            if not row:
+                continue
+            if len(row) < width:
+                report.add_malformed(reader.line_num, f'列数不足（{len(row)} < {width}）')
+                continue
+            sys_name = row[i_sys].strip()
+            port = row[i_port].strip()
+            if not sys_name or not port:
+                report.add_malformed(reader.line_num, 'System 或 Port 为空')
+                continue
+            peer = row[i_peer].strip()
+            if not peer:
+                report.disconnected += 1
+                continue
+            report.rows += 1
+            yield sys_name, port, peer, row[i_peer_port].strip()
+    finally:
+        if csv_path == '-':
+            f.detach()
+        else:
+            f.close()
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class RunMetrics:
+    """各阶段的耗时与内存峰值，以及元素数与输出大小（--profile / --metrics-json）。
+
+    peak_rss_mb 是进程 RSS 峰值，随阶段单调不减，上涨处即内存增长的阶段；
+    tracemalloc 开启时另记录阶段内 Python 分配的峰值 traced_peak_mb。
+    enabled=False 时 stage() 不做任何记录。
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.csv = None
+        self.stages = []
+        self.counts = {}
+        self.outputs = {}
+        self.allocations = []  # --profile 时 tracemalloc 统计的主要分配位置
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        tracing = tracemalloc.is_tracing()
+        if tracing and hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = {'stage': name, 'seconds': round(time.perf_counter() - start, 4), 'peak_rss_mb': peak_rss_mb()}
+            if tracing:
+                entry['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            self.stages.append(entry)
+
+    def record_page(self, graph, page, output):
+        if not self.enabled:
+            return
+        index = page.partition.pod_index
+        pods = {}
+        for k, pod in enumerate(page.partition.pods_only):
+            spines, leaves = len(page.partition.pod_spines[pod]), len(page.partition.pod_leaves[pod])
+            pods[pod] = {'spines': spines, 'leaves': leaves, 'nodes': 1 + spines + leaves,
+                         'edges': len(index.leaf_spine_links[k]),
+                         'core_spine_edges': len(index.core_spine_links[k])}
+        self.counts = {'devices': len(graph.device_names), 'links': graph.num_links,
+                       'cores': len(graph.core_list), 'pods': pods}
+        self.outputs = {'html_bytes': os.path.getsize(output)}
+        if page.shard_dir:
+            self.outputs['shard_bytes'] = sum(entry.stat().st_size for entry in os.scandir(page.shard_dir))
+        if page.render_stats.get('raw_bytes'):
+            self.outputs['payload_raw_bytes'] = page.render_stats['raw_bytes']
+            self.outputs['payload_embedded_bytes'] = page.render_stats['embedded_bytes']
+
+    def to_dict(self):
+        result = {'csv': self.csv, 'stages': self.stages,
+                  'total_seconds': round(sum(s['seconds'] for s in self.stages), 4),
+                  'counts': self.counts, 'outputs': self.outputs}
+        if self.allocations:
+            result['top_allocations'] = self.allocations
+        return result
+
+
+# 2. 构建图：驻留设备/端口并建立邻接索引，追溯三设备链路并按层统计设备
+def build_graph(rows, metrics=None, report=None, rules=None):
+    metrics = metrics or RunMetrics(enabled=False)
+    builder = GraphBuilder((rules or DEFAULT_RULES).classify)
+    with metrics.stage('csv_load'):
+        for sys_name, port, peer, peer_port in rows:
+            builder.add(sys_name, port, peer, peer_port)
+    if report is not None:
+        report.duplicates = builder.duplicates
+    with metrics.stage('chain_tracing'):
+        return builder.build()
+
+
+# 解析缓存：以 CSV 内容哈希 + 解析器版本 + 分类规则摘要为键，将去重后的图以紧凑二进制格式存盘
+PARSER_VERSION = 3
+CACHE_MAGIC = b'UFMTOPO\0'
+_CACHE_STR_FIELDS = ('device_names', 'port_names', 'device_pod', 'device_rack', 'device_row')
+_CACHE_ARRAY_FIELDS = ('device_layer', 'src', 'src_port', 'dst', 'dst_port')
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ufm-topology')
+
+
+def dump_graph(graph, meta=None):
+    meta = dict(meta or {}, byteorder=sys.byteorder)
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    chunks = [CACHE_MAGIC, struct.pack('<II', PARSER_VERSION, len(meta_bytes)), meta_bytes]
+    sections = [(name, 's', '\0'.join(getattr(graph, name)).encode('utf-8'))
+                for name in _CACHE_STR_FIELDS]
+    for name in _CACHE_ARRAY_FIELDS + TopologyGraph.INDEX_FIELDS:
+        value = getattr(graph, name)
+        typecode = value.typecode if isinstance(value, array) else 'B'
+        sections.append((name, typecode, bytes(value)))
+    for name, typecode, data in sections:
+        name_bytes = name.encode('ascii')
+        chunks.append(struct.pack('<B', len(name_bytes)) + name_bytes)
+        chunks.append(struct.pack('<cQ', typecode.encode('ascii'), len(data)))
+        chunks.append(data)
+    return b''.join(chunks)
+
+
+def load_graph_bytes(data):
+    """反序列化 dump_graph 的输出，返回 (graph, meta)；格式或版本不符时返回 None。"""
+    view = memoryview(data)
+    if bytes(view[:len(CACHE_MAGIC)]) != CACHE_MAGIC:
+        return None
+    pos = len(CACHE_MAGIC)
+    version, meta_len = struct.unpack_from('<II', view, pos)
+    pos += 8
+    if version != PARSER_VERSION:
+        return None
+    meta = json.loads(bytes(view[pos:pos + meta_len]).decode('utf-8'))
+    pos += meta_len
+    if meta.get('byteorder') != sys.byteorder:
+        return None
+    fields = {}
+    while pos < len(view):
+        name_len = view[pos]
+        name = bytes(view[pos + 1:pos + 1 + name_len]).decode('ascii')
+        pos += 1 + name_len
+        typecode, size = struct.unpack_from('<cQ', view, pos)
+        pos += struct.calcsize('<cQ')
+        raw = view[pos:pos + size]
+        pos += size
+        typecode = typecode.decode('ascii')
+        if typecode == 's':
+            text = bytes(raw).decode('utf-8')
+            fields[name] = text.split('\0') if text else []
+        elif typecode == 'B':
+            fields[name] = bytearray(raw)
+        else:
+            values = array(typecode)
+            values.frombytes(raw)
+            fields[name] = values
+    graph = TopologyGraph(
+        fields['device_names'], fields['device_layer'], fields['port_names'],
+        fields['src'], fields['src_port'], fields['dst'], fields['dst_port'],
+        fields['device_pod'], fields['device_rack'], fields['device_row'],
+        index={name: fields[name] for name in TopologyGraph.INDEX_FIELDS})
+    return graph, meta
+
+
+class ParseCache:
+    """磁盘解析缓存，总大小超过上限时按最近使用时间淘汰。"""
+
+    def __init__(self, cache_dir=None, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key_for(csv_path, rules=None):
+        digest = hashlib.sha256()
+        with open(csv_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(f'parser-v{PARSER_VERSION}'.encode('ascii'))
+        digest.update(f'rules-{(rules or DEFAULT_RULES).digest}'.encode('ascii'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.bin')
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                loaded = load_graph_bytes(f.read())
+            os.utime(path)  # 刷新最近使用时间
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+        return loaded
+
+    def store(self, key, graph, meta=None):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(dump_graph(graph, meta))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.bin'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # 批量模式下可能已被其他进程淘汰
+                pass
+            total -= size
+
+
+def load_graph(csv_path, cache=None, rebuild_cache=False, report=None, metrics=None, rules=None, key=None):
+    """解析 CSV 并构建图，可选地经过解析缓存。返回 (graph, report, 缓存状态)。
 
-def get_device_layer(device_name):
-    if 'IBCR' in device_name:
-        return 'core'
-    elif 'IBSP' in device_name:
-        return 'spine'
-    elif 'IBLF' in device_name:
-        return 'leaf'
+    缓存状态为 'hit'、'miss'、'rebuilt' 或 'disabled'（未启用缓存或从标准输入读取）。
+    key 为调用方已算好的 ParseCache.key_for(csv_path, rules)，避免重复读取并哈希整个文件。
+    """
+    report = report if report is not None else IngestReport()
+    metrics = metrics or RunMetrics(enabled=False)
+    if cache is None or csv_path == '-':
+        return build_graph(read_port_rows(csv_path, report), metrics, report, rules), report, 'disabled'
+    with metrics.stage('cache_lookup'):
+        key = key or cache.key_for(csv_path, rules)
+        loaded = None if rebuild_cache else cache.load(key)
+    if loaded is not None:
+        graph, meta = loaded
+        cached = meta.get('report', {})
+        report.rows = cached.get('rows', 0)
+        report.disconnected = cached.get('disconnected', 0)
+        report.malformed = cached.get('malformed', 0)
+        report.samples = cached.get('samples', [])
+        report.duplicates = [tuple(d) for d in cached.get('duplicates', [])]
+        return graph, report, 'hit'
+    graph = build_graph(read_port_rows(csv_path, report), metrics, report, rules)
+    meta = {'source': os.path.basename(csv_path),
+            'report': {'rows': report.rows, 'disconnected': report.disconnected,
+                       'malformed': report.malformed, 'samples': report.samples,
+                       'duplicates': report.duplicates}}
+    try:
+        with metrics.stage('cache_store'):
+            cache.store(key, graph, meta)
+    except OSError as e:
+        print(f'警告: 写入解析缓存失败: {e}', file=sys.stderr)
+    return graph, report, 'rebuilt' if rebuild_cache else 'miss'
+
+
+# 历史库（--history-db）：每份导出存为一个快照，链路按 [首个快照, 最后快照] 区间存放，
+# 与上一快照相同的记录只延长区间，不重复存储；snapshots.link_order 记下本快照各记录在 CSV 中的顺序
+HISTORY_SCHEMA_VERSION = 2
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    taken_at TEXT NOT NULL,
+    source TEXT,
+    content_key TEXT,
+    records INTEGER NOT NULL,
+    link_order BLOB
+);
+CREATE INDEX IF NOT EXISTS snapshots_taken_at ON snapshots (taken_at);
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    layer TEXT NOT NULL,
+    pod TEXT
+);
+CREATE INDEX IF NOT EXISTS devices_pod ON devices (pod);
+CREATE TABLE IF NOT EXISTS ports (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS links (
+    id INTEGER PRIMARY KEY,
+    device_id INTEGER NOT NULL REFERENCES devices (id),
+    port_id INTEGER NOT NULL REFERENCES ports (id),
+    peer_id INTEGER NOT NULL REFERENCES devices (id),
+    peer_port_id INTEGER NOT NULL REFERENCES ports (id),
+    first_snapshot INTEGER NOT NULL REFERENCES snapshots (id),
+    last_snapshot INTEGER NOT NULL REFERENCES snapshots (id)
+);
+CREATE INDEX IF NOT EXISTS links_endpoint ON links (device_id, port_id);
+CREATE INDEX IF NOT EXISTS links_peer ON links (peer_id, peer_port_id);
+CREATE INDEX IF NOT EXISTS links_last ON links (last_snapshot);
+"""
+
+
+def encode_link_order(link_ids):
+    # 链路编号按记录顺序做差分后以小端 int64 存放并压缩；多数相邻记录编号连续，压缩后很小
+    deltas = array('q', (b - a for a, b in zip(chain((0,), link_ids), link_ids)))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return zlib.compress(bytes(deltas), 6)
+
+
+def decode_link_order(blob):
+    deltas = array('q', zlib.decompress(blob))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    link_ids = []
+    current = 0
+    for delta in deltas:
+        current += delta
+        link_ids.append(current)
+    return link_ids
+
+
+class HistoryStore:
+    """SQLite 拓扑历史库。快照只能按时间顺序追加；链路记录 (System, Port) -> (Peer Node, Peer Port)
+    在连续快照中不变时共用一行，last_snapshot 随之延长。"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA cache_size = -65536')  # 64 MB 页缓存，大快照写入索引时明显更快
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, 1, HISTORY_SCHEMA_VERSION):
+            self.conn.close()
+            raise ValueError(f'{path} 的历史库版本 {version} 不受支持')
+        with self.conn:
+            self.conn.executescript(HISTORY_SCHEMA)
+            if version == 1:  # 版本 1 的快照没有记录顺序，读取时退回按链路编号排序
+                self.conn.execute('ALTER TABLE snapshots ADD COLUMN link_order BLOB')
+            self.conn.execute(f'PRAGMA user_version = {HISTORY_SCHEMA_VERSION}')
+
+    def close(self):
+        self.conn.close()
+
+    def snapshots(self):
+        """[(编号, 时间, 来源, 记录数)]，按编号排序。"""
+        return self.conn.execute('SELECT id, taken_at, source, records FROM snapshots ORDER BY id').fetchall()
+
+    def _intern(self, table, rows, columns):
+        # name 以外的列（设备的层级与 POD）随最新一次分类更新，--rules 变化后不会停留在首次入库时的结果
+        sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) ON CONFLICT (name) DO '
+        updated = [c for c in columns if c != 'name']
+        if updated:
+            sql += (f'UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in updated)} '
+                    f'WHERE {" OR ".join(f"{c} IS NOT excluded.{c}" for c in updated)}')
+        else:
+            sql += 'NOTHING'
+        self.conn.executemany(sql, rows)
+        return dict(self.conn.execute(f'SELECT name, id FROM {table}'))
+
+    def ingest(self, graph, taken_at, source=None, content_key=None):
+        """存入一个快照，返回 (快照编号, 统计)；与最新快照内容相同时不新建快照，统计为 None。"""
+        latest = self.conn.execute('SELECT id, taken_at, content_key FROM snapshots ORDER BY id DESC LIMIT 1').fetchone()
+        if latest is not None and content_key is not None and latest[2] == content_key:
+            return latest[0], None
+        if latest is not None and taken_at < latest[1]:
+            raise ValueError(f'快照时间 {taken_at} 早于历史库中最新的快照 #{latest[0]}（{latest[1]}），只能按时间顺序追加')
+        names, ports = graph.device_names, graph.port_names
+        with self.conn:
+            snapshot = self.conn.execute(
+                'INSERT INTO snapshots (taken_at, source, content_key, records) VALUES (?, ?, ?, ?)',
+                (taken_at, source, content_key, graph.num_links)).lastrowid
+            device_ids = self._intern('devices', ((name, LAYER_NAMES[graph.device_layer[d]], graph.device_pod[d] or None)
+                                                  for d, name in enumerate(names)), ('name', 'layer', 'pod'))
+            port_ids = self._intern('ports', ((name,) for name in ports), ('name',))
+            dev = [device_ids[name] for name in names]
+            port = [port_ids[name] for name in ports]
+            previous = {}
+            if latest is not None:
+                for row_id, d, p, peer, peer_port in self.conn.execute(
+                        'SELECT id, device_id, port_id, peer_id, peer_port_id FROM links WHERE last_snapshot = ?',
+                        (latest[0],)):
+                    previous[(d, p)] = (row_id, peer, peer_port)
+            unchanged = 0
+            added = []
+            link_order = []
+            next_id = (self.conn.execute('SELECT MAX(id) FROM links').fetchone()[0] or 0) + 1
+            src, src_port, dst, dst_port = graph.src, graph.src_port, graph.dst, graph.dst_port
+            for i in range(graph.num_links):
+                key = (dev[src[i]], port[src_port[i]])
+                peer = (dev[dst[i]], port[dst_port[i]])
+                found = previous.get(key)
+                if found is not None and found[1:] == peer:
+                    unchanged += 1
+                    del previous[key]
+                    link_order.append(found[0])
+                else:
+                    added.append((next_id,) + key + peer + (snapshot, snapshot))
+                    link_order.append(next_id)
+                    next_id += 1
+            if latest is not None:
+                # previous 中剩下的是本快照中已不存在或对端已变的记录，其余记录整体延长到本快照
+                self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS ended_links (id INTEGER PRIMARY KEY)')
+                self.conn.execute('DELETE FROM ended_links')
+                self.conn.executemany('INSERT INTO ended_links (id) VALUES (?)',
+                                      ((row_id,) for row_id, _, _ in previous.values()))
+                self.conn.execute('UPDATE links SET last_snapshot = ? WHERE last_snapshot = ? '
+                                  'AND id NOT IN (SELECT id FROM ended_links)', (snapshot, latest[0]))
+            self.conn.executemany(
+                'INSERT INTO links (id, device_id, port_id, peer_id, peer_port_id, first_snapshot, last_snapshot) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', added)
+            self.conn.execute('UPDATE snapshots SET link_order = ? WHERE id = ?',
+                              (encode_link_order(link_order), snapshot))
+        return snapshot, {'unchanged': unchanged, 'added': len(added), 'ended': len(previous)}
+
+    def resolve(self, spec):
+        """快照编号、latest 或时间（取不晚于该时间的最近快照）-> (编号, 时间)。"""
+        if spec == 'latest':
+            row = self.conn.execute('SELECT id, taken_at FROM snapshots ORDER BY id DESC LIMIT 1').fetchone()
+        elif spec.isdigit():
+            row = self.conn.execute('SELECT id, taken_at FROM snapshots WHERE id = ?', (int(spec),)).fetchone()
+        else:
+            row = self.conn.execute('SELECT id, taken_at FROM snapshots WHERE taken_at <= ? '
+                                    'ORDER BY taken_at DESC, id DESC LIMIT 1', (spec,)).fetchone()
+        if row is None:
+            raise ValueError(f'历史库 {self.path} 中没有快照 {spec}')
+        return row
+
+    def load_graph(self, snapshot, rules=None):
+        """按快照存入时的记录顺序重建图，与直接解析原 CSV 得到的图相同。"""
+        builder = GraphBuilder((rules or DEFAULT_RULES).classify)
+        rows = self.conn.execute(
+            'SELECT l.id, d.name, p.name, pd.name, pp.name FROM links l '
+            'JOIN devices d ON d.id = l.device_id JOIN ports p ON p.id = l.port_id '
+            'JOIN devices pd ON pd.id = l.peer_id JOIN ports pp ON pp.id = l.peer_port_id '
+            'WHERE l.first_snapshot <= ? AND l.last_snapshot >= ? ORDER BY l.id', (snapshot, snapshot))
+        row = self.conn.execute('SELECT link_order FROM snapshots WHERE id = ?', (snapshot,)).fetchone()
+        if row is not None and row[0] is not None:
+            by_id = {record[0]: record for record in rows}
+            rows = (by_id[link_id] for link_id in decode_link_order(row[0]))
+        for _, sys_name, port, peer, peer_port in rows:
+            builder.add(sys_name, port, peer, peer_port)
+        return builder.build()
+
+    def _history(self, where, params):
+        return self.conn.execute(
+            'SELECT d.name, p.name, pd.name, pp.name, l.first_snapshot, l.last_snapshot, sf.taken_at, sl.taken_at '
+            'FROM links l JOIN devices d ON d.id = l.device_id JOIN ports p ON p.id = l.port_id '
+            'JOIN devices pd ON pd.id = l.peer_id JOIN ports pp ON pp.id = l.peer_port_id '
+            'JOIN snapshots sf ON sf.id = l.first_snapshot JOIN snapshots sl ON sl.id = l.last_snapshot '
+            f'WHERE {where} ORDER BY p.name, l.first_snapshot', params).fetchall()
+
+    def port_history(self, device, port):
+        """端口在各快照区间内的对端：[(设备, 端口, 对端, 对端端口, 首快照, 末快照, 首时间, 末时间)]。"""
+        return self._history('l.device_id = (SELECT id FROM devices WHERE name = ?) '
+                             'AND l.port_id = (SELECT id FROM ports WHERE name = ?)', (device, port))
+
+    def device_history(self, device):
+        """设备作为 System 的全部链路区间，以及只以对端身份出现的端口（如未导出的主机）。"""
+        own = self._history('l.device_id = (SELECT id FROM devices WHERE name = ?)', (device,))
+        seen = {row[1] for row in own}
+        peer_rows = self._history('l.peer_id = (SELECT id FROM devices WHERE name = ?)', (device,))
+        mirrored = [(row[2], row[3], row[0], row[1]) + row[4:] for row in peer_rows if row[3] not in seen]
+        return own + sorted(mirrored, key=lambda row: (row[1], row[4]))
+
+
+def snapshot_time(args, csv_path):
+    if args.snapshot_time:
+        return args.snapshot_time
+    mtime = time.time() if csv_path == '-' else os.path.getmtime(csv_path)
+    return datetime.fromtimestamp(mtime, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def ingest_snapshot(args, csv_path, graph, rules=None, content_key=None):
+    """将本次解析结果存入 --history-db，返回一行摘要。"""
+    store = HistoryStore(args.history_db)
+    try:
+        if content_key is None and csv_path != '-':
+            content_key = ParseCache.key_for(csv_path, rules)
+        snapshot, stats = store.ingest(graph, snapshot_time(args, csv_path), os.path.basename(csv_path), content_key)
+    finally:
+        store.close()
+    if stats is None:
+        return f'快照 #{snapshot}（与最新快照内容相同，未新建）'
+    return f'快照 #{snapshot}（沿用 {stats["unchanged"]} 条，新增 {stats["added"]} 条，结束 {stats["ended"]} 条）'
+
+
+def run_history_query(args):
+    """--list-snapshots / --port-history / --device-history。"""
+    store = HistoryStore(args.history_db)
+    try:
+        if args.list_snapshots:
+            for snapshot, taken_at, source, records in store.snapshots():
+                print(f'#{snapshot}  {taken_at}  {source or "-"}（链路记录 {records} 条）')
+            return 0
+        if args.port_history:
+            rows = store.port_history(*args.port_history)
+            title = f'{args.port_history[0]}:{args.port_history[1]}'
+        else:
+            rows = store.device_history(args.device_history)
+            title = args.device_history
+        if not rows:
+            print(f'错误: 历史库中没有 {title} 的记录', file=sys.stderr)
+            return 1
+        print(f'{title} 的历史（快照区间: 对端）:')
+        previous = {}
+        for device, port, peer, peer_port, first, last, first_at, last_at in rows:
+            before = previous.get(port)
+            if before is None:
+                change = ''
+            elif first > before + 1:
+                gap = f'#{before + 1}' if first == before + 2 else f'#{before + 1}–#{first - 1}'
+                change = f'（快照 {gap} 中无记录）'
+            else:
+                change = '（对端变更）'
+            previous[port] = last
+            print(f'  {device}:{port}  #{first} {first_at} ~ #{last} {last_at}: {peer}:{peer_port}{change}')
+        return 0
+    finally:
+        store.close()
+
+
+# 布线校验（--validate）：一次遍历链路记录，找出不对称/重复/冲突的端口与不符合三层结构的链路
+VALIDATION_KINDS = {
+    # 类型: (级别, 说明)
+    'duplicate_port': ('error', '同一 (System, Port) 出现在多行且对端不同，只保留了最后一行'),
+    'duplicate_row': ('warning', '同一 (System, Port) 的重复行'),
+    'asymmetric_peer': ('error', 'A→B 的对端端口记录没有指回 A'),
+    'missing_mirror': ('warning', '对端设备在导出中，但对端端口没有记录'),
+    'port_cabled_twice': ('error', '同一端口被多条记录作为对端'),
+    'unknown_switch': ('error', '未识别层级（名称不匹配分类规则）的设备连接了 Spine 或 Core'),
+    'unknown_device': ('warning', '未识别层级的设备未连接任何 Core/Spine/Leaf，不会出现在拓扑中'),
+    'same_layer': ('warning', '同层交换机之间的链路'),
+    'leaf_core': ('error', 'Leaf 直连 Core'),
+    'cross_pod': ('error', 'Leaf 与其他 POD 的 Spine 相连'),
+}
+EXIT_VALIDATION_ERRORS = 3
+EXIT_VALIDATION_WARNINGS = 4  # 仅在 --strict 时
+
+
+@dataclass
+class ValidationReport:
+    """校验结果：issues 每项含 kind、severity、device、port、peer、peer_port；stats 为总体计数。"""
+    issues: List[dict]
+    stats: Dict[str, int]
+
+    def counts(self):
+        counts = {}
+        for issue in self.issues:
+            counts[issue['kind']] = counts.get(issue['kind'], 0) + 1
+        return counts
+
+    def severity_count(self, severity):
+        return sum(1 for issue in self.issues if issue['severity'] == severity)
+
+    def exit_code(self, strict=False):
+        if self.severity_count('error'):
+            return EXIT_VALIDATION_ERRORS
+        if strict and self.issues:
+            return EXIT_VALIDATION_WARNINGS
+        return 0
+
+    def to_dict(self):
+        return {
+            'summary': dict(self.stats, errors=self.severity_count('error'),
+                            warnings=self.severity_count('warning'), by_kind=self.counts()),
+            'issues': self.issues,
+        }
+
+
+def validate_graph(graph, report=None):
+    names, ports, layer = graph.device_names, graph.port_names, graph.device_layer
+    src, src_port, dst, dst_port, peer_link = graph.src, graph.src_port, graph.dst, graph.dst_port, graph.peer_link
+    out_offsets = graph.out_offsets
+    n_port = len(ports)
+    issues = []
+
+    def issue(kind, device, port=None, peer=None, peer_port=None):
+        issues.append({'kind': kind, 'severity': VALIDATION_KINDS[kind][0], 'device': device, 'port': port,
+                       'peer': peer, 'peer_port': peer_port})
+
+    def record_issue(kind, i):
+        issue(kind, names[src[i]], ports[src_port[i]], names[dst[i]], ports[dst_port[i]])
+
+    for sys_name, port, old_peer, old_peer_port, peer, peer_port in (report.duplicates if report else ()):
+        if (old_peer, old_peer_port) == (peer, peer_port):
+            issue('duplicate_row', sys_name, port, peer, peer_port)
+        else:
+            issue('duplicate_port', sys_name, port, peer, peer_port)
+            issues[-1]['overwritten_peer'] = [old_peer, old_peer_port]
+
+    pods = {}
+    for d in range(len(names)):
+        if layer[d] in (LAYER_SPINE, LAYER_LEAF):
+            pods[d] = graph.device_pod[d] or None
+    switch_peers = bytearray(len(names))  # 未识别设备：1 连接了 Leaf，2 连接了 Spine/Core
+    targeted = {}
+    not_exported = 0
+    links = 0
+    for i in range(graph.num_links):
+        a, b = src[i], dst[i]
+        j = peer_link[i]
+        # 镜像：对端端口的记录必须指回本端口；对端设备完全不在导出中时（如未导出的主机）不计为问题
+        if j < 0:
+            if out_offsets[b] == out_offsets[b + 1]:
+                not_exported += 1
+            else:
+                record_issue('missing_mirror', i)
+        elif dst[j] != a or dst_port[j] != src_port[i]:
+            record_issue('asymmetric_peer', i)
+        endpoint = b * n_port + dst_port[i]
+        if endpoint in targeted:
+            record_issue('port_cabled_twice', i)
+        else:
+            targeted[endpoint] = i
+        if j >= 0 and j < i and peer_link[j] == i:
+            continue  # 以下按物理链路检查，正反两条记录只看一次
+        links += 1
+        la, lb = layer[a], layer[b]
+        if not la or not lb:
+            unknown, other = (a, lb) if not la else (b, la)
+            if other:
+                switch_peers[unknown] = max(switch_peers[unknown], 1 if other == LAYER_LEAF else 2)
+            continue
+        if la == lb:
+            record_issue('same_layer', i)
+        elif {la, lb} == {LAYER_LEAF, LAYER_CORE}:
+            record_issue('leaf_core', i)
+        elif {la, lb} == {LAYER_LEAF, LAYER_SPINE} and pods[a] != pods[b]:
+            record_issue('cross_pod', i)
+    hosts = 0
+    for d in range(len(names)):
+        if layer[d]:
+            continue
+        if switch_peers[d] == 1:
+            hosts += 1
+        else:
+            issue('unknown_switch' if switch_peers[d] == 2 else 'unknown_device', names[d])
+    stats = {'records': graph.num_links, 'links': links, 'devices': len(names), 'hosts': hosts,
+             'peers_not_exported': not_exported}
+    return ValidationReport(issues=issues, stats=stats)
+
+
+# 路径查询：设备级无向邻接索引上惰性枚举路径，按层动态规划统计 ECMP（--query-paths / --query-ecmp）
+class PathIndex:
+    """设备级无向邻接（CSR）：adj_nodes 为相邻设备，adj_links 为两设备间的物理链路数（镜像记录只计一次）。
+
+    只有 Core/Spine/Leaf 可作为路径的中间设备，主机等其他设备只能作为端点。
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        n = len(graph.device_names)
+        src, dst, peer_link = graph.src, graph.dst, graph.peer_link
+        pairs = {}
+        for i in range(len(src)):
+            j = peer_link[i]
+            if j >= 0 and j < i and peer_link[j] == i:
+                continue
+            a, b = src[i], dst[i]
+            if a != b:
+                key = (a, b) if a < b else (b, a)
+                pairs[key] = pairs.get(key, 0) + 1
+        heads, tails, counts = array('i'), array('i'), array('i')
+        for (a, b), count in pairs.items():
+            heads += array('i', (a, b))
+            tails += array('i', (b, a))
+            counts += array('i', (count, count))
+        self.adj_offsets, order = _csr(heads, n)
+        self.adj_nodes = array('i', (tails[k] for k in order))
+        self.adj_links = array('i', (counts[k] for k in order))
+        self.transit = bytearray(1 if layer != LAYER_UNKNOWN else 0 for layer in graph.device_layer)
+
+    def device_id(self, name):
+        dev_id = self.graph.device_ids.get(name)
+        if dev_id is None:
+            raise KeyError(f'未找到设备: {name}')
+        return dev_id
+
+    def neighbors(self, dev_id):
+        for k in range(self.adj_offsets[dev_id], self.adj_offsets[dev_id + 1]):
+            yield self.adj_nodes[k], self.adj_links[k]
+
+    def links_between(self, a, b):
+        for nb, count in self.neighbors(a):
+            if nb == b:
+                return count
+        return 0
+
+    def _distances(self, target, max_hops):
+        # 自 target 反向 BFS；中间设备才继续扩展
+        dist = {target: 0}
+        frontier = [target]
+        for hops in range(1, max_hops + 1):
+            next_frontier = []
+            for node in frontier:
+                if node != target and not self.transit[node]:
+                    continue
+                for nb, _ in self.neighbors(node):
+                    if nb not in dist:
+                        dist[nb] = hops
+                        next_frontier.append(nb)
+            frontier = next_frontier
+        return dist
+
+    def _walk(self, s, t, length, dist):
+        # 长度恰为 length 的简单路径；只沿剩余跳数内能到达 t 的邻居前进
+        path = [s]
+        on_path = {s}
+
+        def extend(node, remaining):
+            if remaining == 0:
+                if node == t:
+                    yield list(path)
+                return
+            if node == t or (node != s and not self.transit[node]):
+                return
+            for nb, _ in self.neighbors(node):
+                if nb in on_path or dist.get(nb, remaining) > remaining - 1:
+                    continue
+                path.append(nb)
+                on_path.add(nb)
+                yield from extend(nb, remaining - 1)
+                path.pop()
+                on_path.discard(nb)
+
+        return extend(s, length)
+
+    def paths(self, src, dst, max_hops=4, via=None):
+        """按跳数从少到多惰性生成 src 到 dst 的简单路径（设备 ID 列表）；via 为必须经过的设备。"""
+        s, t = self.device_id(src), self.device_id(dst)
+        if via is None:
+            dist = self._distances(t, max_hops)
+            if s not in dist:
+                return
+            for length in range(dist[s], max_hops + 1):
+                yield from self._walk(s, t, length, dist)
+            return
+        v = self.device_id(via)
+        to_via, to_dst = self._distances(v, max_hops), self._distances(t, max_hops)
+        if s not in to_via or v not in to_dst:
+            return
+        for length in range(to_via[s] + to_dst[v], max_hops + 1):
+            for first in range(to_via[s], length - to_dst[v] + 1):
+                for head in self._walk(s, v, first, to_via):
+                    seen = set(head[:-1])
+                    for tail in self._walk(v, t, length - first, to_dst):
+                        if seen.isdisjoint(tail):
+                            yield head + tail[1:]
+
+    def path_links(self, path):
+        """路径上每一跳的物理链路数。"""
+        return [self.links_between(a, b) for a, b in zip(path, path[1:])]
+
+    def _shortest_counts(self, s, targets, max_hops):
+        # 自 s 按层 BFS，累加到达每台设备的最短路径数（设备级与物理链路级）；targets 全部到达后停止
+        dist = {s: 0}
+        paths = {s: 1}
+        link_paths = {s: 1}
+        frontier = [s]
+        pending = set(targets)
+        for hops in range(1, max_hops + 1):
+            if not pending or not frontier:
+                break
+            next_frontier = []
+            for node in frontier:
+                if node != s and not self.transit[node]:
+                    continue
+                for nb, count in self.neighbors(node):
+                    if nb not in dist:
+                        dist[nb] = hops
+                        paths[nb] = link_paths[nb] = 0
+                        next_frontier.append(nb)
+                    if dist[nb] == hops:
+                        paths[nb] += paths[node]
+                        link_paths[nb] += link_paths[node] * count
+            pending.difference_update(next_frontier)
+            frontier = next_frontier
+        return {t: (dist[t], paths[t], link_paths[t]) for t in targets if t in dist}
+
+    def ecmp(self, src, dst, max_hops=8):
+        """最短路径的 (跳数, 设备级路径数, 物理链路级路径数)，只计数不枚举；不可达时返回 None。"""
+        s, t = self.device_id(src), self.device_id(dst)
+        return self._shortest_counts(s, (t,), max_hops).get(t)
+
+    def pairwise_ecmp(self, devices, max_hops=8):
+        """devices 中每对设备的 ECMP 统计 {(A, B): (跳数, 设备级, 链路级) 或 None}，每台设备一次 BFS。"""
+        ids = [self.device_id(name) for name in devices]
+        result = {}
+        for i, s in enumerate(ids[:-1]):
+            counts = self._shortest_counts(s, ids[i + 1:], max_hops)
+            for name, t in zip(devices[i + 1:], ids[i + 1:]):
+                result[(devices[i], name)] = counts.get(t)
+        return result
+
+    def describe(self, path):
+        names, layer = self.graph.device_names, self.graph.device_layer
+        return ' → '.join(f'{names[d]}({LAYER_NAMES[layer[d]]})' for d in path)
+
+
+def ego_graph(graph, device, hops):
+    """device 周围 hops 跳内的交换机邻域子图，返回 (子图, {设备ID: 跳数})。
+
+    在图自带的 CSR 邻接索引上 BFS，只经过 Core/Spine/Leaf，耗时只与邻域大小有关；
+    子图保留两端都在邻域内的全部记录（含端口），记录顺序与原图一致。
+    """
+    center = graph.device_ids.get(device)
+    if center is None or graph.device_layer[center] == LAYER_UNKNOWN:
+        raise KeyError(f'未找到交换机: {device}')
+    src, dst, layer = graph.src, graph.dst, graph.device_layer
+    out_offsets, out_links = graph.out_offsets, graph.out_links
+    in_offsets, in_links = graph.in_offsets, graph.in_links
+    depth = {center: 0}
+    frontier = [center]
+    for hop in range(1, hops + 1):
+        next_frontier = []
+        for d in frontier:
+            peers = [dst[i] for i in out_links[out_offsets[d]:out_offsets[d + 1]]]
+            peers += [src[i] for i in in_links[in_offsets[d]:in_offsets[d + 1]]]
+            for peer in peers:
+                if peer not in depth and layer[peer] != LAYER_UNKNOWN:
+                    depth[peer] = hop
+                    next_frontier.append(peer)
+        frontier = next_frontier
+    records = sorted(i for d in depth for i in out_links[out_offsets[d]:out_offsets[d + 1]] if dst[i] in depth)
+    builder = GraphBuilder(graph.device_class)
+    for i in records:
+        builder.add(*graph.link(i))
+    return builder.build(), depth
+
+
+# 3. POD 划分：一次遍历将 spine/leaf 设备与链路分桶到所属 POD
+def build_pod_index(graph):
+    spine_ids = graph.devices_in_layer(LAYER_SPINE)
+    leaf_ids = graph.devices_in_layer(LAYER_LEAF)
+    device_pod = graph.device_pod
+    pod_of = array('i', [-1]) * len(device_pod)
+    pod_token = {dev: device_pod[dev] for dev in spine_ids + leaf_ids if device_pod[dev]}
+    pods_only = sorted(set(pod_token.values()), key=pod_sort_key)
+    pod_pos = {pod: k for k, pod in enumerate(pods_only)}
+    for dev, pod in pod_token.items():
+        pod_of[dev] = pod_pos[pod]
+
+    index = PodIndex(
+        pods_only=pods_only,
+        pod_of=pod_of,
+        spine_ids=[[] for _ in pods_only],
+        leaf_ids=[[] for _ in pods_only],
+        leaf_spine_links=[array('i') for _ in pods_only],
+        core_spine_links=[array('i') for _ in pods_only],
+    )
+    # 设备列表已按名称排序，分桶后各 POD 内仍保持有序
+    for dev in spine_ids:
+        if pod_of[dev] >= 0:
+            index.spine_ids[pod_of[dev]].append(dev)
+    for dev in leaf_ids:
+        if pod_of[dev] >= 0:
+            index.leaf_ids[pod_of[dev]].append(dev)
+    # leaf-spine 边：两端属于同一 POD 才归入该 POD
+    src, dst = graph.src, graph.dst
+    for i in graph.leaf_spine_links:
+        k = pod_of[src[i]]
+        if k >= 0 and k == pod_of[dst[i]]:
+            index.leaf_spine_links[k].append(i)
+    # core-spine 边：归入 spine 所在 POD
+    layer = graph.device_layer
+    for i in graph.core_spine_links:
+        spine = src[i] if layer[src[i]] == LAYER_SPINE else dst[i]
+        k = pod_of[spine]
+        if k >= 0:
+            index.core_spine_links[k].append(i)
+    return index
+
+
+def partition_pods(graph):
+    index = build_pod_index(graph)
+    names = graph.device_names
+    pods_only = index.pods_only
+    pod_names = ["ALL"] + pods_only
+    pod_color_map = {}
+    for idx, pod in enumerate(pod_names):
+        pod_color_map[pod] = POD_COLORS[idx % len(POD_COLORS)]
+    return PodPartition(
+        pod_names=pod_names,
+        pods_only=pods_only,
+        pod_color_map=pod_color_map,
+        pod_index=index,
+        pod_spines={pod: [names[d] for d in index.spine_ids[k]] for k, pod in enumerate(pods_only)},
+        pod_leaves={pod: [names[d] for d in index.leaf_ids[k]] for k, pod in enumerate(pods_only)},
+    )
+
+
+# POD 划分后的可选分析阶段（--analytics）：逐交换机的上/下行链路、超售比与扇出均衡，
+# POD 内 Leaf 对的 ECMP 路径多样性，以及 POD 成员缺失或多余的链路
+ANALYTICS_PAIR_LIMIT = 1000  # 每个 POD 在报告中列出的低于最大 ECMP 的 Leaf 对上限
+ANALYTICS_CSV_COLUMNS = ('device', 'layer', 'pod', 'uplinks', 'downlinks', 'lateral', 'oversubscription',
+                         'fanout_peers', 'fanout_min', 'fanout_max', 'balance', 'anomalies')
+# 越靠近 Core 层级越小；主机等未识别设备视为最下层
+_LAYER_RANK = {LAYER_CORE: 0, LAYER_SPINE: 1, LAYER_LEAF: 2, LAYER_UNKNOWN: 3}
+
+
+@dataclass
+class FabricAnalytics:
+    """分析阶段的结果。
+
+    switches：逐交换机指标（字段见 ANALYTICS_CSV_COLUMNS）；oversubscription 为下行/上行链路数，
+    扇出对端对 Leaf/Spine 是上层交换机、对 Core 是 Spine，balance 为各对端中最少与最多链路数之比（1 表示均衡）。
+    pods：各 POD 内 Leaf 对经 Spine 的 ECMP 统计（设备级路径数与物理链路级路径数）。
+    anomalies：与 POD 内多数成员不一致的链路数（缺失或多余）。
+    """
+    switches: List[dict]
+    pods: Dict[str, dict]
+    anomalies: List[dict]
+
+    def to_dict(self):
+        oversub = [s['oversubscription'] for s in self.switches
+                   if s['layer'] == 'leaf' and s['oversubscription'] is not None]
+        ecmp = [stats['ecmp_links']['min'] for stats in self.pods.values() if stats['leaf_pairs']]
+        return {
+            'summary': {
+                'switches': len(self.switches),
+                'leaf_oversubscription_max': max(oversub, default=None),
+                'ecmp_links_min': min(ecmp, default=None),
+                'degraded_pairs': sum(stats['degraded_pairs'] for stats in self.pods.values()),
+                'anomalies': len(self.anomalies),
+            },
+            'switches': self.switches,
+            'pods': self.pods,
+            'anomalies': self.anomalies,
+        }
+
+    def overlay(self):
+        """页面着色数据：设备名 -> [超售比, 扇出均衡度, 异常数]。"""
+        return {s['device']: [s['oversubscription'], s['balance'], s['anomalies']] for s in self.switches}
+
+    def write_csv(self, path):
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, ANALYTICS_CSV_COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.switches)
+
+
+def _mode(values):
+    # 众数（并列时取较大值），作为 POD 内成员的期望值
+    counts = {}
+    for v in values:
+        counts[v] = counts.get(v, 0) + 1
+    return max(counts, key=lambda v: (counts[v], v)) if counts else 0
+
+
+def _leaf_pair_ecmp(names, leaves, rows, k, pod_of):
+    # Leaf 对的 ECMP 即 Leaf×Spine 链路数矩阵与其转置之积；Spine 链路向量相同的 Leaf 结果相同，
+    # 因此先按向量分组，只对不同的向量两两求内积，再按组大小折算为 Leaf 对数
+    groups = {}
+    for leaf, row in zip(leaves, rows):
+        signature = tuple(sorted((s, c) for s, c in row.items() if pod_of[s] == k))
+        groups.setdefault(signature, []).append(leaf)
+    groups = list(groups.items())
+    blocks = []  # (链路级路径数, 设备级路径数, Leaf 对数, 组 i, 组 j)
+    for gi, (sig_a, members_a) in enumerate(groups):
+        row_a = dict(sig_a)
+        for gj in range(gi, len(groups)):
+            sig_b, members_b = groups[gj]
+            pairs = len(members_a) * (len(members_a) - 1) // 2 if gi == gj else len(members_a) * len(members_b)
+            if not pairs:
+                continue
+            paths = links = 0
+            for s, c in sig_b:
+                if s in row_a:
+                    paths += 1
+                    links += row_a[s] * c
+            blocks.append((links, paths, pairs, gi, gj))
+    total = sum(b[2] for b in blocks)
+    stats = {'leaves': len(leaves), 'leaf_pairs': total, 'signatures': len(groups),
+             'ecmp_paths': None, 'ecmp_links': None, 'ecmp_histogram': {},
+             'degraded_pairs': 0, 'degraded_samples': []}
+    if not blocks:
+        return stats
+    max_links = max(b[0] for b in blocks)
+    stats['ecmp_paths'] = {'min': min(b[1] for b in blocks), 'max': max(b[1] for b in blocks)}
+    stats['ecmp_links'] = {'min': min(b[0] for b in blocks), 'max': max_links,
+                           'mean': round(sum(b[0] * b[2] for b in blocks) / total, 2)}
+    histogram = {}
+    for links, _, pairs, _, _ in blocks:
+        histogram[links] = histogram.get(links, 0) + pairs
+    stats['ecmp_histogram'] = {str(links): histogram[links] for links in sorted(histogram)}
+    samples = stats['degraded_samples']
+    for links, paths, pairs, gi, gj in sorted(blocks):
+        if links == max_links:
+            break
+        stats['degraded_pairs'] += pairs
+        members_a, members_b = groups[gi][1], groups[gj][1]
+        leaf_pairs = combinations(members_a, 2) if gi == gj else product(members_a, members_b)
+        for a, b in islice(leaf_pairs, ANALYTICS_PAIR_LIMIT - len(samples)):
+            samples.append([names[a], names[b], paths, links])
+    return stats
+
+
+def analyze_fabric(graph, partition):
+    names, layer = graph.device_names, graph.device_layer
+    src, dst, peer_link = graph.src, graph.dst, graph.peer_link
+    n = len(names)
+    index = partition.pod_index
+    pod_of = index.pod_of
+    # 一次遍历链路列：按层级区分上行、下行与同层链路，并统计交换机到上层各对端的链路数
+    uplinks = array('i', [0]) * n
+    downlinks = array('i', [0]) * n
+    lateral = array('i', [0]) * n
+    pair_links = {}  # 下层交换机 * n + 上层交换机 -> 链路数
+    for i in range(graph.num_links):
+        j = peer_link[i]
+        if j >= 0 and j < i and peer_link[j] == i:
+            continue  # 正反两条记录是同一条链路
+        a, b = src[i], dst[i]
+        rank_a, rank_b = _LAYER_RANK[layer[a]], _LAYER_RANK[layer[b]]
+        if rank_a == rank_b:
+            if layer[a] and a != b:
+                lateral[a] += 1
+                lateral[b] += 1
+            continue
+        if rank_a < rank_b:
+            a, b = b, a
+        uplinks[a] += 1
+        downlinks[b] += 1
+        if layer[a]:
+            key = a * n + b
+            pair_links[key] = pair_links.get(key, 0) + 1
+    up_peers = {}
+    down_peers = {}
+    for key, count in pair_links.items():
+        a, b = divmod(key, n)
+        up_peers.setdefault(a, {})[b] = count
+        down_peers.setdefault(b, {})[a] = count
+
+    anomalies = []
+
+    def anomaly(device, peer, links, expected, kind):
+        k = pod_of[device]
+        anomalies.append({'pod': index.pods_only[k] if k >= 0 else None, 'device': names[device],
+                          'layer': LAYER_NAMES[layer[device]], 'peer': names[peer] if peer is not None else None,
+                          'links': links, 'expected': expected, 'kind': kind})
+
+    pods = {}
+    for k, pod in enumerate(index.pods_only):
+        leaves, spines = index.leaf_ids[k], index.spine_ids[k]
+        rows = [up_peers.get(leaf, {}) for leaf in leaves]
+        # 期望对端：连接了本 POD 过半 Leaf 的 Spine；期望链路数：本 POD 内 Leaf-Spine 对链路数的众数
+        expected_spines = [s for s in spines if sum(1 for row in rows if s in row) * 2 > len(leaves)]
+        expected = _mode([c for row in rows for s, c in row.items() if pod_of[s] == k])
+        expected_set = set(expected_spines)
+        for leaf, row in zip(leaves, rows):
+            for s in expected_spines:
+                links = row.get(s, 0)
+                if links != expected:
+                    anomaly(leaf, s, links, expected, 'missing' if links < expected else 'excess')
+            for s, links in row.items():
+                if s not in expected_set and layer[s] == LAYER_SPINE:
+                    anomaly(leaf, s, links, 0, 'excess')
+        pods[pod] = _leaf_pair_ecmp(names, leaves, rows, k, pod_of)
+        pods[pod]['spines'] = len(spines)
+    # Spine 的 Core 对端数与每对链路数按全网众数比较（不同平面的 Spine 连接不同的 Core 组）
+    spine_rows = [(s, up_peers.get(s, {})) for s in graph.devices_in_layer(LAYER_SPINE)]
+    expected_cores = _mode([len(row) for _, row in spine_rows])
+    expected_links = _mode([c for _, row in spine_rows for c in row.values()])
+    for s, row in spine_rows:
+        if len(row) < expected_cores:
+            anomaly(s, None, len(row), expected_cores, 'missing_peers')
+        for core, links in row.items():
+            if links != expected_links:
+                anomaly(s, core, links, expected_links, 'missing' if links < expected_links else 'excess')
+
+    anomaly_count = {}
+    for entry in anomalies:
+        anomaly_count[entry['device']] = anomaly_count.get(entry['device'], 0) + 1
+    switches = []
+    for layer_code in (LAYER_CORE, LAYER_SPINE, LAYER_LEAF):
+        for d in graph.devices_in_layer(layer_code):
+            fanout = list((down_peers if layer_code == LAYER_CORE else up_peers).get(d, {}).values())
+            k = pod_of[d]
+            switches.append({
+                'device': names[d],
+                'layer': LAYER_NAMES[layer_code],
+                'pod': index.pods_only[k] if k >= 0 else None,
+                'uplinks': uplinks[d],
+                'downlinks': downlinks[d],
+                'lateral': lateral[d],
+                'oversubscription': round(downlinks[d] / uplinks[d], 2) if uplinks[d] else None,
+                'fanout_peers': len(fanout),
+                'fanout_min': min(fanout, default=None),
+                'fanout_max': max(fanout, default=None),
+                'balance': round(min(fanout) / max(fanout), 2) if fanout else None,
+                'anomalies': anomaly_count.get(names[d], 0),
+            })
+    return FabricAnalytics(switches=switches, pods=pods, anomalies=anomalies)
+
+
+# 4. 布局：计算 POD 间距、POD 父容器与各层节点坐标
+def layout_topology(graph, partition, options=None):
+    options = options or LayoutOptions()
+    layer_gap = options.layer_gap
+    node_gap = options.node_gap
+    spine_node_gap = options.spine_gap
+    leaf_node_gap = options.leaf_gap
+    pods_only = partition.pods_only
+
+    # 预计算各 POD 父容器宽度，并据此确定 ALL 视图的水平间距
+    pod_container_width_map = {}
+    for pod in pods_only:
+        n_spine = len(partition.pod_spines[pod])
+        n_leaf = len(partition.pod_leaves[pod])
+        max_span_spine = (n_spine - 1) * spine_node_gap if n_spine > 0 else 0
+        max_span_leaf = (n_leaf - 1) * leaf_node_gap if n_leaf > 0 else 0
+        pod_container_width_map[pod] = max(max_span_spine, max_span_leaf, 300) + 300
+    if options.pod_spacing is not None:
+        pod_spacing_effective = options.pod_spacing
     else:
-        return 'unknown'
-
-
-# 1. 构建完整的端口映射
-port_map = {}  # (System, Port) -> (Peer Node, Peer Port)
-with open(csv_path, encoding='utf-8') as f:
-    reader = csv.DictReader(f, delimiter=',')
-    if reader.fieldnames[0].startswith('\ufeff'):
-        reader.fieldnames[0] = reader.fieldnames[0].replace('\ufeff', '')
-    for row in reader:
-        sys = row['System'].strip()
-        port = row['Port'].strip()
-        peer = row['Peer Node'].strip()
-        peer_port = row['Peer Port'].strip()
-        port_map[(sys, port)] = (peer, peer_port)
-
-# 2. 追溯三台设备链路关系
-three_device_chains = []
-core_devices = set()
-spine_devices = set()
-leaf_devices = set()
-edges = set()
-device_count = defaultdict(int)
-unique_edges = set()
-nodes = {}
-# 先正常追溯三设备链路
-for (sys, port), (peer, peer_port) in port_map.items():
-    key_b = (peer, peer_port)
-    if key_b in port_map:
-        peer2, peer2_port = port_map[key_b]
-        if any(role in sys for role in ['IBCR', 'IBSP', 'IBLF']) or \
-           any(role in peer for role in ['IBCR', 'IBSP', 'IBLF']) or \
-           any(role in peer2 for role in ['IBCR', 'IBSP', 'IBLF']):
-            chain = {
-                'device_a': sys,
-                'device_b': peer,
-                'device_c': peer2,
-                'port_a': port,
-                'port_b': peer_port,
-                'port_c': peer2_port,
-                'layer_a': get_device_layer(sys),
-                'layer_b': get_device_layer(peer),
-                'layer_c': get_device_layer(peer2)
-            }
-            three_device_chains.append(chain)
-            device_count[sys] += 1
-            device_count[peer] += 1
-            device_count[peer2] += 1
-            n1 = sys
-            n2 = peer
-            n3 = peer2
-        nodes[n1] = sys
-        nodes[n2] = peer
-        nodes[n3] = peer2
-# 只按设备名的边
-edge1 = tuple(sorted([n1, n2]))
-edge2 = tuple(sorted([n2, n3]))
-if edge1 not in unique_edges:
-    edges.add((n1, None, n2, None))
-    unique_edges.add(edge1)
-if edge2 not in unique_edges:
-    edges.add((n2, None, n3, None))
-    unique_edges.add(edge2)
-# 补充所有 leaf-spine 直连边（每一条链路都保留端口信息，正反向只保留一条）
-for (sys, port), (peer, peer_port) in port_map.items():
-    if (('IBLF' in sys and 'IBSP' in peer) or (
-        'IBSP' in sys and 'IBLF' in peer)):
-        edge_key = tuple(sorted([(sys, port), (peer, peer_port)]))
-        if edge_key not in unique_edges:
-            edges.add((sys, port, peer, peer_port))
-            unique_edges.add(edge_key)
-
-# 统计三层设备
-for dev in nodes:
-    layer = get_device_layer(dev)
-    if layer == 'core':
-        core_devices.add(dev)
-    elif layer == 'spine':
-        spine_devices.add(dev)
-    elif layer == 'leaf':
-        leaf_devices.add(dev)
-
-core_list = sorted(list(core_devices))
-spine_list = sorted(list(spine_devices))
-leaf_list = sorted(list(leaf_devices))
-layer_gap = args.layer_gap
-node_gap = args.node_gap
-spine_node_gap = args.spine_gap
-leaf_node_gap = args.leaf_gap
-pod_spacing = args.pod_spacing  # 若为 None，后续自动计算
-max_count = max(len(core_list), len(spine_list), len(leaf_list))
-center_x = (max_count - 1) * node_gap / 2
-
-# 统计所有POD
-pod_names = set()
-pod_color_map = {}
-pod_colors = [
-    "#f1c40f33",
-    "#a2d5f2cc",
-    "#b8e994cc",
-    "#f7cac9cc",
-    "#f9e79fcc",
-    "#d2b4fccc",
-     "#f5cba7cc"]
-for dev in list(spine_list) + list(leaf_list):
-    m = re.search(r'POD(\d+)', dev)
-    if m:
-        pod_names.add(m.group(0))
-pod_names = sorted(list(pod_names))
-pod_names = ["ALL"] + pod_names
-for idx, pod in enumerate(pod_names):
-    pod_color_map[pod] = pod_colors[idx % len(pod_colors)]
-pods_only = [p for p in pod_names if p != "ALL"]
-
-# 预计算各 POD 父容器宽度，并据此确定 ALL 视图的水平间距
-pod_container_width_map = {}
-for pod in pods_only:
-    pod_spine_devices_tmp = [dev for dev in spine_list if pod in dev]
-    pod_leaf_devices_tmp = [dev for dev in leaf_list if pod in dev]
-    max_span_spine_tmp = (len(pod_spine_devices_tmp) - 1) * spine_node_gap if len(pod_spine_devices_tmp) > 0 else 0
-    max_span_leaf_tmp = (len(pod_leaf_devices_tmp) - 1) * leaf_node_gap if len(pod_leaf_devices_tmp) > 0 else 0
-    container_width_tmp = max(max_span_spine_tmp, max_span_leaf_tmp, 300) + 300
-    pod_container_width_map[pod] = container_width_tmp
-pod_spacing_effective = pod_spacing if pod_spacing is not None else (max(pod_container_width_map.values() or [900]) + args.pod_margin)
-
-# 记录设备与端口的映射
-device_port_map = defaultdict(set)
-for (sys, port), (peer, peer_port) in port_map.items():
-    device_port_map[sys].add(port)
-    device_port_map[peer].add(peer_port)
-
-# 生成每个POD的节点和边（只包含该POD的父节点、spine/leaf节点，以及core与该POD的spine/leaf之间的边）
-pod_node_map = {}
-pod_edge_map = {}
-core_node_objs = []
-for idx, dev in enumerate(core_list):
-    x = idx * node_gap - (len(core_list) - 1) * node_gap / 2 + center_x
-    core_node_objs.append({
-        "data": {"id": dev, "label": dev, "layer": "core"},
-        "position": {"x": x, "y": 0},
-        "style": {"background-color": "#e74c3c", "width": "50px", "height": "50px"}
+        pod_spacing_effective = max(pod_container_width_map.values() or [900]) + options.pod_margin
+
+    # 每个POD的父容器与 spine/leaf 横坐标
+    pod_x = {}
+    pod_spine_x = {}
+    pod_leaf_x = {}
+    for pod_idx, pod in enumerate(pods_only):
+        # 计算该 POD 的水平偏移
+        pod_offset_x = (pod_idx - (len(pods_only) - 1) / 2) * pod_spacing_effective
+        n_spine = len(partition.pod_spines[pod])
+        n_leaf = len(partition.pod_leaves[pod])
+        pod_x[pod] = pod_offset_x
+        pod_spine_x[pod] = [pod_offset_x + (j - (n_spine - 1) / 2) * spine_node_gap for j in range(n_spine)]
+        pod_leaf_x[pod] = [pod_offset_x + (j - (n_leaf - 1) / 2) * leaf_node_gap for j in range(n_leaf)]
+
+    # 计算所有 spine/leaf 的水平范围，并让 Core 居中于其上方
+    child_xs = [x for pod in pods_only for xs in (pod_spine_x[pod], pod_leaf_x[pod]) for x in xs]
+    mid_x = (min(child_xs) + max(child_xs)) / 2 if child_xs else 0
+    core_list = graph.core_list
+    core_x = [mid_x + (idx - (len(core_list) - 1) / 2) * node_gap for idx in range(len(core_list))]
+
+    return TopologyLayout(
+        options=options,
+        layer_y={"core": 0, "spine": layer_gap, "leaf": layer_gap * 2, "pod": layer_gap * 1.5},
+        core_list=core_list,
+        core_x=core_x,
+        pod_x=pod_x,
+        pod_spine_x=pod_spine_x,
+        pod_leaf_x=pod_leaf_x,
+        pod_container_width_map=pod_container_width_map,
+        pod_spacing_effective=pod_spacing_effective,
+    )
+
+
+def safe_json_for_html(js):
+    # HTML 解析器不区分大小写，且 '</script' 后跟空白、'/' 或 '>' 都会结束标签
+    return re.sub(r'</(script)', r'<\\/\1', js, flags=re.IGNORECASE)
+
+
+def to_json(obj):
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def json_object_from_fragments(items):
+    return '{' + ', '.join(f'{to_json(key)}: {fragment}' for key, fragment in items) + '}'
+
+
+def _coord(x):
+    # 坐标保留一位小数，整数不带小数部分，缩短 JSON
+    x = round(x, 1)
+    return int(x) if x == int(x) else x
+
+
+@dataclass
+class TopologyPayloads:
+    """序列化阶段的结果：Core 与每个 POD 的载荷各自是一段紧凑 JSON 文本，可单独复用。
+
+    POD 载荷分两段：nodes（容器与 spine/leaf 名称及横坐标，依赖布局）与
+    links（本 POD 的设备/端口名称表，以及按下标编码、每 4 个整数一条的 leaf-spine 与
+    core-spine 链路，与布局无关）。ALL 视图由页面按 POD 拼接，不再重复存放。
+    """
+    core: str
+    pod_list: str
+    pod_nodes: Dict[str, str]
+    pod_links: Dict[str, str]
+    reused_pods: List[str] = field(default_factory=list)  # 沿用了上次链路片段的 POD
+    unchanged_pods: List[str] = field(default_factory=list)  # 整个载荷与上次完全相同的 POD
+
+    def pod_json(self, pod):
+        return f'{{"nodes": {self.pod_nodes[pod]}, "links": {self.pod_links[pod]}}}'
+
+    def topology_json(self):
+        pods = json_object_from_fragments((pod, self.pod_json(pod)) for pod in self.pod_nodes)
+        return f'{{"podList": {self.pod_list}, "core": {self.core}, "pods": {pods}}}'
+
+
+def encode_pod_links(graph, index, k):
+    """将第 k 个 POD 的链路编码为列式整数数组，设备与端口名称在本 POD 内驻留。"""
+    names, port_names = graph.device_names, graph.port_names
+    src, src_port, dst, dst_port = graph.src, graph.src_port, graph.dst, graph.dst_port
+    layer = graph.device_layer
+    devices = {}
+    ports = {}
+
+    def dev(d):
+        return devices.setdefault(d, len(devices))
+
+    def port(p):
+        return ports.setdefault(p, len(ports))
+
+    # 同一设备对之间的平行链路连续存放，页面可按游程聚合为一条捆绑边（见 --bundle）
+    by_pair = {}
+    for i in index.leaf_spine_links[k]:
+        a, b = src[i], dst[i]
+        by_pair.setdefault((a, b) if a < b else (b, a), []).append(i)
+    edges = []
+    for pair_links in by_pair.values():
+        for i in pair_links:
+            edges += (dev(src[i]), port(src_port[i]), dev(dst[i]), port(dst_port[i]))
+    # core-spine 边强制 core 为 source，spine 为 target，并按 core 分组，
+    # coreRanges 每 3 个整数一组：core 下标、起始链路序号、链路数，供页面 O(度数) 查找某个 core 的边
+    by_core = {}
+    for i in index.core_spine_links[k]:
+        if layer[src[i]] == LAYER_SPINE:
+            quad = (dev(dst[i]), port(dst_port[i]), dev(src[i]), port(src_port[i]))
+        else:
+            quad = (dev(src[i]), port(src_port[i]), dev(dst[i]), port(dst_port[i]))
+        by_core.setdefault(quad[0], []).extend(quad)
+    core_spine = []
+    core_ranges = []
+    for core, quads in by_core.items():
+        core_ranges += (core, len(core_spine) // 4, len(quads) // 4)
+        core_spine += quads
+    return to_json({
+        "devices": [names[d] for d in devices],
+        "ports": [port_names[p] for p in ports],
+        "edges": edges,
+        "coreSpine": core_spine,
+        "coreRanges": core_ranges,
     })
-# ALL POD 节点和边合集（仅收集非 Core 节点，Core 单独维护）
-all_nodes = []
-all_edges = []
-# 不在pod_edge_map中补充IBCR<->IBSP的边
-# 但生成ibcr_ibsp_edges_map[pod][spine]，用于前端点击spine节点时动态添加
-ibcr_ibsp_edges_map = {pod: {} for pod in pod_names}
-for pod in pod_names:
-    if pod == "ALL":
-        continue
-    pod_node_map[pod] = []
-    pod_edge_map[pod] = []
-    # 计算该 POD 的水平偏移
-    pod_idx = pods_only.index(pod) if pod in pods_only else 0
-    pod_offset_x = (pod_idx - (len(pods_only) - 1) / 2) * pod_spacing_effective
-    # 该 POD 内 spines 与 leafs 列表
-    pod_spine_devices = [dev for dev in spine_list if pod in dev]
-    pod_leaf_devices = [dev for dev in leaf_list if pod in dev]
-    # 计算父容器宽度以适配子节点
-    max_span_spine = (len(pod_spine_devices) - 1) * spine_node_gap if len(pod_spine_devices) > 0 else 0
-    max_span_leaf = (len(pod_leaf_devices) - 1) * leaf_node_gap if len(pod_leaf_devices) > 0 else 0
-    container_width = max(max_span_spine, max_span_leaf, 300) + 300
-    # pod_spacing_effective 已预先计算，无需在此处更新
-    # 父节点
-    pod_node_map[pod].append({
-        "data": {"id": pod, "label": pod},
-        "position": {"x": pod_offset_x, "y": layer_gap * 1.5},
-        "grabbable": False, "selectable": False,
-        "style": {"background-color": pod_color_map[pod], "shape": "roundrectangle", "width": container_width, "height": 350, "label": pod, "font-size": "20px", "text-valign": "top", "text-halign": "center", "z-index": 0}
+
+
+def encode_pod_nodes(partition, layout, pod):
+    return to_json({
+        "x": _coord(layout.pod_x[pod]),
+        "width": _coord(layout.pod_container_width_map[pod]),
+        "color": partition.pod_color_map[pod],
+        "spines": partition.pod_spines[pod],
+        "spineX": [_coord(x) for x in layout.pod_spine_x[pod]],
+        "leaves": partition.pod_leaves[pod],
+        "leafX": [_coord(x) for x in layout.pod_leaf_x[pod]],
     })
-    # IBSP
-    pod_spine = []
-    for j, dev in enumerate(pod_spine_devices):
-        x = pod_offset_x + (j - (len(pod_spine_devices) - 1) / 2) * spine_node_gap
-        pod_spine.append(dev)
-        pod_node_map[pod].append({
-            "data": {"id": dev, "label": dev, "layer": "spine", "parent": pod},
-            "position": {"x": x, "y": layer_gap},
-            "style": {"background-color": "#3498db", "width": "45px", "height": "45px"}
-        })
-    # IBLF
-    pod_leaf = []
-    for j, dev in enumerate(pod_leaf_devices):
-        x = pod_offset_x + (j - (len(pod_leaf_devices) - 1) / 2) * leaf_node_gap
-        pod_leaf.append(dev)
-        pod_node_map[pod].append({
-            "data": {"id": dev, "label": dev, "layer": "leaf", "parent": pod},
-            "position": {"x": x, "y": layer_gap * 2},
-            "style": {"background-color": "#27ae60", "width": "40px", "height": "40px"}
-        })
-    # 边：只保留core与该POD的spine/leaf之间的边，以及该POD内部的边（不补充IBCR<->IBSP）
-    for edge in edges:
-        if len(edge) == 4:
-            src, src_port, dst, dst_port = edge
+
+
+SEARCH_SEPARATOR_RE = re.compile(r'[-_./]')
+
+
+def build_search_index(graph, partition):
+    """页面搜索索引：devices 为画布上的交换机名称（按小写排序），pods 为各设备所属 POD 在 podList 中的下标
+    （Core 为 0 即 ALL）。suffixes 每 2 个整数一项：设备下标、名称内偏移（名称开头及每个 -_./ 之后），
+    按该偏移起的小写后缀排序，页面对其二分查找前缀，输入 IBLF-005 也能找到完整名称。"""
+    pod_pos = {pod: k for k, pod in enumerate(partition.pod_names)}
+    pod_of = {}
+    for pod in partition.pods_only:
+        for name in partition.pod_spines[pod] + partition.pod_leaves[pod]:
+            pod_of[name] = pod_pos[pod]
+    devices = sorted(graph.core_list + list(pod_of), key=str.lower)
+    suffixes = []
+    for d, name in enumerate(devices):
+        lower = name.lower()
+        suffixes.append((lower, d, 0))
+        for m in SEARCH_SEPARATOR_RE.finditer(name):
+            if m.end() < len(name):
+                suffixes.append((lower[m.end():], d, m.end()))
+    suffixes.sort()
+    return {
+        "devices": devices,
+        "pods": [pod_of.get(name, 0) for name in devices],
+        "suffixes": [x for _, d, offset in suffixes for x in (d, offset)],
+    }
+
+
+def encode_core(layout, analytics=None, search=None):
+    core = {
+        "layerY": {key: _coord(y) for key, y in layout.layer_y.items()},
+        "cores": layout.core_list,
+        "coreX": [_coord(x) for x in layout.core_x],
+    }
+    if search is not None:
+        core["search"] = search
+    if analytics is not None:
+        core["analytics"] = analytics.overlay()
+    return to_json(core)
+
+
+# 5. 序列化：逐个 POD 生成紧凑 JSON 片段；reuse 提供的 POD 链路片段直接沿用（见 --diff）
+def build_payloads(graph, partition, layout, reuse=None, analytics=None):
+    reuse = reuse or {}
+    pod_nodes = {}
+    pod_links = {}
+    reused_pods = []
+    unchanged_pods = []
+    for k, pod in enumerate(partition.pods_only):
+        pod_nodes[pod] = encode_pod_nodes(partition, layout, pod)
+        if pod in reuse:
+            pod_links[pod] = reuse[pod]['links']
+            reused_pods.append(pod)
+            if reuse[pod].get('nodes') == pod_nodes[pod]:
+                unchanged_pods.append(pod)
         else:
-            src, src_port, dst, dst_port = edge[0], None, edge[2], None
-        # 跳过没有端口信息的边
-        if src_port is None or dst_port is None:
+            pod_links[pod] = encode_pod_links(graph, partition.pod_index, k)
+    return TopologyPayloads(
+        core=encode_core(layout, analytics, build_search_index(graph, partition)),
+        pod_list=to_json(partition.pod_names),
+        pod_nodes=pod_nodes,
+        pod_links=pod_links,
+        reused_pods=reused_pods,
+        unchanged_pods=unchanged_pods,
+    )
+
+
+# 载荷状态文件：保存各 POD 的 JSON 片段，供下一次 --diff 只重新生成有变化的 POD
+STATE_VERSION = 4
+
+
+def save_payload_state(path, source_key, payloads):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(f'UFMTOPO-STATE {STATE_VERSION} {source_key}\n')
+        for pod, links_json in payloads.pod_links.items():
+            f.write(f'{pod}\tnodes\t{payloads.pod_nodes[pod]}\n')
+            f.write(f'{pod}\tlinks\t{links_json}\n')
+    os.replace(tmp_path, path)
+
+
+def load_payload_state(path, source_key):
+    """读取状态文件；不存在或与 source_key 不对应时返回 None。片段保持原始文本，不做 JSON 解析。"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            header = f.readline().split()
+            if header != ['UFMTOPO-STATE', str(STATE_VERSION), source_key]:
+                return None
+            state = {}
+            for line in f:
+                pod, kind, fragment = line.rstrip('\n').split('\t', 2)
+                state.setdefault(pod, {})[kind] = fragment
+    except (OSError, ValueError):
+        return None
+    return state
+
+
+# 分片输出：外壳页面 + 每个 POD 一个载荷文件（以及 Core 文件），页面按需加载
+SHARD_CALLBACK = '__topologyShard'
+
+
+def shard_dir_for(output_path):
+    return f'{os.path.splitext(output_path)[0]}_data'
+
+
+def shard_name(pod):
+    # POD 名来自分类规则的捕获，可能含 '/'、'..'、'#'、'?' 或空格：不安全的名称改为 slug 加名称哈希，
+    # 既不会写到分片目录之外，也不会与其他 POD 重名
+    slug = re.sub(r'[^\w.-]', '_', pod)
+    if slug == pod:
+        return f'pod-{pod}'
+    return f'pod-{slug}-{hashlib.sha256(pod.encode("utf-8")).hexdigest()[:8]}'
+
+
+def _shard_script(name, json_text):
+    # 以字符串形式交给 JSON.parse，大对象的解析比 JS 对象字面量更快
+    return f'window.{SHARD_CALLBACK}({to_json(name)}, JSON.parse({to_json(json_text)}));\n'
+
+
+def write_shards(shard_dir, payloads, skip_pods=()):
+    """写出分片文件，返回实际写入的文件数；skip_pods（载荷未变化的 POD）中已存在的分片保持不变。"""
+    os.makedirs(shard_dir, exist_ok=True)
+    wanted = {'core.js'}
+    written = 0
+    with open(os.path.join(shard_dir, 'core.js'), 'w', encoding='utf-8') as f:
+        f.write(_shard_script('core', payloads.core))
+    written += 1
+    for pod in payloads.pod_links:
+        name = shard_name(pod)
+        path = os.path.join(shard_dir, f'{name}.js')
+        wanted.add(f'{name}.js')
+        if pod in skip_pods and os.path.exists(path):
             continue
-        # 只保留本POD相关的边
-        if (
-            (src in core_list and dst in pod_leaf) or
-            (dst in core_list and src in pod_leaf) or
-            (src in pod_spine + pod_leaf and dst in pod_spine + pod_leaf)
-        ):
-            edge_id = f"{src}:{src_port}->{dst}:{dst_port}"
-            src_ports = [src_port] if src_port else list(
-    device_port_map[src]) if src in device_port_map else []
-            dst_ports = [dst_port] if dst_port else list(
-    device_port_map[dst]) if dst in device_port_map else []
-            pod_edge_map[pod].append({
-                "data": {
-                    "id": edge_id,
-                    "source": src,
-                    "target": dst,
-                    "src_ports": src_ports,
-                    "dst_ports": dst_ports
-                }
-            })
-    # pod 内独立去重
-    ibcr_ibsp_edge_set = set()
-    for (sys, port), (peer, peer_port) in port_map.items():
-        if ('IBCR' in sys and 'IBSP' in peer) or (
-            'IBSP' in sys and 'IBCR' in peer):
-            if (pod in sys) or (pod in peer):
-                # 确定spine和core，强制core为source，spine为target
-                if 'IBSP' in sys:
-                    spine, core = sys, peer
-                    spine_port, core_port = port, peer_port
-                else:
-                    spine, core = peer, sys
-                    spine_port, core_port = peer_port, port
-                edge_key = tuple(sorted([(core, core_port), (spine, spine_port)]))
-                if edge_key in ibcr_ibsp_edge_set:
-                    continue
-                ibcr_ibsp_edge_set.add(edge_key)
-                if spine not in ibcr_ibsp_edges_map[pod]:
-                    ibcr_ibsp_edges_map[pod][spine] = []
-                ibcr_ibsp_edges_map[pod][spine].append({
-                    "data": {
-                        "id": f"{core}:{core_port}->{spine}:{spine_port}",
-                        "source": core,
-                        "target": spine,
-                        "src_ports": [core_port],
-                        "dst_ports": [spine_port]
-                    }
-                })
-
-# 计算所有 spine/leaf 的水平范围，并让 Core 居中于其上方
-child_xs = []
-for pod in pods_only:
-    for node in pod_node_map.get(pod, []):
-        if node.get("data", {}).get("layer") in ("spine", "leaf"):
-            child_xs.append(node.get("position", {}).get("x", 0))
-if child_xs:
-    mid_x = (min(child_xs) + max(child_xs)) / 2
-else:
-    mid_x = 0
-# 重新计算 Core 的 X 坐标，使其整体居中
-core_node_objs = []
-for idx, dev in enumerate(core_list):
-    x = mid_x + (idx - (len(core_list) - 1) / 2) * node_gap
-    core_node_objs.append({
-        "data": {"id": dev, "label": dev, "layer": "core"},
-        "position": {"x": x, "y": 0},
-        "style": {"background-color": "#e74c3c", "width": "50px", "height": "50px"}
-    })
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(_shard_script(name, payloads.pod_json(pod)))
+        written += 1
+    # 清理已不存在的 POD 的旧分片
+    for fname in os.listdir(shard_dir):
+        if fname.startswith('pod-') and fname.endswith('.js') and fname not in wanted:
+            os.remove(os.path.join(shard_dir, fname))
+    return written
 
-all_nodes += [node for pod_nodes in pod_node_map.values() for node in pod_nodes]
-all_edges += [edge for pod_edges in pod_edge_map.values() for edge in pod_edges]
-
-# 生成ALL合集（不包含 Core，Core 由前端单独添加）
-pod_node_map["ALL"] = all_nodes
-pod_edge_map["ALL"] = all_edges
-# 生成 ibcr_ibsp_edges_map["ALL"]，合并所有POD的core-spine边
-ibcr_ibsp_edges_map["ALL"] = {}
-for pod in pod_names:
-    if pod == "ALL":
-        continue
-    for spine, edges_list in ibcr_ibsp_edges_map[pod].items():
-        if spine not in ibcr_ibsp_edges_map["ALL"]:
-            ibcr_ibsp_edges_map["ALL"][spine] = []
-        ibcr_ibsp_edges_map["ALL"][spine].extend(edges_list)
 
-def safe_json_for_html(js):
-    return js.replace('</script>', '<\\/script>')
+# 差异模式：比较两份导出的链路集合（无向、按端口哈希），找出新增、移除与重新布线的链路
+@dataclass
+class TopologyDiff:
+    added: List[tuple]  # (设备A, 端口A, 设备B, 端口B)
+    removed: List[tuple]
+    recabled: List[tuple]  # (设备, 端口, 原对端, 原对端端口, 新对端, 新对端端口)
+    touched_pods: List[str]
+
+    def to_dict(self):
+        link_keys = ('device_a', 'port_a', 'device_b', 'port_b')
+        recable_keys = ('device', 'port', 'old_peer', 'old_peer_port', 'new_peer', 'new_peer_port')
+        return {
+            'summary': {
+                'added': len(self.added),
+                'removed': len(self.removed),
+                'recabled': len(self.recabled),
+                'touched_pods': self.touched_pods,
+            },
+            'added': [dict(zip(link_keys, link)) for link in self.added],
+            'removed': [dict(zip(link_keys, link)) for link in self.removed],
+            'recabled': [dict(zip(recable_keys, change)) for change in self.recabled],
+        }
+
+
+def graph_link_keys(graph):
+    # 无向链路键：两个 (设备, 端口) 端点按字典序排列，正反两行记录得到同一个键
+    names, ports = graph.device_names, graph.port_names
+    src, src_port, dst, dst_port = graph.src, graph.src_port, graph.dst, graph.dst_port
+    keys = set()
+    for i in range(graph.num_links):
+        a = (names[src[i]], ports[src_port[i]])
+        b = (names[dst[i]], ports[dst_port[i]])
+        keys.add((a, b) if a <= b else (b, a))
+    return keys
+
+
+def graph_endpoint_peers(graph):
+    # 有向端点 -> 对端：每行记录只描述本端 (设备, 端口) 当前连到哪里（重复端口已在建图时去重）
+    names, ports = graph.device_names, graph.port_names
+    src, src_port, dst, dst_port = graph.src, graph.src_port, graph.dst, graph.dst_port
+    peers = {}
+    for i in range(graph.num_links):
+        peers[names[src[i]], ports[src_port[i]]] = (names[dst[i]], ports[dst_port[i]])
+    return peers
+
+
+def diff_graphs(old_graph, new_graph):
+    old_keys = graph_link_keys(old_graph)
+    new_keys = graph_link_keys(new_graph)
+    removed = old_keys - new_keys
+    added = new_keys - old_keys
+    recabled = []
+    recabled_old = set()
+    recabled_new = set()
+    # 先按有向端点匹配：只导出了一侧的对端变化时，另一侧残留的旧镜像行会让旧的无向链路仍然“存在”，
+    # 只比较无向键会把它误报为新增链路
+    old_peers = graph_endpoint_peers(old_graph)
+    new_peers = graph_endpoint_peers(new_graph)
+    for endpoint in sorted(old_peers.keys() & new_peers.keys()):
+        old_peer, new_peer = old_peers[endpoint], new_peers[endpoint]
+        if old_peer == new_peer:
+            continue
+        old_link = (endpoint, old_peer) if endpoint <= old_peer else (old_peer, endpoint)
+        new_link = (endpoint, new_peer) if endpoint <= new_peer else (new_peer, endpoint)
+        recabled_old.add(old_link)
+        if new_link in recabled_new:
+            continue  # 对端一侧已经记录过这次换线
+        recabled.append(endpoint + old_peer + new_peer)
+        recabled_new.add(new_link)
+    # 再按无向键兜底：同一端口既出现在移除链路又出现在新增链路中，即为该端口换了对端（重新布线）
+    added_by_endpoint = {}
+    for link in added - recabled_new:
+        for endpoint in link:
+            added_by_endpoint.setdefault(endpoint, link)
+    for link in sorted(removed - recabled_old):
+        for k, endpoint in enumerate(link):
+            new_link = added_by_endpoint.get(endpoint)
+            if new_link is None or new_link in recabled_new:
+                continue
+            old_peer = link[1 - k]
+            new_peer = new_link[1] if new_link[0] == endpoint else new_link[0]
+            recabled.append(endpoint + old_peer + new_peer)
+            recabled_old.add(link)
+            recabled_new.add(new_link)
+            break
+    touched = set()
+    for link in removed | added | recabled_old | recabled_new:
+        for device, _ in link:
+            graph = new_graph if device in new_graph.device_ids else old_graph
+            pod = graph.device_pod[graph.device_ids[device]]
+            if pod:
+                touched.add(pod)
+    return TopologyDiff(
+        added=[a + b for a, b in sorted(added - recabled_new)],
+        removed=[a + b for a, b in sorted(removed - recabled_old)],
+        recabled=recabled,
+        touched_pods=sorted(touched, key=pod_sort_key),
+    )
+
+
+# 6. 渲染 HTML
+# 页面端的紧凑载荷解码：POD 在首次选中时才展开为 Cytoscape 元素
+DECODE_DATA_JS = """    let coreNodes = [];
+    let layerY = null;
+    let analytics = null;  // 设备名 -> [超售比, 扇出均衡度, 异常数]，仅 --analytics 时存在
+    let searchIndex = null;  // 见 build_search_index；lower 为页面端预先转为小写的设备名
+    const podNodes = {};
+    const podEdges = {};
+    const ibcrIbspEdgesMap = {};  // POD -> spine -> core-spine 边
+    const ibcrEdgesByCore = {};  // POD -> core -> core-spine 边
+    function decodeCore(core) {
+      layerY = core.layerY;
+      analytics = core.analytics || null;
+      searchIndex = core.search || null;
+      if (searchIndex) searchIndex.lower = searchIndex.devices.map(function(name) { return name.toLowerCase(); });
+      coreNodes = core.cores.map(function(name, i) {
+        return {data: {id: name, label: name, layer: 'core'}, position: {x: core.coreX[i], y: layerY.core}, classes: 'core'};
+      });
+    }
+    // 链路每 4 个整数一条：源设备、源端口、目的设备、目的端口（下标指向本 POD 的名称表）
+    function decodeLinks(links, flat) {
+      const edges = [];
+      for (let i = 0; i < flat.length; i += 4) {
+        const src = links.devices[flat[i]], srcPort = links.ports[flat[i + 1]];
+        const dst = links.devices[flat[i + 2]], dstPort = links.ports[flat[i + 3]];
+        edges.push({data: {id: src + ':' + srcPort + '->' + dst + ':' + dstPort, source: src, target: dst, src_ports: [srcPort], dst_ports: [dstPort]}});
+      }
+      return edges;
+    }
+    function decodePod(pod, raw) {
+      const n = raw.nodes;
+      const nodes = [{data: {id: pod, label: pod, color: n.color, width: n.width}, position: {x: n.x, y: layerY.pod}, grabbable: false, selectable: false, classes: 'pod'}];
+      n.spines.forEach(function(name, j) {
+        nodes.push({data: {id: name, label: name, layer: 'spine', parent: pod}, position: {x: n.spineX[j], y: layerY.spine}, classes: 'spine'});
+      });
+      n.leaves.forEach(function(name, j) {
+        nodes.push({data: {id: name, label: name, layer: 'leaf', parent: pod}, position: {x: n.leafX[j], y: layerY.leaf}, classes: 'leaf'});
+      });
+      const overlay = decodeLinks(raw.links, raw.links.coreSpine);
+      const bySpine = {};
+      overlay.forEach(function(edge) {
+        (bySpine[edge.data.target] = bySpine[edge.data.target] || []).push(edge);
+      });
+      const byCore = {};
+      const ranges = raw.links.coreRanges;
+      for (let i = 0; i < ranges.length; i += 3) {
+        byCore[raw.links.devices[ranges[i]]] = overlay.slice(ranges[i + 1], ranges[i + 1] + ranges[i + 2]);
+      }
+      podNodes[pod] = nodes;
+      podEdges[pod] = decodeLinks(raw.links, raw.links.edges);
+      ibcrIbspEdgesMap[pod] = bySpine;
+      ibcrEdgesByCore[pod] = byCore;
+    }
+    function loadPod(pod) {
+      if (pod === 'ALL') {
+        // ALL 由各 POD 在页面内拼接，载荷中不重复存放
+        const pods = podList.filter(function(p) { return p !== 'ALL'; });
+        return Promise.all(pods.map(loadPod)).then(function() {
+          if (ibcrIbspEdgesMap.ALL) return;
+          ibcrIbspEdgesMap.ALL = Object.assign.apply(null, [{}].concat(pods.map(function(p) { return ibcrIbspEdgesMap[p]; })));
+          const byCore = {};
+          pods.forEach(function(p) {
+            for (const core in ibcrEdgesByCore[p]) {
+              byCore[core] = (byCore[core] || []).concat(ibcrEdgesByCore[p][core]);
+            }
+          });
+          ibcrEdgesByCore.ALL = byCore;
+        });
+      }
+      if (podNodes[pod]) return Promise.resolve();
+      return loadRawPod(pod).then(function(raw) {
+        if (!podNodes[pod]) decodePod(pod, raw);
+      });
+    }"""
+
+INLINE_DATA_JS = """    // 安全获取大JSON数据
+    const topologyData = JSON.parse(document.getElementById('topology-data').textContent);
+    const podList = topologyData.podList;
+    function loadCore() { return Promise.resolve(); }
+    function loadRawPod(pod) { return Promise.resolve(topologyData.pods[pod]); }
+""" + DECODE_DATA_JS + """
+    decodeCore(topologyData.core);"""
+
+COMPRESSED_DATA_JS = """    // 压缩内联模式：Core 与各 POD 载荷为 gzip + base64，选中时才用 DecompressionStream 解压并 JSON.parse
+    const podList = JSON.parse(document.getElementById('pod-list-data').textContent);
+    const blobLoads = {};
+    function inflateBlob(id) {
+      if (!blobLoads[id]) {
+        if (typeof DecompressionStream === 'undefined') {
+          return Promise.reject(new Error('当前浏览器不支持 DecompressionStream，请改用不带 --compress 生成的页面'));
+        }
+        const binary = atob(document.getElementById(id).textContent.trim());
+        const bytes = new Uint8Array(binary.length);
+        for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
+        const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+        blobLoads[id] = new Response(stream).text().then(JSON.parse);
+      }
+      return blobLoads[id];
+    }
+    function loadCore() {
+      return inflateBlob('core-data').then(function(core) {
+        if (!layerY) decodeCore(core);
+      });
+    }
+    function loadRawPod(pod) {
+      return Promise.all([loadCore(), inflateBlob('pod-data-' + pod)]).then(function(results) { return results[1]; });
+    }
+""" + DECODE_DATA_JS
+
+SHARD_DATA_JS = """    // 分片模式：Core 与各 POD 载荷按需通过 <script> 加载（file:// 下同样可用），已加载的分片缓存在页面中
+    const shardBase = __SHARD_BASE__;
+    const shardNames = __SHARD_NAMES__;  // POD -> 分片文件名（见 shard_name）
+    const podList = JSON.parse(document.getElementById('pod-list-data').textContent);
+    const shardLoads = {};
+    const shardResolvers = {};
+    window.__SHARD_CALLBACK__ = function(name, payload) {
+      if (shardResolvers[name]) shardResolvers[name](payload);
+    };
+    function loadShard(name) {
+      if (!shardLoads[name]) {
+        shardLoads[name] = new Promise(function(resolve, reject) {
+          shardResolvers[name] = resolve;
+          const script = document.createElement('script');
+          script.src = shardBase + '/' + encodeURIComponent(name) + '.js';
+          script.onerror = function() {
+            delete shardLoads[name];
+            reject(new Error('加载失败: ' + script.src));
+          };
+          document.head.appendChild(script);
+        });
+      }
+      return shardLoads[name];
+    }
+    function loadCore() {
+      return loadShard('core').then(function(core) {
+        if (!layerY) decodeCore(core);
+      });
+    }
+    function loadRawPod(pod) {
+      return Promise.all([loadCore(), loadShard(shardNames[pod])]).then(function(results) { return results[1]; });
+    }
+""" + DECODE_DATA_JS
+
+SERVER_DATA_JS = """    // 服务模式：Core 与各 POD 载荷通过 HTTP 接口按需获取（服务端按 ETag 与 gzip 响应）
+    const apiBase = __API_BASE__;
+    const podList = JSON.parse(document.getElementById('pod-list-data').textContent);
+    const apiLoads = {};
+    function fetchJson(path) {
+      if (!apiLoads[path]) {
+        apiLoads[path] = fetch(apiBase + path).then(function(resp) {
+          if (!resp.ok) throw new Error('加载失败: ' + apiBase + path + ' (' + resp.status + ')');
+          return resp.json();
+        }).catch(function(err) {
+          delete apiLoads[path];
+          throw err;
+        });
+      }
+      return apiLoads[path];
+    }
+    function loadCore() {
+      return fetchJson('core').then(function(core) {
+        if (!layerY) decodeCore(core);
+      });
+    }
+    function loadRawPod(pod) {
+      return Promise.all([loadCore(), fetchJson('pod/' + encodeURIComponent(pod))]).then(function(results) { return results[1]; });
+    }
+""" + DECODE_DATA_JS
+
+
+CYTOSCAPE_VERSION = '3.26.0'
+CYTOSCAPE_CDN_URL = f'https://unpkg.com/cytoscape@{CYTOSCAPE_VERSION}/dist/cytoscape.min.js'
+CYTOSCAPE_ASSET = 'cytoscape.min.js'
+
+
+def find_cytoscape_js(path=None, cache_dir=None):
+    """定位本地 Cytoscape 构建：path 可为文件或包含 cytoscape.min.js 的目录；
+    未指定时依次查找脚本同级的 assets/ 与缓存目录下的 assets/。"""
+    if path:
+        candidates = [os.path.join(path, CYTOSCAPE_ASSET) if os.path.isdir(path) else path]
+    else:
+        candidates = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', CYTOSCAPE_ASSET),
+                      os.path.join(cache_dir or default_cache_dir(), 'assets', CYTOSCAPE_ASSET)]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError(f'未找到本地 Cytoscape 构建 {CYTOSCAPE_ASSET}（已查找: {", ".join(candidates)}），'
+                            f'可从 {CYTOSCAPE_CDN_URL} 下载后用 --cytoscape-js 指定')
+
+
+def cytoscape_script_tag(js_path=None):
+    """js_path 为 None 时从 CDN 加载，否则将该文件内联进页面（离线模式）。"""
+    if js_path is None:
+        return f'<script src="{CYTOSCAPE_CDN_URL}"></script>'
+    with open(js_path, encoding='utf-8') as f:
+        source = f.read()
+    # 转义脚本内容中的 </script，避免提前结束标签
+    return '<script>' + re.sub(r'</(script)', r'<\\/\1', source, flags=re.IGNORECASE) + '</script>'
+
 
-core_node_objs_js = safe_json_for_html(json.dumps(core_node_objs, ensure_ascii=False))
-pod_nodes_js = safe_json_for_html(json.dumps(pod_node_map, ensure_ascii=False))
-pod_edges_js = safe_json_for_html(json.dumps(pod_edge_map, ensure_ascii=False))
-pod_list_js = safe_json_for_html(json.dumps(pod_names, ensure_ascii=False))
-ibcr_ibsp_edges_map_js = safe_json_for_html(json.dumps(ibcr_ibsp_edges_map, ensure_ascii=False))
-label_width_js = args.label_width
+def compress_payload(json_text):
+    # mtime=0 保证相同载荷生成相同输出
+    return base64.b64encode(gzip.compress(json_text.encode('utf-8'), compresslevel=9, mtime=0)).decode('ascii')
 
-pod_select_html = '''
+
+# 页面模板中载荷的位置；模板在此处切开，载荷片段逐段输出
+PAYLOAD_MARKER = '\0payload\0'
+
+
+def _inline_payload_parts(payloads):
+    # 与 TopologyPayloads.topology_json() 相同的文本，按 Core 与各 POD 的片段分段产出
+    yield f'{{"podList": {payloads.pod_list}, "core": '
+    yield payloads.core
+    yield ', "pods": {'
+    for k, pod in enumerate(payloads.pod_nodes):
+        yield f'{", " if k else ""}{to_json(pod)}: {{"nodes": '
+        yield payloads.pod_nodes[pod]
+        yield ', "links": '
+        yield payloads.pod_links[pod]
+        yield '}'
+    yield '}}'
+
+
+def _inline_payload_chunks(payloads, stats):
+    # 各片段均为完整的 JSON 值或分隔符，'</script>' 只可能出现在片段内的字符串中，可逐段转义
+    yield '  <script type="application/json" id="topology-data">'
+    for part in _inline_payload_parts(payloads):
+        part = safe_json_for_html(part)
+        if stats is not None:
+            size = len(part.encode('utf-8'))
+            stats['raw_bytes'] += size
+            stats['embedded_bytes'] += size
+        yield part
+    yield '</script>'
+
+
+def _compressed_payload_chunks(payloads, pods_only, stats):
+    blobs = [('core-data', payloads.core)]
+    blobs.extend((f'pod-data-{pod}', pod) for pod in pods_only)
+    for blob_id, json_text in blobs:
+        if blob_id != 'core-data':
+            json_text = payloads.pod_json(json_text)
+        packed = compress_payload(json_text)
+        if stats is not None:
+            stats['raw_bytes'] += len(json_text.encode('utf-8'))
+            stats['embedded_bytes'] += len(packed)
+        yield f'\n  <script type="application/octet-stream" id="{escape(blob_id)}">{packed}</script>'
+
+
+def render_html(graph, partition, layout, label_width=150, payloads=None, shard_dir=None,
+                compress=False, stats=None, bundle_zoom=None, cytoscape_js=None, api_base=None,
+                path_limit=15, max_hops=4, focus=None):
+    """渲染完整页面文本，参数见 render_html_chunks。"""
+    return ''.join(render_html_chunks(graph, partition, layout, label_width, payloads, shard_dir, compress,
+                                      stats, bundle_zoom, cytoscape_js, api_base, path_limit, max_hops, focus))
+
+
+def render_html_chunks(graph, partition, layout, label_width=150, payloads=None, shard_dir=None,
+                       compress=False, stats=None, bundle_zoom=None, cytoscape_js=None, api_base=None,
+                       path_limit=15, max_hops=4, focus=None):
+    """渲染页面，返回文本片段的迭代器（见 write_chunks）：模板一次生成，内嵌载荷按 Core 与各 POD
+    逐段转义（或压缩）后输出，不再拼出整页字符串。指定 shard_dir（相对页面的分片目录）时只生成外壳，
+    载荷由 write_shards 写出。
+
+    compress=True 时各载荷以 gzip + base64 内嵌。传入 stats 字典时，迭代结束后其中为
+    raw_bytes（载荷原始 JSON 字节数）与 embedded_bytes（实际内嵌字节数）。
+    bundle_zoom 不为 None 时启用捆绑模式，缩放达到该值后展开可视区域内的捆绑边。
+    cytoscape_js 为本地 Cytoscape 构建路径时将其内联，页面不再访问网络。
+    指定 api_base 时生成服务模式的外壳，载荷由页面从该路径下的接口获取（见 --serve）。
+    path_limit / max_hops 为页面路径查询返回的路径条数上限与默认最大跳数。
+    focus 为设备名时，页面打开后切换到其所在 POD 并居中高亮该设备（见 --focus）。
+    """
+    core_list = graph.core_list
+    spine_list = graph.spine_list
+    leaf_list = graph.leaf_list
+    pod_names = partition.pod_names
+    pod_list_js = safe_json_for_html(to_json(pod_names))
+    if stats is not None:
+        stats['raw_bytes'] = stats['embedded_bytes'] = 0
+    data_chunks = ()
+    if shard_dir is None and api_base is None:
+        payloads = payloads or build_payloads(graph, partition, layout)
+    if api_base is not None:
+        data_html = f'  <script type="application/json" id="pod-list-data">{pod_list_js}</script>'
+        data_js = SERVER_DATA_JS.replace('__API_BASE__', safe_json_for_html(to_json(api_base)))
+    elif shard_dir is None and compress:
+        data_html = f'  <script type="application/json" id="pod-list-data">{pod_list_js}</script>'
+        data_chunks = _compressed_payload_chunks(payloads, partition.pods_only, stats)
+        data_js = COMPRESSED_DATA_JS
+    elif shard_dir is None:
+        data_html = ''
+        data_chunks = _inline_payload_chunks(payloads, stats)
+        data_js = INLINE_DATA_JS
+    else:
+        data_html = f'  <script type="application/json" id="pod-list-data">{pod_list_js}</script>'
+        shard_names = {pod: shard_name(pod) for pod in partition.pods_only}
+        data_js = (SHARD_DATA_JS.replace('__SHARD_BASE__', safe_json_for_html(to_json(shard_dir)))
+                   .replace('__SHARD_NAMES__', safe_json_for_html(to_json(shard_names)))
+                   .replace('__SHARD_CALLBACK__', SHARD_CALLBACK))
+    label_width_js = label_width
+    cytoscape_html = cytoscape_script_tag(cytoscape_js)
+    bundle_zoom_js = 'null' if bundle_zoom is None else to_json(bundle_zoom)
+    focus_js = safe_json_for_html(to_json(focus))
+    # 各层样式只定义一次（Cytoscape class），元素本身不再携带 style
+    layer_styles = [
+        f"        {{ selector: 'node.{layer}', style: {{ 'background-color': '{style['color']}', "
+        f"'width': {style['size']}, 'height': {style['size']} }} }}"
+        for layer, style in LAYER_STYLES.items()
+    ]
+    layer_styles.append(
+        "        { selector: 'node.pod', style: { 'background-color': 'data(color)', 'shape': 'roundrectangle', "
+        f"'width': 'data(width)', 'height': {POD_CONTAINER_HEIGHT}, 'label': 'data(label)', 'font-size': '20px', "
+        "'text-valign': 'top', 'text-halign': 'center', 'z-index': 0 } }")
+    layer_styles.append(
+        "        { selector: 'edge.bundle', style: { 'width': 'mapData(count, 2, 32, 3, 10)', 'line-color': '#8e44ad', "
+        "'target-arrow-color': '#8e44ad', 'label': 'data(count)', 'font-size': '14px', 'text-background-color': '#fff', "
+        "'text-background-opacity': 1 } }")
+    layer_styles.append(
+        "        { selector: 'node.path', style: { 'border-color': '#f39c12', 'border-width': 6 } }")
+    layer_styles.append(
+        "        { selector: 'edge.path', style: { 'width': 5, 'line-color': '#f39c12', 'target-arrow-color': '#f39c12', "
+        "'z-index': 10 } }")
+    layer_styles.append(
+        "        { selector: 'node.heat', style: { 'background-color': 'mapData(heat, 0, 1, #2ecc71, #e74c3c)' } }")
+    layer_styles.append("        { selector: '.hidden, .collapsed', style: { 'display': 'none' } }")
+    layer_styles_js = ',\n'.join(layer_styles)
+
+    pod_select_html = '''
 <div style="position:absolute;top:10px;left:400px;z-index:3000;background:rgba(255,255,255,0.95);padding:6px 12px;border-radius:8px;box-shadow:0 2px 10px rgba(0,0,0,0.08);">
   <label for="pod-select" style="font-size:16px;margin-right:8px;">选择POD:</label>
   <select id="pod-select" style="font-size:16px;">
     {options}
   </select>
+  <span style="position:relative;margin-left:12px;">
+    <input id="search-box" placeholder="搜索设备或 设备:端口" autocomplete="off" style="font-size:16px;width:260px;">
+    <div id="search-results" style="display:none;position:absolute;top:28px;left:0;width:420px;max-height:360px;overflow-y:auto;background:#fff;box-shadow:0 2px 10px rgba(0,0,0,0.15);font-size:14px;"></div>
+  </span>
+  <span id="color-mode-box" style="display:none;margin-left:12px;">
+    <label for="color-mode" style="font-size:16px;margin-right:8px;">着色:</label>
+    <select id="color-mode" style="font-size:16px;">
+      <option value="none">无</option>
+      <option value="oversub">超售比</option>
+      <option value="balance">扇出不均衡</option>
+      <option value="anomaly">异常链路</option>
+    </select>
+  </span>
 </div>
 '''.replace('{options}', ''.join(
-    f'<option value="{pod}"{" selected" if pod=="ALL" else ""}>{pod}</option>' for pod in pod_names
-))
-
-# 生成三台设备链路的详细信息
-chain_info = []
-for i, chain in enumerate(three_device_chains[:15]):
-    chain_info.append(f"链路{i+1}: {chain['device_a']}({chain['layer_a']}) → {chain['device_b']}({chain['layer_b']}) → {chain['device_c']}({chain['layer_c']})")
-
-# 调试：输出指定leaf的所有链路和edges中的所有相关边
-# 可根据需要修改target_leaf
-# 统计三层设备前
-
-if args.debug and args.debug_target_leaf:
-    target_leaf = args.debug_target_leaf
-    leaf_links = [((sys, port), (peer, peer_port)) for (sys, port), (peer, peer_port) in port_map.items() if sys == target_leaf or peer == target_leaf]
-    print(f'{target_leaf} 相关链路总数: {len(leaf_links)}')
-    for link in leaf_links:
-        print(link)
-    leaf_edges = [e for e in edges if target_leaf in e]
-    print(f'edges中 {target_leaf} 相关边数: {len(leaf_edges)}')
-    for e in leaf_edges:
-        print(e)
+        f'<option value="{escape(pod)}"{" selected" if pod=="ALL" else ""}>{escape(pod)}</option>' for pod in pod_names
+    ))
+    path_query_html = f'''
+<div style="position:absolute;top:56px;left:400px;z-index:3000;background:rgba(255,255,255,0.95);padding:6px 12px;border-radius:8px;box-shadow:0 2px 10px rgba(0,0,0,0.08);font-size:14px;">
+  路径查询:
+  <input id="path-src" placeholder="源设备" style="width:200px;">
+  <input id="path-dst" placeholder="目的设备" style="width:200px;">
+  <input id="path-via" placeholder="经过（可选）" style="width:160px;">
+  <input id="path-hops" type="number" min="1" max="16" value="{max_hops}" title="最大跳数" style="width:48px;">
+  <button onclick="runPathQuery()">查询</button>
+</div>
+'''
+    path_limit_js = to_json(path_limit)
+    max_hops_js = to_json(max_hops)
 
-# 生成alert JS代码时，全部用\n换行，避免非法换行
-html = f"""
+    # 生成alert JS代码时，全部用\n换行，避免非法换行
+    html = f"""
 <!DOCTYPE html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>CLOS三层架构拓扑图</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <script src="https://unpkg.com/cytoscape@3.26.0/dist/cytoscape.min.js"></script>
+  {cytoscape_html}
   <style>
     #cy {{
       width: 100vw;
@@ -424,178 +2427,37 @@ html = f"""
 </head>
 <body>
   {pod_select_html}
+{path_query_html}
   <div class="info">
-    <strong>CLOS三层架构拓扑图</strong><br>
-    Core层(IBCR): {len(core_list)} 个<br>
-    Spine层(IBSP): {len(spine_list)} 个<br>
-    Leaf层(IBLF): {len(leaf_list)} 个
-  </div>
-  <div class="legend">
-    <strong>CLOS三层架构</strong><br>
-    <div class="legend-item"><div class="legend-color" style="background-color: #e74c3c;"></div><span>Core层 (IBCR)</span></div>
-    <div class="legend-item"><div class="legend-color" style="background-color: #3498db;"></div><span>Spine层 (IBSP)</span></div>
-    <div class="legend-item"><div class="legend-color" style="background-color: #27ae60;"></div><span>Leaf层 (IBLF)</span></div>
-  </div>
-  <div class="debug">
-    <strong>调试信息</strong><br>
-    <div id="debug-info">正在加载...</div>
-  </div>
-  <div id="cy"></div>
-  <!-- 信息浮层子页面 -->
-  <div id="info-panel" style="display:none;position:fixed;top:0;right:0;height:100vh;width:350px;background:#fff;box-shadow:-2px 0 10px rgba(0,0,0,0.1);z-index:9999;padding:24px;overflow-y:auto;">
-    <div id="info-panel-content"></div>
-    <button onclick="document.getElementById('info-panel').style.display='none'" style="position:absolute;top:8px;right:8px;">关闭</button>
-  </div>
-  <!-- 安全传递大JSON数据 -->
-  <script type="application/json" id="core-nodes-data">{core_node_objs_js}</script>
-  <script type="application/json" id="pod-nodes-data">{pod_nodes_js}</script>
-  <script type="application/json" id="pod-edges-data">{pod_edges_js}</script>
-  <script type="application/json" id="pod-list-data">{pod_list_js}</script>
-  <script type="application/json" id="ibcr-ibsp-edges-map-data">{ibcr_ibsp_edges_map_js}</script>
-  <script>
-    // 安全获取大JSON数据
-    const coreNodes = JSON.parse(document.getElementById('core-nodes-data').textContent);
-    const podNodes = JSON.parse(document.getElementById('pod-nodes-data').textContent);
-    const podEdges = JSON.parse(document.getElementById('pod-edges-data').textContent);
-    const podList = JSON.parse(document.getElementById('pod-list-data').textContent);
-    const ibcrIbspEdgesMap = JSON.parse(document.getElementById('ibcr-ibsp-edges-map-data').textContent);
-    let currentPod = null;
-    let ibcrIbspEdgesAdded = [];
-    // 初始只显示Core
-    let cy = cytoscape({{
-      container: document.getElementById('cy'),
-      elements: coreNodes,
-      style: [
-        {{
-          selector: 'node',
-          style: {{
-            'label': 'data(label)',
-            'text-valign': 'center',
-            'text-halign': 'center',
-            'color': '#222',
-            'font-size': '11px',
-            'text-wrap': 'wrap',
-            'text-max-width': '150px',
-            'border-width': 2,
-            'border-color': '#fff',
-            'font-weight': 'bold'
-          }}
-        }},
-        {{
-          selector: 'edge',
-          style: {{
-            'width': 2,
-            'line-color': '#666',
-            'target-arrow-color': '#666',
-            'target-arrow-shape': 'triangle',
-            'target-arrow-width': 4,
-            'curve-style': 'bezier'
-          }}
-        }}
-      ],
-      layout: {{
-        name: 'preset',
-        fit: true,
-        padding: 50
-      }},
-      minZoom: 0.1,
-      maxZoom: 2,
-      wheelSensitivity: 0.2,
-      motionBlur: true,
-      boxSelectionEnabled: false,
-      autoungrabify: false,
-    }});
-    document.getElementById('pod-select').onchange = function() {{
-      let pod = this.value;
-      currentPod = pod;
-      let nodes, edges;
-      if (pod && podNodes[pod]) {{
-        nodes = coreNodes.concat(podNodes[pod]);
-        edges = podEdges[pod];
-      }} else {{
-        nodes = coreNodes;
-        edges = [];
-      }}
-      cy.elements().remove();
-      cy.add(nodes.concat(edges));
-      cy.layout({{name: 'preset', fit: true, padding: 50}}).run();
-      // 移除所有IBCR<->IBSP边
-      ibcrIbspEdgesAdded.forEach(eid => {{ try{{cy.remove(eid);}}catch(e){{}} }});
-      ibcrIbspEdgesAdded = [];
-    }};
-    function showInfoPanel(html) {{
-      document.getElementById('info-panel-content').innerHTML = html;
-      document.getElementById('info-panel').style.display = 'block';
-    }}
-    cy.on('tap', 'edge', function(evt) {{
-      var edge = evt.target;
-      var src = edge.data('source');
-      var dst = edge.data('target');
-      var src_ports = edge.data('src_ports') || [];
-      var dst_ports = edge.data('dst_ports') || [];
-      showInfoPanel(
-        '<b>链路信息</b><br>' +
-        '源设备: ' + src + '<br>' +
-        '目标设备: ' + dst + '<br>' +
-        '源端口: ' + src_ports.join(', ') + '<br>' +
-        '目标端口: ' + dst_ports.join(', ')
-      );
-    }});
-    cy.on('tap', 'node', function(evt) {{
-      var node = evt.target;
-      var edges = node.connectedEdges();
-      var html = '<b>设备: ' + node.id() + '</b><br>连接数量: ' + edges.length + '<br>';
-      edges.forEach(function(edge) {{
-        var peer = (edge.data('source') === node.id()) ? edge.data('target') : edge.data('source');
-        var src_ports = edge.data('src_ports') || [];
-        var dst_ports = edge.data('dst_ports') || [];
-        html += '对端: ' + peer + ' | 源端口: ' + src_ports.join(', ') + ' | 目标端口: ' + dst_ports.join(', ') + '<br>';
-      }});
-      showInfoPanel(html);
-      if(node.data('layer') === 'core' && currentPod && ibcrIbspEdgesMap[currentPod]) {{
-        ibcrIbspEdgesAdded.forEach(eid => {{ try{{cy.remove(eid);}}catch(e){{}} }});
-        ibcrIbspEdgesAdded = [];
-        let connectedSpineEdges = [];
-        for (let spine in ibcrIbspEdgesMap[currentPod]) {{
-          ibcrIbspEdgesMap[currentPod][spine].forEach(function(edge) {{
-            if (edge.data.source === node.id() || edge.data.target === node.id()) {{
-              connectedSpineEdges.push(edge);
-            }}
-          }});
-        }}
-        connectedSpineEdges.forEach(function(edge) {{
-          let ele = cy.add(edge);
-          ibcrIbspEdgesAdded.push(ele);
-        }});
-      }}
-      if(node.data('layer') === 'spine' && currentPod && ibcrIbspEdgesMap[currentPod] && ibcrIbspEdgesMap[currentPod][node.id()]) {{
-        ibcrIbspEdgesAdded.forEach(eid => {{ try{{cy.remove(eid);}}catch(e){{}} }});
-        ibcrIbspEdgesAdded = [];
-        ibcrIbspEdgesMap[currentPod][node.id()].forEach(function(edge) {{
-          let ele = cy.add(edge);
-          ibcrIbspEdgesAdded.push(ele);
-        }});
-      }}
-    }});
-    cy.on('tap', function(evt) {{
-      if(evt.target === cy) {{
-        document.getElementById('info-panel').style.display = 'none';
-        ibcrIbspEdgesAdded.forEach(eid => {{ try{{cy.remove(eid);}}catch(e){{}} }});
-        ibcrIbspEdgesAdded = [];
-      }}
-    }});
-    document.getElementById('debug-info').innerHTML = '初始化成功<br>节点数: ' + cy.nodes().length + '<br>边数: ' + cy.edges().length;
-  </script>
-  <!--
+    <strong>CLOS三层架构拓扑图</strong><br>
+    Core层(IBCR): {len(core_list)} 个<br>
+    Spine层(IBSP): {len(spine_list)} 个<br>
+    Leaf层(IBLF): {len(leaf_list)} 个
+  </div>
+  <div class="legend">
+    <strong>CLOS三层架构</strong><br>
+    <div class="legend-item"><div class="legend-color" style="background-color: {LAYER_STYLES['core']['color']};"></div><span>Core层 (IBCR)</span></div>
+    <div class="legend-item"><div class="legend-color" style="background-color: {LAYER_STYLES['spine']['color']};"></div><span>Spine层 (IBSP)</span></div>
+    <div class="legend-item"><div class="legend-color" style="background-color: {LAYER_STYLES['leaf']['color']};"></div><span>Leaf层 (IBLF)</span></div>
+  </div>
+  <div class="debug">
+    <strong>调试信息</strong><br>
+    <div id="debug-info">正在加载...</div>
+  </div>
+  <div id="cy"></div>
+  <!-- 信息浮层子页面 -->
+  <div id="info-panel" style="display:none;position:fixed;top:0;right:0;height:100vh;width:350px;background:#fff;box-shadow:-2px 0 10px rgba(0,0,0,0.1);z-index:9999;padding:24px;overflow-y:auto;">
+    <div id="info-panel-content"></div>
+    <button onclick="document.getElementById('info-panel').style.display='none'" style="position:absolute;top:8px;right:8px;">关闭</button>
+  </div>
+  <!-- 安全传递大JSON数据 -->
+{data_html}{PAYLOAD_MARKER}
   <script>
-    // 安全获取大JSON数据
-    const coreNodes = JSON.parse(document.getElementById('core-nodes-data').textContent);
-    const podNodes = JSON.parse(document.getElementById('pod-nodes-data').textContent);
-    const podEdges = JSON.parse(document.getElementById('pod-edges-data').textContent);
-    const podList = JSON.parse(document.getElementById('pod-list-data').textContent);
-    const ibcrIbspEdgesMap = JSON.parse(document.getElementById('ibcr-ibsp-edges-map-data').textContent);
+{data_js}
     let currentPod = null;
-    let ibcrIbspEdgesAdded = [];
+    let overlayEdges = null;
+    // 已加入画布的 POD 元素常驻，切换 POD 时只在批量更新中切换可见性
+    const residentPods = {{}};
     // 初始只显示Core
     let cy = cytoscape({{
       container: document.getElementById('cy'),
@@ -610,7 +2472,7 @@ html = f"""
             'color': '#222',
             'font-size': '11px',
             'text-wrap': 'wrap',
-            'text-max-width': '" + String(label_width_js) + "px',
+            'text-max-width': '{label_width_js}px',
             'border-width': 2,
             'border-color': '#fff',
             'font-weight': 'bold'
@@ -626,7 +2488,8 @@ html = f"""
             'target-arrow-width': 4,
             'curve-style': 'bezier'
           }}
-        }}
+        }},
+{layer_styles_js}
       ],
       layout: {{
         name: 'preset',
@@ -640,73 +2503,1363 @@ html = f"""
       boxSelectionEnabled: false,
       autoungrabify: false,
     }});
-    document.getElementById('pod-select').onchange = function() {{
-      let pod = this.value;
-      currentPod = pod;
-      let nodes, edges;
-      if (pod && podNodes[pod]) {{
-        nodes = coreNodes.concat(podNodes[pod]);
-        edges = podEdges[pod];
-      }} else {{
-        nodes = coreNodes;
-        edges = [];
+    function clearOverlay() {{
+      if (overlayEdges) {{
+        overlayEdges.remove();
+        overlayEdges = null;
+      }}
+    }}
+    function showOverlay(edges) {{
+      cy.batch(function() {{
+        clearOverlay();
+        overlayEdges = cy.add(edges);
+      }});
+    }}
+    // 捆绑模式：同一设备对之间的平行链路聚合为一条边，点击或放大超过阈值时展开为逐端口链路
+    const BUNDLE_ZOOM = {bundle_zoom_js};
+    const bundleMembers = {{}};  // 捆绑边 ID -> {{pod, edges: 成员边定义, eles: 已加入画布的成员边}}
+    const expandedBundles = new Set();
+    function bundleEdges(pod, edges) {{
+      // 载荷中同一设备对的链路连续存放，按游程聚合；单条链路保持原样
+      const out = [];
+      for (let i = 0; i < edges.length;) {{
+        const a = edges[i].data.source, b = edges[i].data.target;
+        let j = i + 1;
+        while (j < edges.length && ((edges[j].data.source === a && edges[j].data.target === b) ||
+                                    (edges[j].data.source === b && edges[j].data.target === a))) j++;
+        if (j - i === 1) {{
+          out.push(edges[i]);
+        }} else {{
+          const members = edges.slice(i, j);
+          const id = a + '<=>' + b;
+          const srcPorts = [], dstPorts = [];
+          members.forEach(function(edge) {{
+            const forward = edge.data.source === a;
+            srcPorts.push((forward ? edge.data.src_ports : edge.data.dst_ports)[0]);
+            dstPorts.push((forward ? edge.data.dst_ports : edge.data.src_ports)[0]);
+          }});
+          bundleMembers[id] = {{pod: pod, edges: members, eles: null}};
+          out.push({{data: {{id: id, source: a, target: b, count: members.length, src_ports: srcPorts, dst_ports: dstPorts}}, classes: 'bundle'}});
+        }}
+        i = j;
+      }}
+      return out;
+    }}
+    function expandBundle(bundle) {{
+      const entry = bundleMembers[bundle.id()];
+      if (!entry || expandedBundles.has(bundle.id())) return;
+      cy.batch(function() {{
+        if (!entry.eles) {{
+          // 成员边首次展开时才加入画布，并归入所属 POD 以参与可见性切换
+          entry.eles = cy.add(entry.edges);
+          residentPods[entry.pod] = residentPods[entry.pod].union(entry.eles);
+        }} else {{
+          entry.eles.removeClass('collapsed');
+        }}
+        bundle.addClass('collapsed');
+      }});
+      expandedBundles.add(bundle.id());
+    }}
+    function collapseBundles() {{
+      cy.batch(function() {{
+        expandedBundles.forEach(function(id) {{
+          bundleMembers[id].eles.addClass('collapsed');
+          cy.getElementById(id).removeClass('collapsed');
+        }});
+      }});
+      expandedBundles.clear();
+    }}
+    function updateBundles() {{
+      if (cy.zoom() < BUNDLE_ZOOM) {{
+        collapseBundles();
+        return;
       }}
-      cy.elements().remove();
-      cy.add(nodes.concat(edges));
-      cy.layout({{name: 'preset', fit: true, padding: 50}}).run();
-      // 移除所有IBCR<->IBSP边
-      ibcrIbspEdgesAdded.forEach(eid => {{ try{{cy.remove(eid);}}catch(e){{}} }});
-      ibcrIbspEdgesAdded = [];
+      const ext = cy.extent();
+      function inView(p) {{
+        return p.x >= ext.x1 && p.x <= ext.x2 && p.y >= ext.y1 && p.y <= ext.y2;
+      }}
+      cy.batch(function() {{
+        cy.edges('.bundle:visible').forEach(function(bundle) {{
+          if (inView(bundle.source().position()) || inView(bundle.target().position())) expandBundle(bundle);
+        }});
+      }});
+    }}
+    if (BUNDLE_ZOOM !== null) {{
+      let bundleTimer = null;
+      cy.on('zoom pan', function() {{
+        clearTimeout(bundleTimer);
+        bundleTimer = setTimeout(updateBundles, 100);
+      }});
+    }}
+    function showPod(pod) {{
+      currentPod = pod;
+      const shown = new Set(pod === 'ALL' ? podList.filter(function(p) {{ return p !== 'ALL'; }}) : [pod]);
+      return Promise.all([loadCore(), loadPod(pod)]).then(function() {{
+        // 加载期间已切换到其他 POD 时放弃本次结果
+        if (currentPod !== pod) return;
+        cy.batch(function() {{
+          // 移除所有IBCR<->IBSP边
+          clearOverlay();
+          clearPath();
+          shown.forEach(function(p) {{
+            if (!residentPods[p] && podNodes[p]) {{
+              const edges = BUNDLE_ZOOM === null ? podEdges[p] : bundleEdges(p, podEdges[p]);
+              residentPods[p] = cy.add(podNodes[p].concat(edges));
+            }}
+          }});
+          for (const p in residentPods) {{
+            if (shown.has(p)) {{
+              residentPods[p].removeClass('hidden');
+            }} else {{
+              residentPods[p].addClass('hidden');
+            }}
+          }}
+        }});
+        applyHeat();
+        cy.fit(cy.elements(':visible'), 50);
+      }}).catch(function(err) {{
+        document.getElementById('debug-info').innerHTML = String(err.message || err);
+      }});
+    }}
+    document.getElementById('pod-select').onchange = function() {{
+      showPod(this.value);
+    }};
+    // 分析着色（--analytics）：按所选指标将交换机由绿（正常）到红着色，超售比相对全网最大值
+    let colorMode = 'none';
+    let maxOversub = 1;
+    function heatOf(name) {{
+      const v = analytics && analytics[name];
+      if (!v || colorMode === 'none') return null;
+      if (colorMode === 'oversub') return v[0] === null ? null : v[0] / maxOversub;
+      if (colorMode === 'balance') return v[1] === null ? null : 1 - v[1];
+      return v[2] > 0 ? 1 : 0;
+    }}
+    function applyHeat() {{
+      if (!analytics) return;
+      cy.batch(function() {{
+        cy.nodes().forEach(function(node) {{
+          const heat = heatOf(node.id());
+          if (heat === null) {{
+            node.removeClass('heat');
+          }} else {{
+            node.data('heat', heat);
+            node.addClass('heat');
+          }}
+        }});
+      }});
+    }}
+    document.getElementById('color-mode').onchange = function() {{
+      colorMode = this.value;
+      applyHeat();
     }};
-    // 点击边显示端口号
+    function showInfoPanel(html) {{
+      document.getElementById('info-panel-content').innerHTML = html;
+      document.getElementById('info-panel').style.display = 'block';
+    }}
+    // 路径查询：在当前 POD（ALL 时为全部 POD）的链路上按跳数由少到多枚举路径，并按层计数 ECMP
+    const PATH_LIMIT = {path_limit_js};
+    const MAX_HOPS = {max_hops_js};
+    const adjacencyCache = {{}};  // POD -> 设备 -> (对端 -> 并行链路数)
+    let pathResults = [];
+    function buildAdjacency(pod) {{
+      if (adjacencyCache[pod]) return adjacencyCache[pod];
+      const adj = new Map();
+      function add(edge) {{
+        [[edge.data.source, edge.data.target], [edge.data.target, edge.data.source]].forEach(function(pair) {{
+          if (!adj.has(pair[0])) adj.set(pair[0], new Map());
+          const peers = adj.get(pair[0]);
+          peers.set(pair[1], (peers.get(pair[1]) || 0) + 1);
+        }});
+      }}
+      const pods = pod === 'ALL' ? podList.filter(function(p) {{ return p !== 'ALL'; }}) : [pod];
+      pods.forEach(function(p) {{
+        podEdges[p].forEach(add);
+        for (const spine in ibcrIbspEdgesMap[p]) ibcrIbspEdgesMap[p][spine].forEach(add);
+      }});
+      adjacencyCache[pod] = adj;
+      return adj;
+    }}
+    function hopDistances(adj, target, maxHops) {{
+      // 自目的设备反向 BFS，用于剪去在剩余跳数内无法到达目的的分支
+      const dist = new Map([[target, 0]]);
+      let frontier = [target];
+      for (let hops = 1; hops <= maxHops && frontier.length; hops++) {{
+        const next = [];
+        frontier.forEach(function(node) {{
+          adj.get(node).forEach(function(count, peer) {{
+            if (!dist.has(peer)) {{
+              dist.set(peer, hops);
+              next.push(peer);
+            }}
+          }});
+        }});
+        frontier = next;
+      }}
+      return dist;
+    }}
+    function walkPaths(adj, dist, path, used, dst, remaining, visit) {{
+      // 恰好 remaining 跳到达 dst 的简单路径逐条交给 visit，visit 返回 false 时停止
+      const node = path[path.length - 1];
+      if (remaining === 0) return node === dst ? visit(path) : true;
+      if (node === dst) return true;
+      for (const peer of adj.get(node).keys()) {{
+        if (used.has(peer) || !(dist.get(peer) <= remaining - 1)) continue;
+        path.push(peer);
+        used.add(peer);
+        const more = walkPaths(adj, dist, path, used, dst, remaining - 1, visit);
+        path.pop();
+        used.delete(peer);
+        if (!more) return false;
+      }}
+      return true;
+    }}
+    function findPaths(adj, src, dst, via, maxHops) {{
+      const found = [];
+      const toDst = hopDistances(adj, dst, maxHops);
+      function collect(path) {{
+        found.push(path.slice());
+        return found.length < PATH_LIMIT;
+      }}
+      if (!via) {{
+        for (let len = toDst.get(src); len <= maxHops && found.length < PATH_LIMIT; len++) {{
+          walkPaths(adj, toDst, [src], new Set([src]), dst, len, collect);
+        }}
+        return found;
+      }}
+      const toVia = hopDistances(adj, via, maxHops);
+      if (!toVia.has(src) || !toDst.has(via)) return found;
+      for (let len = toVia.get(src) + toDst.get(via); len <= maxHops && found.length < PATH_LIMIT; len++) {{
+        for (let head = toVia.get(src); head <= len - toDst.get(via) && found.length < PATH_LIMIT; head++) {{
+          walkPaths(adj, toVia, [src], new Set([src]), via, head, function(path) {{
+            return walkPaths(adj, toDst, path, new Set(path), dst, len - head, collect);
+          }});
+        }}
+      }}
+      return found;
+    }}
+    function ecmpCounts(adj, src, dst) {{
+      // 与命令行 --query-ecmp 相同：按层累加最短路径数（设备级与物理链路级），不枚举路径
+      const dist = new Map([[src, 0]]), paths = new Map([[src, 1]]), links = new Map([[src, 1]]);
+      let frontier = [src];
+      for (let hops = 1; hops <= 8 && frontier.length && !dist.has(dst); hops++) {{
+        const next = [];
+        frontier.forEach(function(node) {{
+          adj.get(node).forEach(function(count, peer) {{
+            if (!dist.has(peer)) {{
+              dist.set(peer, hops);
+              paths.set(peer, 0);
+              links.set(peer, 0);
+              next.push(peer);
+            }}
+            if (dist.get(peer) === hops) {{
+              paths.set(peer, paths.get(peer) + paths.get(node));
+              links.set(peer, links.get(peer) + links.get(node) * count);
+            }}
+          }});
+        }});
+        frontier = next.filter(function(node) {{ return node !== dst; }});
+      }}
+      return dist.has(dst) ? {{hops: dist.get(dst), paths: paths.get(dst), links: links.get(dst)}} : null;
+    }}
+    function clearPath() {{
+      cy.elements('.path').removeClass('path');
+    }}
+    function highlightPath(i) {{
+      const path = pathResults[i];
+      if (!path) return;
+      // core-spine 跳所需的边按需加入覆盖层，其余边已在画布上
+      const bySpine = ibcrIbspEdgesMap[currentPod] || {{}};
+      const overlay = [];
+      for (let k = 1; k < path.length; k++) {{
+        const a = path[k - 1], b = path[k];
+        (bySpine[a] || []).concat(bySpine[b] || []).forEach(function(edge) {{
+          if ((edge.data.source === a && edge.data.target === b) || (edge.data.source === b && edge.data.target === a)) overlay.push(edge);
+        }});
+      }}
+      showOverlay(overlay);
+      cy.batch(function() {{
+        clearPath();
+        for (let k = 0; k < path.length; k++) {{
+          const node = cy.getElementById(path[k]);
+          node.addClass('path');
+          if (k > 0) node.edgesWith(cy.getElementById(path[k - 1])).addClass('path');
+        }}
+      }});
+    }}
+    function runPathQuery() {{
+      function value(id) {{ return document.getElementById(id).value.trim(); }}
+      const src = value('path-src'), dst = value('path-dst'), via = value('path-via');
+      const maxHops = parseInt(value('path-hops'), 10) || MAX_HOPS;
+      const pod = currentPod;
+      if (!pod) {{
+        showInfoPanel('<b>路径查询</b><br>请先选择 POD');
+        return;
+      }}
+      loadPod(pod).then(function() {{
+        if (currentPod !== pod) return;
+        const adj = buildAdjacency(pod);
+        const missing = [src, dst, via].filter(function(name) {{ return name && !adj.has(name); }});
+        if (!src || !dst || missing.length) {{
+          showInfoPanel('<b>路径查询</b><br>' + (missing.length ? pod + ' 中未找到设备: ' + missing.join(', ') : '请输入源设备与目的设备'));
+          return;
+        }}
+        pathResults = findPaths(adj, src, dst, via, maxHops);
+        const ecmp = ecmpCounts(adj, src, dst);
+        let html = '<b>路径查询（' + pod + '）</b><br>' + src + ' → ' + dst + (via ? '（经过 ' + via + '）' : '') + '<br>';
+        html += ecmp ? 'ECMP: 最短 ' + ecmp.hops + ' 跳，设备级路径 ' + ecmp.paths + ' 条，物理链路级路径 ' + ecmp.links + ' 条<br>'
+                     : 'ECMP: 不可达<br>';
+        html += '最多 ' + maxHops + ' 跳内找到 ' + pathResults.length + ' 条路径' + (pathResults.length >= PATH_LIMIT ? '（已达上限）' : '') + '，点击高亮:<br>';
+        pathResults.forEach(function(path, i) {{
+          html += '<a href="#" onclick="highlightPath(' + i + ');return false;">链路' + (i + 1) + '</a>（' + (path.length - 1) + ' 跳）: ' + path.join(' → ') + '<br>';
+        }});
+        showInfoPanel(html);
+        highlightPath(0);
+      }}).catch(function(err) {{
+        document.getElementById('debug-info').innerHTML = String(err.message || err);
+      }});
+    }}
     cy.on('tap', 'edge', function(evt) {{
       var edge = evt.target;
       var src = edge.data('source');
       var dst = edge.data('target');
       var src_ports = edge.data('src_ports') || [];
       var dst_ports = edge.data('dst_ports') || [];
-      alert(
-        '链路: ' + src + ' → ' + dst + '\\n' +
-        '源端口: ' + src_ports.join(', ') + '\\n' +
+      // 点击捆绑边时展开为逐端口链路
+      if (edge.hasClass('bundle')) expandBundle(edge);
+      showInfoPanel(
+        '<b>链路信息</b><br>' +
+        (edge.data('count') ? '链路数量: ' + edge.data('count') + '<br>' : '') +
+        '源设备: ' + src + '<br>' +
+        '目标设备: ' + dst + '<br>' +
+        '源端口: ' + src_ports.join(', ') + '<br>' +
         '目标端口: ' + dst_ports.join(', ')
       );
     }});
-    // 点击spine节点时动态添加IBCR<->IBSP边
-    cy.on('tap', 'node', function(evt) {{
-      var node = evt.target;
-      var degree = node.connectedEdges().length;
-      alert(
-        '设备: ' + node.id() + '\\n' +
-        '连线数量: ' + degree
-      );
+    function showDevice(node) {{
+      var edges = node.connectedEdges(':visible');
+      var linkCount = 0;
+      edges.forEach(function(edge) {{ linkCount += edge.data('count') || 1; }});
+      var html = '<b>设备: ' + node.id() + '</b><br>连接数量: ' + linkCount + '<br>';
+      var metrics = analytics && analytics[node.id()];
+      if (metrics) {{
+        html += '超售比: ' + (metrics[0] === null ? '-' : metrics[0]) + ' | 扇出均衡度: ' + (metrics[1] === null ? '-' : metrics[1]) +
+                ' | 异常链路: ' + metrics[2] + '<br>';
+      }}
+      edges.forEach(function(edge) {{
+        var peer = (edge.data('source') === node.id()) ? edge.data('target') : edge.data('source');
+        var src_ports = edge.data('src_ports') || [];
+        var dst_ports = edge.data('dst_ports') || [];
+        html += '对端: ' + peer + ' | 源端口: ' + src_ports.join(', ') + ' | 目标端口: ' + dst_ports.join(', ') + '<br>';
+      }});
+      showInfoPanel(html);
+      // core 使用预建的 core -> 边 索引，无需遍历所有 spine
+      if(node.data('layer') === 'core' && currentPod && ibcrEdgesByCore[currentPod]) {{
+        showOverlay(ibcrEdgesByCore[currentPod][node.id()] || []);
+      }}
       if(node.data('layer') === 'spine' && currentPod && ibcrIbspEdgesMap[currentPod] && ibcrIbspEdgesMap[currentPod][node.id()]) {{
-        // 先移除之前的IBCR<->IBSP边
-        ibcrIbspEdgesAdded.forEach(eid => {{ try{{cy.remove(eid);}}catch(e){{}} }});
-        ibcrIbspEdgesAdded = [];
-        // 添加当前spine的IBCR<->IBSP边
-        ibcrIbspEdgesMap[currentPod][node.id()].forEach(function(edge) {{
-          let ele = cy.add(edge);
-          ibcrIbspEdgesAdded.push(ele);
-        }});
+        showOverlay(ibcrIbspEdgesMap[currentPod][node.id()]);
       }}
+    }}
+    cy.on('tap', 'node', function(evt) {{
+      showDevice(evt.target);
     }});
-    // 点击空白处移除IBCR<->IBSP边
+    // 搜索：对按名称后缀排序的 suffixes 二分查找输入前缀，每次按键只比较 O(log n) 个后缀
+    const SEARCH_LIMIT = 20;
+    const FOCUS_DEVICE = {focus_js};
+    let searchResults = [];
+    let searchPort = null;
+    function searchSuffix(k) {{
+      return searchIndex.lower[searchIndex.suffixes[2 * k]].slice(searchIndex.suffixes[2 * k + 1]);
+    }}
+    function searchDevices(query) {{
+      const q = query.toLowerCase();
+      const n = searchIndex.suffixes.length / 2;
+      let lo = 0, hi = n;
+      while (lo < hi) {{
+        const mid = (lo + hi) >> 1;
+        if (searchSuffix(mid) < q) lo = mid + 1; else hi = mid;
+      }}
+      const found = [];
+      const seen = new Set();
+      for (let k = lo; k < n && found.length < SEARCH_LIMIT && searchSuffix(k).startsWith(q); k++) {{
+        const d = searchIndex.suffixes[2 * k];
+        if (!seen.has(d)) {{
+          seen.add(d);
+          found.push(d);
+        }}
+      }}
+      // 完整名称相同的设备排在最前
+      return found.sort(function(a, b) {{ return (searchIndex.lower[b] === q) - (searchIndex.lower[a] === q); }});
+    }}
+    function focusDevice(d, port) {{
+      const name = searchIndex.devices[d];
+      const pod = podList[searchIndex.pods[d]];
+      // Core 在所有视图中可见，保持当前视图；ALL 视图中已包含所有 POD
+      const target = pod === 'ALL' || currentPod === 'ALL' ? currentPod || 'ALL' : pod;
+      document.getElementById('search-results').style.display = 'none';
+      document.getElementById('pod-select').value = target;
+      (target === currentPod ? Promise.resolve() : showPod(target)).then(function() {{
+        const node = cy.getElementById(name);
+        if (node.empty()) return;
+        showDevice(node);
+        cy.batch(function() {{
+          clearPath();
+          node.addClass('path');
+          let edges = node.connectedEdges(':visible');
+          if (port) {{
+            edges = edges.filter(function(edge) {{
+              const ports = edge.data('source') === name ? edge.data('src_ports') : edge.data('dst_ports');
+              return (ports || []).indexOf(port) >= 0;
+            }});
+          }}
+          edges.addClass('path');
+        }});
+        cy.animate({{center: {{eles: node}}, zoom: Math.max(cy.zoom(), 1)}}, {{duration: 300}});
+      }});
+    }}
+    const searchBox = document.getElementById('search-box');
+    searchBox.oninput = function() {{
+      const panel = document.getElementById('search-results');
+      const text = this.value.trim();
+      if (!searchIndex || !text) {{
+        panel.style.display = 'none';
+        return;
+      }}
+      // 设备:端口 —— 端口在所属 POD 载荷加载后按链路端口匹配
+      const colon = text.lastIndexOf(':');
+      searchPort = colon > 0 ? text.slice(colon + 1) : null;
+      searchResults = searchDevices(colon > 0 ? text.slice(0, colon) : text);
+      panel.innerHTML = searchResults.length ? searchResults.map(function(d, i) {{
+        return '<div style="padding:4px 8px;cursor:pointer;" onclick="focusDevice(searchResults[' + i + '], searchPort)">' +
+               escapeHtml(searchIndex.devices[d]) + (searchPort ? ':' + escapeHtml(searchPort) : '') +
+               ' <span style="color:#888;">' + (searchIndex.pods[d] ? podList[searchIndex.pods[d]] : 'Core') + '</span></div>';
+      }}).join('') : '<div style="padding:4px 8px;color:#888;">无匹配设备</div>';
+      panel.style.display = 'block';
+    }};
+    searchBox.onkeydown = function(evt) {{
+      if (evt.key === 'Enter' && searchResults.length) focusDevice(searchResults[0], searchPort);
+      if (evt.key === 'Escape') document.getElementById('search-results').style.display = 'none';
+    }};
+    function escapeHtml(text) {{
+      return String(text).replace(/[&<>"']/g, function(c) {{
+        return {{'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}}[c];
+      }});
+    }}
     cy.on('tap', function(evt) {{
       if(evt.target === cy) {{
-        ibcrIbspEdgesAdded.forEach(eid => {{ try{{cy.remove(eid);}}catch(e){{}} }});
-        ibcrIbspEdgesAdded = [];
+        document.getElementById('info-panel').style.display = 'none';
+        clearOverlay();
+        clearPath();
+        if (BUNDLE_ZOOM !== null && cy.zoom() < BUNDLE_ZOOM) collapseBundles();
+      }}
+    }});
+    loadCore().then(function() {{
+      if (cy.nodes().length === 0) {{
+        cy.add(coreNodes);
+        cy.fit(undefined, 50);
+      }}
+      if (analytics) {{
+        for (const name in analytics) {{
+          if (analytics[name][0] !== null) maxOversub = Math.max(maxOversub, analytics[name][0]);
+        }}
+        document.getElementById('color-mode-box').style.display = 'inline';
       }}
+      document.getElementById('debug-info').innerHTML = '初始化成功<br>节点数: ' + cy.nodes().length + '<br>边数: ' + cy.edges().length;
+      if (FOCUS_DEVICE && searchIndex && searchIndex.devices.indexOf(FOCUS_DEVICE) >= 0) {{
+        focusDevice(searchIndex.devices.indexOf(FOCUS_DEVICE), null);
+      }}
+    }}).catch(function(err) {{
+      document.getElementById('debug-info').innerHTML = String(err.message || err);
     }});
-    document.getElementById('debug-info').innerHTML = '初始化成功<br>节点数: ' + cy.nodes().length + '<br>边数: ' + cy.edges().length;
-    // 页面加载后自动触发一次POD切换事件
-    document.getElementById('pod-select').dispatchEvent(new Event('change'));
   </script>
-  -->
 </body>
 </html>
 """
+    head, tail = html.split(PAYLOAD_MARKER)
+    return chain((head,), data_chunks, (tail,))
+
+
+def write_html(html, output_path):
+    write_chunks((html,), output_path)
+
+
+def write_chunks(chunks, output_path):
+    """逐段写出文本片段（可为生成器），内存占用只与单个片段有关。"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+# 图导出（--export）：与页面相同的 Core/Spine/Leaf 与 leaf-spine、core-spine 物理链路，
+# 逐行生成并流式写出，内存占用与链路数无关
+EXPORT_FORMATS = {'jsonl': '.jsonl', 'graphml': '.graphml', 'dot': '.dot'}
+
+
+class FabricExport:
+    """导出用的设备与链路视图：links 为物理链路的记录下标（镜像记录只取一条）。"""
+
+    def __init__(self, graph, partition):
+        self.graph = graph
+        self.pod_of = partition.pod_index.pod_of
+        self.pods_only = partition.pods_only
+        marked = bytearray(len(graph.device_names))
+        for layer_code in (LAYER_CORE, LAYER_SPINE, LAYER_LEAF):
+            for d in graph.devices_in_layer(layer_code):
+                marked[d] = 1
+        for i in self.iter_links():
+            marked[graph.src[i]] = marked[graph.dst[i]] = 1
+        self.devices = [d for d in range(len(marked)) if marked[d]]
+
+    def iter_links(self):
+        return chain(self.graph.leaf_spine_links, self.graph.core_spine_links)
+
+    def pod(self, dev_id):
+        k = self.pod_of[dev_id]
+        return self.pods_only[k] if k >= 0 else ''
+
+    def link_pod(self, i):
+        return self.pod(self.graph.src[i]) or self.pod(self.graph.dst[i])
+
+    def jsonl(self):
+        graph = self.graph
+        for i in self.iter_links():
+            source, source_port, target, target_port = graph.link(i)
+            yield to_json({'source': source, 'source_port': source_port, 'target': target,
+                           'target_port': target_port, 'pod': self.link_pod(i)}) + '\n'
+
+    def graphml(self):
+        graph, names, layer = self.graph, self.graph.device_names, self.graph.device_layer
+        yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+               '  <key id="layer" for="node" attr.name="layer" attr.type="string"/>\n'
+               '  <key id="pod" for="node" attr.name="pod" attr.type="string"/>\n'
+               '  <key id="rack" for="node" attr.name="rack" attr.type="string"/>\n'
+               '  <key id="row" for="node" attr.name="row" attr.type="string"/>\n'
+               '  <key id="source_port" for="edge" attr.name="source_port" attr.type="string"/>\n'
+               '  <key id="target_port" for="edge" attr.name="target_port" attr.type="string"/>\n'
+               '  <key id="link_pod" for="edge" attr.name="pod" attr.type="string"/>\n'
+               '  <graph id="fabric" edgedefault="undirected">\n')
+        for d in self.devices:
+            yield (f'    <node id="{escape(names[d])}"><data key="layer">{LAYER_NAMES[layer[d]]}</data>'
+                   f'<data key="pod">{escape(self.pod(d))}</data><data key="rack">{escape(graph.device_rack[d])}</data>'
+                   f'<data key="row">{escape(graph.device_row[d])}</data></node>\n')
+        for i in self.iter_links():
+            source, source_port, target, target_port = graph.link(i)
+            yield (f'    <edge source="{escape(source)}" target="{escape(target)}">'
+                   f'<data key="source_port">{escape(source_port)}</data>'
+                   f'<data key="target_port">{escape(target_port)}</data>'
+                   f'<data key="link_pod">{escape(self.link_pod(i))}</data></edge>\n')
+        yield '  </graph>\n</graphml>\n'
+
+    def dot(self):
+        graph, names, layer = self.graph, self.graph.device_names, self.graph.device_layer
+        yield 'graph fabric {\n'
+        for d in self.devices:
+            yield (f'  {_dot_id(names[d])} [layer={LAYER_NAMES[layer[d]]}, pod={_dot_id(self.pod(d))}, '
+                   f'rack={_dot_id(graph.device_rack[d])}, row={_dot_id(graph.device_row[d])}];\n')
+        for i in self.iter_links():
+            source, source_port, target, target_port = graph.link(i)
+            yield (f'  {_dot_id(source)} -- {_dot_id(target)} '
+                   f'[taillabel={_dot_id(source_port)}, headlabel={_dot_id(target_port)}];\n')
+        yield '}\n'
+
+
+def _dot_id(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def write_exports(formats, graph, partition, stem):
+    """按 --export 写出 <stem>.<扩展名>，返回写出的路径列表。"""
+    exporter = FabricExport(graph, partition)
+    paths = []
+    for fmt in formats:
+        path = stem + EXPORT_FORMATS[fmt]
+        write_chunks(getattr(exporter, fmt)(), path)
+        paths.append(path)
+    return paths
+
+
+# 调试：输出指定leaf的所有链路和edges中的所有相关边
+def print_leaf_debug(graph, target_leaf):
+    dev_id = graph.device_ids.get(target_leaf)
+    leaf_links = [graph.link(i) for i in graph.links_of(dev_id)] if dev_id is not None else []
+    print(f'{target_leaf} 相关链路总数: {len(leaf_links)}')
+    for link in leaf_links:
+        print(link)
+    leaf_edges = [graph.link(i) for i in graph.leaf_spine_links
+                  if dev_id in (graph.src[i], graph.dst[i])]
+    print(f'edges中 {target_leaf} 相关边数: {len(leaf_edges)}')
+    for e in leaf_edges:
+        print(e)
+
+
+def run_validate(args, csv_path, graph, report):
+    """--validate：输出校验摘要与报告文件，返回退出码（见 EXIT_VALIDATION_*）。"""
+    result = validate_graph(graph, report)
+    report_path = args.validate_report or f'{os.path.splitext(args.output)[0]}.validation.json'
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(result.to_dict(), csv=csv_path), f, ensure_ascii=False, indent=2)
+    stats = result.stats
+    print(f'校验: {csv_path}（链路记录 {stats["records"]} 条，物理链路 {stats["links"]} 条，'
+          f'主机 {stats["hosts"]} 台，对端未导出 {stats["peers_not_exported"]} 条）')
+    counts = result.counts()
+    for kind, (severity, description) in VALIDATION_KINDS.items():
+        if kind not in counts:
+            continue
+        print(f'  [{"错误" if severity == "error" else "警告"}] {kind}: {counts[kind]} 处 — {description}')
+        samples = [issue for issue in result.issues if issue['kind'] == kind][:args.max_chains]
+        for issue in samples:
+            endpoint = issue['device'] + (f':{issue["port"]}' if issue['port'] is not None else '')
+            peer = f' → {issue["peer"]}:{issue["peer_port"]}' if issue['peer'] is not None else ''
+            print(f'      {endpoint}{peer}')
+    errors, warnings = result.severity_count('error'), result.severity_count('warning')
+    print(f'  共 {errors} 个错误，{warnings} 个警告；报告: {report_path}')
+    return result.exit_code(args.strict)
+
+
+def run_query(args, graph):
+    """--query-paths / --query-ecmp / --ecmp-pod：在终端输出查询结果。"""
+    index = PathIndex(graph)
+    try:
+        if args.query_paths:
+            src, dst = args.query_paths
+            found = list(islice(index.paths(src, dst, args.max_hops, args.via), args.max_chains))
+            via = f'，经过 {args.via}' if args.via else ''
+            print(f'{src} 到 {dst} 的路径（最多 {args.max_hops} 跳{via}，前 {args.max_chains} 条）: {len(found)} 条')
+            for i, path in enumerate(found):
+                links = index.path_links(path)
+                print(f'链路{i + 1}: {index.describe(path)}（{len(path) - 1} 跳，各跳并行链路 {"×".join(map(str, links))}）')
+        if args.query_paths or args.query_ecmp:
+            src, dst = args.query_paths or args.query_ecmp
+            ecmp = index.ecmp(src, dst)
+            if ecmp is None:
+                print(f'ECMP: {src} 与 {dst} 之间不可达')
+            else:
+                print(f'ECMP: 最短 {ecmp[0]} 跳，设备级路径 {ecmp[1]} 条，物理链路级路径 {ecmp[2]} 条')
+        if args.ecmp_pod:
+            leaves = partition_pods(graph).pod_leaves.get(args.ecmp_pod)
+            if not leaves:
+                print(f'错误: 未找到 POD {args.ecmp_pod} 或其中没有 Leaf', file=sys.stderr)
+                return 1
+            counts = index.pairwise_ecmp(leaves)
+            reachable = {pair: c for pair, c in counts.items() if c is not None}
+            print(f'{args.ecmp_pod}: {len(leaves)} 台 Leaf，{len(counts)} 个 Leaf 对，'
+                  f'不可达 {len(counts) - len(reachable)} 对')
+            if reachable:
+                device_paths = [c[1] for c in reachable.values()]
+                link_paths = [c[2] for c in reachable.values()]
+                print(f'  设备级 ECMP: 最少 {min(device_paths)}，最多 {max(device_paths)}；'
+                      f'物理链路级: 最少 {min(link_paths)}，最多 {max(link_paths)}')
+                degraded = sorted((c[2], pair) for pair, c in reachable.items() if c[2] < max(link_paths))
+                for link_count, (a, b) in degraded[:args.max_chains]:
+                    print(f'  低于最大值: {a} ↔ {b}（{link_count} 条）')
+    except KeyError as e:
+        print(f'错误: {e.args[0]}', file=sys.stderr)
+        return 1
+    return 0
+
+
+def run_focus(args, graph, cytoscape_js=None, metrics=None):
+    """--focus：将设备 --hops 跳内的邻域子图写成独立页面 <输出名>-<设备名>.html。"""
+    try:
+        with (metrics or RunMetrics(enabled=False)).stage('focus_extract'):
+            subgraph, depth = ego_graph(graph, args.focus, args.hops)
+    except KeyError as e:
+        print(f'错误: {e.args[0]}', file=sys.stderr)
+        return 1
+    safe_name = re.sub(r'[^\w.-]', '_', args.focus)
+    output = f'{os.path.splitext(args.output)[0]}-{safe_name}.html'
+    page = write_page(subgraph, args, output, cytoscape_js=cytoscape_js, metrics=metrics, focus=args.focus)
+    exports = write_exports(args.export, subgraph, page.partition, os.path.splitext(output)[0]) if args.export else []
+    per_hop = [sum(1 for h in depth.values() if h == hop) for hop in range(1, args.hops + 1)]
+    print(f'已生成: {output}')
+    print(f'  聚焦: {args.focus}，{args.hops} 跳内交换机 {len(depth)} 台'
+          f'（逐跳新增 {" / ".join(map(str, per_hop))}），链路记录 {subgraph.num_links} 条')
+    if exports:
+        print(f'  导出: {", ".join(exports)}')
+    return 0
+
+
+CACHE_STATUS_TEXT = {
+    'hit': '命中',
+    'miss': '未命中（已写入缓存）',
+    'rebuilt': '已重建',
+    'disabled': '未启用',
+    'history': '未使用（来自历史库）',
+}
+
+
+def report_ingest(csv_path, report, debug=False):
+    if report.malformed:
+        print(f'警告: {csv_path} 中有 {report.malformed} 行格式错误，已跳过', file=sys.stderr)
+        if debug:
+            for sample in report.samples:
+                print(f'  {sample}', file=sys.stderr)
+    if report.duplicates:
+        print(f'警告: {csv_path} 中有 {len(report.duplicates)} 个 (System, Port) 重复出现，已以最后一行为准'
+              '（--validate 查看明细）', file=sys.stderr)
+
+
+@dataclass
+class PageOutput:
+    partition: PodPartition
+    payloads: TopologyPayloads
+    shard_dir: Optional[str] = None
+    shards_written: int = 0
+    render_stats: Dict[str, int] = field(default_factory=dict)
+    analytics: Optional[FabricAnalytics] = None
+
+
+def write_page(graph, args, output, reuse=None, cytoscape_js=None, metrics=None, focus=None):
+    """按命令行选项完成 POD 划分、布局、序列化与渲染，写出 output（--shard 时连同分片目录）。"""
+    metrics = metrics or RunMetrics(enabled=False)
+    with metrics.stage('pod_partition'):
+        partition = partition_pods(graph)
+    with metrics.stage('layout'):
+        layout = layout_topology(graph, partition, LayoutOptions.from_args(args))
+    analytics = None
+    if args.analytics:
+        with metrics.stage('analytics'):
+            analytics = analyze_fabric(graph, partition)
+    with metrics.stage('serialize'):
+        payloads = build_payloads(graph, partition, layout, reuse, analytics)
+    page = PageOutput(partition, payloads, analytics=analytics)
+    if args.shard:
+        with metrics.stage('shard_write'):
+            page.shard_dir = shard_dir_for(output)
+            page.shards_written = write_shards(page.shard_dir, payloads, payloads.unchanged_pods)
+    with metrics.stage('render'):
+        chunks = render_html_chunks(graph, partition, layout, label_width=args.label_width, payloads=payloads,
+                                    shard_dir=os.path.basename(page.shard_dir) if page.shard_dir else None,
+                                    compress=args.compress, stats=page.render_stats,
+                                    bundle_zoom=args.bundle_zoom if args.bundle else None,
+                                    cytoscape_js=cytoscape_js, path_limit=args.max_chains, max_hops=args.max_hops,
+                                    focus=focus)
+    with metrics.stage('html_write'):
+        write_chunks(chunks, output)
+    metrics.record_page(graph, page, output)
+    return page
+
+
+# 批量模式：每份导出在独立进程中生成，单个输入失败只记入索引页，不影响其他输入
+BATCH_CSV_SUFFIXES = ('.csv', '.csv.gz', '.csv.xz', '.csv.bz2')
+
+
+def collect_batch_inputs(specs):
+    """展开 --batch 的输入：目录递归查找 CSV（含压缩文件），其余按 glob 模式匹配；去重后排序。"""
+    found = set()
+    for spec in specs:
+        if os.path.isdir(spec):
+            for root, _, files in os.walk(spec):
+                found.update(os.path.join(root, name) for name in files
+                             if name.lower().endswith(BATCH_CSV_SUFFIXES))
+        else:
+            found.update(p for p in glob.glob(spec, recursive=True) if os.path.isfile(p))
+    return sorted(found)
+
+
+def batch_output_names(paths):
+    """以输入相对公共目录的路径命名页面，不同目录下的同名导出不会互相覆盖。"""
+    if not paths:
+        return []
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+    names = []
+    for p in paths:
+        rel = os.path.relpath(os.path.abspath(p), root)
+        for suffix in BATCH_CSV_SUFFIXES[::-1]:
+            if rel.lower().endswith(suffix):
+                rel = rel[:-len(suffix)]
+                break
+        names.append(rel.replace(os.sep, '__') + '.html')
+    return names
+
+
+def run_batch_item(args, csv_path, output, cytoscape_js=None, rules=None):
+    """批量模式的单个任务（在工作进程中执行），返回写入索引页的记录。"""
+    start = time.perf_counter()
+    item = {'csv': csv_path, 'output': output}
+    try:
+        cache = None if args.no_cache else ParseCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+        graph, report, cache_status = load_graph(csv_path, cache, args.rebuild_cache, rules=rules)
+        page = write_page(graph, args, output, cytoscape_js=cytoscape_js)
+        exports = write_exports(args.export, graph, page.partition, os.path.splitext(output)[0]) if args.export else []
+        item.update(ok=True, exports=exports, cores=len(graph.core_list), spines=len(graph.spine_list),
+                    leaves=len(graph.leaf_list), pods=len(page.partition.pods_only),
+                    links=graph.num_links, malformed=report.malformed, cache=cache_status)
+    except Exception as e:  # 隔离单个输入的任何失败
+        item.update(ok=False, error=f'{type(e).__name__}: {e}')
+    item['seconds'] = round(time.perf_counter() - start, 3)
+    return item
+
+
+def render_batch_index(items):
+    rows = []
+    for item in items:
+        name = os.path.basename(item['output'])
+        if item['ok']:
+            links = [f'<a href="{escape(name)}">{escape(name)}</a>']
+            links += [f'<a href="{escape(os.path.basename(path))}">{escape(os.path.splitext(path)[1][1:])}</a>'
+                      for path in item['exports']]
+            cells = [' '.join(links), escape(item['csv'])]
+            cells += [str(item[k]) for k in ('cores', 'spines', 'leaves', 'pods', 'links')]
+            cells += [f'{item["seconds"]:.2f}s', '成功' if not item['malformed'] else f'成功（跳过 {item["malformed"]} 行）']
+            rows.append('<tr>' + ''.join(f'<td>{c}</td>' for c in cells) + '</tr>')
+        else:
+            rows.append(f'<tr class="failed"><td>{escape(name)}</td><td>{escape(item["csv"])}</td>'
+                        f'<td colspan="5"></td><td>{item["seconds"]:.2f}s</td><td>失败: {escape(item["error"])}</td></tr>')
+    ok = sum(1 for item in items if item['ok'])
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>CLOS拓扑索引</title>
+  <style>
+    body {{ font-family: sans-serif; margin: 24px; }}
+    table {{ border-collapse: collapse; }}
+    th, td {{ border: 1px solid #ddd; padding: 6px 12px; text-align: left; }}
+    th {{ background: #f4f6f8; }}
+    tr.failed td {{ background: #fdecea; }}
+  </style>
+</head>
+<body>
+  <h2>CLOS拓扑索引</h2>
+  <p>生成时间: {time.strftime('%Y-%m-%d %H:%M:%S')} | 共 {len(items)} 份导出，成功 {ok}，失败 {len(items) - ok}</p>
+  <table>
+    <tr><th>页面</th><th>CSV</th><th>Core</th><th>Spine</th><th>Leaf</th><th>POD</th><th>链路</th><th>耗时</th><th>状态</th></tr>
+    {chr(10).join('    ' + row for row in rows).lstrip()}
+  </table>
+</body>
+</html>
+"""
+
+
+def run_batch(args, cytoscape_js=None, rules=None):
+    inputs = collect_batch_inputs(args.batch)
+    if not inputs:
+        print(f'错误: 批量输入中未找到 CSV: {" ".join(args.batch)}', file=sys.stderr)
+        return 1
+    os.makedirs(args.batch_dir, exist_ok=True)
+    outputs = [os.path.join(args.batch_dir, name) for name in batch_output_names(inputs)]
+    jobs = max(1, min(args.jobs or os.cpu_count() or 1, len(inputs)))
+    start = time.perf_counter()
+    items = []
+
+    def done(item):
+        items.append(item)
+        status = f'完成 -> {item["output"]}' if item['ok'] else f'失败: {item["error"]}'
+        print(f'[{len(items)}/{len(inputs)}] {item["csv"]} {status}（{item["seconds"]:.2f}s）')
+
+    if jobs == 1:
+        for csv_path, output in zip(inputs, outputs):
+            done(run_batch_item(args, csv_path, output, cytoscape_js, rules))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(run_batch_item, args, csv_path, output, cytoscape_js, rules): (csv_path, output)
+                       for csv_path, output in zip(inputs, outputs)}
+            for future in as_completed(futures):
+                try:
+                    item = future.result()
+                except Exception as e:  # 工作进程异常退出（例如被系统终止）
+                    csv_path, output = futures[future]
+                    item = {'csv': csv_path, 'output': output, 'ok': False,
+                            'error': f'{type(e).__name__}: {e}', 'seconds': 0.0}
+                done(item)
+    items.sort(key=lambda item: item['csv'])
+    index_path = os.path.join(args.batch_dir, 'index.html')
+    write_html(render_batch_index(items), index_path)
+    failed = [item for item in items if not item['ok']]
+    print(f'已生成索引: {index_path}')
+    print(f'  共 {len(items)} 份导出，成功 {len(items) - len(failed)}，失败 {len(failed)}；'
+          f'{jobs} 个进程，总耗时 {time.perf_counter() - start:.2f}s')
+    return 1 if failed else 0
+
+
+# 监视模式：常驻进程轮询导出目录，上一轮的图与载荷保留在内存中，新导出只重新生成有变化的 POD
+class CsvWatcher:
+    """返回已写入完成、且内容与上次处理的文件不同的最新导出；否则返回 None。
+
+    文件大小与修改时间在相邻两次轮询间不变，或修改时间已早于 settle 秒，才视为写入完成。
+    """
+
+    def __init__(self, pattern, settle, rules=None):
+        self.pattern = pattern
+        self.settle = settle
+        self.rules = rules
+        self.pending = None  # 上次轮询看到的 (路径, 大小, 修改时间)
+        self.seen = None  # 已处理过的 (路径, 大小, 修改时间)
+        self.content_key = None
+
+    def poll(self):
+        try:
+            path = pick_latest_csv(self.pattern)
+            if path is None:
+                return None
+            st = os.stat(path)
+        except FileNotFoundError:  # 轮询期间文件被移走
+            return None
+        signature = (path, st.st_size, st.st_mtime_ns)
+        if signature == self.seen:
+            return None
+        stable = signature == self.pending or time.time() - st.st_mtime >= self.settle
+        self.pending = signature
+        if not stable:
+            return None
+        self.seen = signature
+        key = ParseCache.key_for(path, self.rules)
+        if key == self.content_key:  # 仅修改时间变化，内容相同
+            return None
+        self.content_key = key
+        return path
+
+
+def watch_refresh(args, csv_path, cache, previous=None, cytoscape_js=None, rules=None, key=None):
+    """重新生成页面；previous 为上一轮的 (graph, payloads)，未受变化影响的 POD 载荷直接沿用。
+
+    key 为监视器轮询时已算好的内容键，解析缓存、载荷状态与历史库共用这一个键。
+    """
+    start = time.perf_counter()
+    key = key or ParseCache.key_for(csv_path, rules)
+    graph, report, cache_status = load_graph(csv_path, cache, args.rebuild_cache, rules=rules, key=key)
+    report_ingest(csv_path, report, args.debug)
+    reuse = None
+    topology_diff = None
+    if previous is not None:
+        old_graph, old_payloads = previous
+        topology_diff = diff_graphs(old_graph, graph)
+        reuse = {pod: {'nodes': old_payloads.pod_nodes[pod], 'links': old_payloads.pod_links[pod]}
+                 for pod in old_payloads.pod_links if pod not in topology_diff.touched_pods}
+    page = write_page(graph, args, args.output, reuse, cytoscape_js)
+    if args.export:
+        write_exports(args.export, graph, page.partition, os.path.splitext(args.output)[0])
+    if args.save_state:
+        save_payload_state(args.state_file or f'{args.output}.state', key, page.payloads)
+    detail = f'解析缓存: {CACHE_STATUS_TEXT[cache_status]}'
+    if args.history_db:
+        try:
+            detail += f'，历史库{ingest_snapshot(args, csv_path, graph, rules, key)}'
+        except (ValueError, sqlite3.Error) as e:
+            print(f'错误: 写入历史库失败: {e}', file=sys.stderr)
+    if topology_diff is not None:
+        detail += (f'，新增 {len(topology_diff.added)}，移除 {len(topology_diff.removed)}，'
+                   f'重新布线 {len(topology_diff.recabled)}，复用 POD 载荷 {len(page.payloads.reused_pods)} 个')
+    print(f'[{time.strftime("%H:%M:%S")}] 已生成: {args.output} <- {csv_path}'
+          f'（{detail}，耗时 {time.perf_counter() - start:.2f}s）')
+    return graph, page.payloads
+
+
+def run_watch(args, cytoscape_js=None, rules=None):
+    pattern = args.csv or args.csv_glob
+    cache = None if args.no_cache else ParseCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+    watcher = CsvWatcher(pattern, args.watch_interval, rules)
+    previous = None
+    print(f'监视中: {pattern}（每 {args.watch_interval:g}s 检查一次，Ctrl+C 退出）')
+    try:
+        while True:
+            csv_path = watcher.poll()
+            if csv_path is not None:
+                try:
+                    previous = watch_refresh(args, csv_path, cache, previous, cytoscape_js, rules,
+                                             watcher.content_key)
+                except (OSError, ValueError) as e:
+                    # 保留上一轮结果，继续等待下一份导出
+                    print(f'错误: {e}', file=sys.stderr)
+            time.sleep(args.watch_interval)
+    except KeyboardInterrupt:
+        print('已停止监视')
+    return 0
+
+
+# 服务模式：图、划分与布局只计算一次，各接口响应按需序列化，连同 gzip 结果与 ETag 放入 LRU 缓存
+@dataclass
+class CachedResponse:
+    body: bytes
+    gzipped: bytes
+    etag: str
+    content_type: str
+
+    @classmethod
+    def from_text(cls, text, content_type='application/json; charset=utf-8'):
+        body = text.encode('utf-8')
+        return cls(body, gzip.compress(body, 6, mtime=0),
+                   '"' + hashlib.sha256(body).hexdigest()[:32] + '"', content_type)
+
+
+class ResponseCache:
+    """线程安全的 LRU 缓存；生成响应时不持有锁，并发请求同一项时可能重复生成一次。"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max(1, max_entries)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, build):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        response = build()
+        with self.lock:
+            self.entries[key] = response
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return response
+
+
+class TopologyService:
+    """服务模式的数据源，接口路径（相对 /api/）：
+
+    core、pods、pod/<POD>（与分片载荷格式相同）、pod/<POD>/overlay（spine -> core-spine 边）、
+    device/<设备名>（端口与对端明细）。无对应数据时返回 None。
+    """
+
+    def __init__(self, graph, partition, layout, page_html, cache_entries=64, analytics=None):
+        self.graph = graph
+        self.partition = partition
+        self.layout = layout
+        self.analytics = analytics
+        self.page = CachedResponse.from_text(page_html, 'text/html; charset=utf-8')
+        self.pod_keys = {pod: k for k, pod in enumerate(partition.pods_only)}
+        self.cache = ResponseCache(cache_entries)
+
+    def respond(self, path):
+        if path in ('/', '/index.html'):
+            return self.page
+        if not path.startswith('/api/'):
+            return None
+        parts = [unquote(part) for part in path[len('/api/'):].split('/')]
+        if parts == ['core']:
+            return self.cache.get('core', lambda: CachedResponse.from_text(
+                encode_core(self.layout, self.analytics, build_search_index(self.graph, self.partition))))
+        if parts == ['pods']:
+            return self.cache.get('pods', lambda: CachedResponse.from_text(to_json(self.partition.pods_only)))
+        if len(parts) == 2 and parts[0] == 'pod' and parts[1] in self.pod_keys:
+            return self.cache.get(('pod', parts[1]), lambda: CachedResponse.from_text(self.pod_json(parts[1])))
+        if len(parts) == 3 and parts[0] == 'pod' and parts[2] == 'overlay' and parts[1] in self.pod_keys:
+            return self.cache.get(('overlay', parts[1]), lambda: CachedResponse.from_text(self.overlay_json(parts[1])))
+        if len(parts) == 2 and parts[0] == 'device' and parts[1] in self.graph.device_ids:
+            return self.cache.get(('device', parts[1]), lambda: CachedResponse.from_text(self.device_json(parts[1])))
+        return None
+
+    def pod_json(self, pod):
+        k = self.pod_keys[pod]
+        return json_object_from_fragments((
+            ('nodes', encode_pod_nodes(self.partition, self.layout, pod)),
+            ('links', encode_pod_links(self.graph, self.partition.pod_index, k)),
+        ))
+
+    def overlay_json(self, pod):
+        graph = self.graph
+        by_spine = {}
+        for i in self.partition.pod_index.core_spine_links[self.pod_keys[pod]]:
+            a, a_port, b, b_port = graph.link(i)
+            if graph.device_layer[graph.src[i]] == LAYER_SPINE:
+                a, a_port, b, b_port = b, b_port, a, a_port
+            by_spine.setdefault(b, []).append(
+                {'source': a, 'target': b, 'src_ports': [a_port], 'dst_ports': [b_port]})
+        return to_json(by_spine)
+
+    def device_json(self, name):
+        graph = self.graph
+        dev_id = graph.device_ids[name]
+        ports = {}
+        # 设备自身的记录在前，镜像记录只补充缺失的端口
+        for i in graph.links_of(dev_id):
+            a, a_port, b, b_port = graph.link(i)
+            if graph.src[i] != dev_id:
+                a, a_port, b, b_port = b, b_port, a, a_port
+            ports.setdefault(a_port, {'port': a_port, 'peer': b, 'peer_port': b_port,
+                                      'peer_layer': LAYER_NAMES[graph.device_class(b)[0]]})
+        return to_json({
+            'device': name,
+            'layer': LAYER_NAMES[graph.device_layer[dev_id]],
+            'pod': graph.device_pod[dev_id] or None,
+            'rack': graph.device_rack[dev_id] or None,
+            'row': graph.device_row[dev_id] or None,
+            'ports': list(ports.values()),
+        })
+
+
+class TopologyRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'ufm-topology'
+
+    def do_GET(self):
+        response = self.server.service.respond(urlsplit(self.path).path)
+        if response is None:
+            response = CachedResponse.from_text(to_json({'error': f'未找到: {self.path}'}))
+            self.send_response(404)
+        elif self.headers.get('If-None-Match') == response.etag:
+            self.send_response(304)
+            self.send_header('ETag', response.etag)
+            self.end_headers()
+            return
+        else:
+            self.send_response(200)
+        use_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = response.gzipped if use_gzip else response.body
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', response.etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.debug:
+            super().log_message(format, *args)
+
+
+def run_server(args, graph, partition, layout, cytoscape_js=None, analytics=None):
+    page_html = render_html(graph, partition, layout, label_width=args.label_width, api_base='api/',
+                            bundle_zoom=args.bundle_zoom if args.bundle else None,
+                            cytoscape_js=cytoscape_js, path_limit=args.max_chains, max_hops=args.max_hops)
+    server = ThreadingHTTPServer((args.host, args.port), TopologyRequestHandler)
+    server.service = TopologyService(graph, partition, layout, page_html, args.serve_cache, analytics)
+    server.debug = args.debug
+    print(f'服务已启动: http://{args.host}:{server.server_address[1]}/（Ctrl+C 退出）')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        cache = server.service.cache
+        print(f'已停止服务（响应缓存命中 {cache.hits} 次，未命中 {cache.misses} 次）')
+    finally:
+        server.server_close()
+    return 0
+
+
+def print_metrics(metrics):
+    print('阶段耗时:')
+    for entry in metrics.stages:
+        memory = f'，进程峰值 {entry["peak_rss_mb"]} MB' if entry['peak_rss_mb'] is not None else ''
+        if 'traced_peak_mb' in entry:
+            memory += f'，阶段内分配峰值 {entry["traced_peak_mb"]} MB'
+        print(f'  {entry["stage"]:<14} {entry["seconds"]:8.3f}s{memory}')
+    if metrics.counts:
+        pods = metrics.counts['pods']
+        largest = max(pods, key=lambda pod: pods[pod]['edges'], default=None)
+        print(f'  设备 {metrics.counts["devices"]} 台，链路记录 {metrics.counts["links"]} 条，POD {len(pods)} 个'
+              + (f'（边最多: {largest}，{pods[largest]["edges"]} 条）' if largest else ''))
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    metrics = RunMetrics(enabled=args.profile or bool(args.metrics_json))
+    if not args.profile:
+        rc = run(args, metrics)
+    else:
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            rc = run(args, metrics)
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        prof_path = f'{os.path.splitext(args.output)[0]}.prof'
+        profiler.dump_stats(prof_path)
+        print_metrics(metrics)
+        print(f'cProfile 结果: {prof_path}（按累计耗时前 15 项）')
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(15)
+        top_allocations = snapshot.statistics('lineno')[:10]
+        print('tracemalloc 结束时占用最多的分配位置:')
+        for stat in top_allocations:
+            print(f'  {stat}')
+        metrics.outputs['profile'] = prof_path
+        metrics.allocations = [str(stat) for stat in top_allocations]
+    if args.metrics_json:
+        with open(args.metrics_json, 'w', encoding='utf-8') as f:
+            json.dump(dict(metrics.to_dict(), exit_code=rc), f, ensure_ascii=False, indent=2)
+    return rc
+
+
+def report_analytics(args, analytics):
+    summary = analytics.to_dict()['summary']
+    oversub = summary['leaf_oversubscription_max']
+    ecmp = summary['ecmp_links_min']
+    print(f'  分析: 交换机 {summary["switches"]} 台，Leaf 超售比最高 {oversub if oversub is not None else "-"}，'
+          f'POD 内 Leaf 对 ECMP 链路级最少 {ecmp if ecmp is not None else "-"}，'
+          f'低于所在 POD 最大值的 Leaf 对 {summary["degraded_pairs"]} 个，异常链路 {summary["anomalies"]} 处')
+    if args.analytics_json:
+        with open(args.analytics_json, 'w', encoding='utf-8') as f:
+            json.dump(analytics.to_dict(), f, ensure_ascii=False, indent=2)
+        print(f'  分析结果: {args.analytics_json}')
+    if args.analytics_csv:
+        analytics.write_csv(args.analytics_csv)
+        print(f'  交换机指标: {args.analytics_csv}')
+
+
+def run(args, metrics):
+    if args.analytics_json or args.analytics_csv:
+        args.analytics = True
+    try:
+        rules = ClassificationRules.load(args.rules)
+    except (OSError, ValueError) as e:
+        print(f'错误: 分类规则 {args.rules}: {e}', file=sys.stderr)
+        return 1
+    cytoscape_js = None
+    if args.offline or args.cytoscape_js:
+        try:
+            cytoscape_js = find_cytoscape_js(args.cytoscape_js, args.cache_dir)
+        except OSError as e:
+            print(f'错误: {e}', file=sys.stderr)
+            return 1
+    if args.focus and (args.diff or args.serve or args.analytics or args.batch or args.watch):
+        # 邻域子图不完整，分析结果中会出现大量“缺失链路”
+        print('错误: --focus 不能与 --diff、--serve、--analytics、--batch 或 --watch 同时使用', file=sys.stderr)
+        return 1
+    if args.focus and args.hops < 1:
+        print('错误: --hops 至少为 1', file=sys.stderr)
+        return 1
+    if args.validate and (args.batch or args.watch):
+        # 校验按单份导出给出退出码，批量与监视模式没有对应的报告与退出码
+        print('错误: --validate 不能与 --batch 或 --watch 同时使用', file=sys.stderr)
+        return 1
+    if args.batch:
+        # 历史库只能按时间顺序追加，多进程并行的批量任务无法保证写入顺序；
+        # 分析结果与阶段指标只对应一份导出，各工作进程的结果无处合并
+        conflicts = [flag for flag, value in (
+            ('--diff', args.diff), ('--history-db', args.history_db),
+            ('--analytics-json', args.analytics_json), ('--analytics-csv', args.analytics_csv),
+            ('--metrics-json', args.metrics_json), ('--profile', args.profile)) if value]
+        if conflicts:
+            print(f'错误: --batch 不能与 {"、".join(conflicts)} 同时使用', file=sys.stderr)
+            return 1
+        return run_batch(args, cytoscape_js, rules)
+    if args.serve and (args.diff or args.watch):
+        print('错误: --serve 不能与 --diff 或 --watch 同时使用', file=sys.stderr)
+        return 1
+    if args.watch:
+        if args.diff or args.csv == '-':
+            print('错误: --watch 不能与 --diff 或标准输入同时使用', file=sys.stderr)
+            return 1
+        return run_watch(args, cytoscape_js, rules)
+    history_query = args.list_snapshots or args.port_history or args.device_history
+    if (history_query or args.snapshot) and not args.history_db:
+        print('错误: --snapshot、--list-snapshots、--port-history 与 --device-history 需要 --history-db', file=sys.stderr)
+        return 1
+    if (history_query or args.snapshot) and not os.path.exists(args.history_db):
+        print(f'错误: 历史库 {args.history_db} 不存在', file=sys.stderr)
+        return 1
+    if history_query:
+        try:
+            return run_history_query(args)
+        except (sqlite3.Error, ValueError) as e:
+            print(f'错误: {e}', file=sys.stderr)
+            return 1
+    if args.snapshot and args.diff:
+        print('错误: --snapshot 不能与 --diff 同时使用', file=sys.stderr)
+        return 1
+    if args.diff:
+        old_path, csv_path = args.diff
+    elif args.snapshot:
+        csv_path = f'{args.history_db}#{args.snapshot}'
+    else:
+        csv_path = args.csv or pick_latest_csv(args.csv_glob) or 'Ports-20250731.csv'
+    if args.debug:
+        print(f'使用的CSV: {csv_path}')
+    metrics.csv = csv_path
+
+    cache = None if args.no_cache else ParseCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+    try:
+        if args.snapshot:
+            with metrics.stage('history_load'):
+                store = HistoryStore(args.history_db)
+                try:
+                    snapshot, taken_at = store.resolve(args.snapshot)
+                    graph = store.load_graph(snapshot, rules)
+                finally:
+                    store.close()
+            csv_path = f'{args.history_db}#{snapshot}（{taken_at}）'
+            report, cache_status = IngestReport(rows=graph.num_links), 'history'
+        else:
+            graph, report, cache_status = load_graph(csv_path, cache, args.rebuild_cache, metrics=metrics, rules=rules)
+        if args.diff:
+            old_graph, old_report, _ = load_graph(old_path, cache, args.rebuild_cache, rules=rules)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f'错误: {e}', file=sys.stderr)
+        return 1
+    report_ingest(csv_path, report, args.debug)
+    if args.validate:
+        return run_validate(args, csv_path, graph, report)
+    if args.query_paths or args.query_ecmp or args.ecmp_pod:
+        return run_query(args, graph)
+    if args.focus:
+        return run_focus(args, graph, cytoscape_js, metrics)
+    if args.serve:
+        partition = partition_pods(graph)
+        layout = layout_topology(graph, partition, LayoutOptions.from_args(args))
+        analytics = None
+        if args.analytics:
+            analytics = analyze_fabric(graph, partition)
+            report_analytics(args, analytics)
+        return run_server(args, graph, partition, layout, cytoscape_js, analytics)
+
+    state_file = args.state_file or f'{args.output}.state'
+    reuse = None
+    topology_diff = None
+    if args.diff:
+        report_ingest(old_path, old_report, args.debug)
+        topology_diff = diff_graphs(old_graph, graph)
+        diff_report = args.diff_report or f'{os.path.splitext(args.output)[0]}.diff.json'
+        with open(diff_report, 'w', encoding='utf-8') as f:
+            json.dump(dict(topology_diff.to_dict(), old=old_path, new=csv_path), f, ensure_ascii=False, indent=2)
+        if old_path != '-':
+            reuse = load_payload_state(state_file, ParseCache.key_for(old_path, rules))
+        if reuse is None:
+            print(f'提示: 未找到与 {old_path} 对应的状态文件 {state_file}，将完整生成所有 POD')
+
+    if reuse is not None:
+        reuse = {pod: parts for pod, parts in reuse.items() if pod not in topology_diff.touched_pods}
+    history = None
+    if args.history_db and not args.snapshot:
+        try:
+            with metrics.stage('history_ingest'):
+                history = ingest_snapshot(args, csv_path, graph, rules)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f'错误: 写入历史库失败: {e}', file=sys.stderr)
+            return 1
+    if args.debug and args.debug_target_leaf:
+        print_leaf_debug(graph, args.debug_target_leaf)
+    if args.shard and args.compress:
+        print('提示: --compress 仅作用于内联载荷，分片输出不压缩', file=sys.stderr)
+    page = write_page(graph, args, args.output, reuse, cytoscape_js, metrics)
+    payloads, shard_dir = page.payloads, page.shard_dir
+    exports = []
+    if args.export:
+        with metrics.stage('export'):
+            exports = write_exports(args.export, graph, page.partition, os.path.splitext(args.output)[0])
+    if (args.save_state or args.diff) and csv_path != '-':
+        save_payload_state(state_file, ParseCache.key_for(csv_path, rules), payloads)
+    print(f'已生成: {args.output}')
+    print(f'  CSV: {csv_path}（端口记录 {report.rows} 条，未连接端口 {report.disconnected} 个）')
+    print(f'  解析缓存: {CACHE_STATUS_TEXT[cache_status]}')
+    if history:
+        print(f'  历史库: {args.history_db} {history}')
+    if exports:
+        print(f'  导出: {", ".join(exports)}')
+    if cytoscape_js:
+        print(f'  Cytoscape: 已内联 {cytoscape_js}（离线可用）')
+    if shard_dir:
+        print(f'  分片目录: {shard_dir}（写入 {page.shards_written} 个文件）')
+    elif args.compress:
+        raw, packed = page.render_stats['raw_bytes'], page.render_stats['embedded_bytes']
+        print(f'  载荷大小: 原始 {raw / 1024:.1f} KB，压缩后 {packed / 1024:.1f} KB'
+              f'（{packed / raw * 100 if raw else 0:.0f}%）')
+    if topology_diff is not None:
+        print(f'  差异: 新增 {len(topology_diff.added)}，移除 {len(topology_diff.removed)}，'
+              f'重新布线 {len(topology_diff.recabled)}，涉及 POD: {", ".join(topology_diff.touched_pods) or "无"}')
+        print(f'  差异报告: {diff_report}')
+        print(f'  复用未变化的 POD 载荷: {len(payloads.reused_pods)} 个')
+    if page.analytics is not None:
+        report_analytics(args, page.analytics)
+    return 0
+
 
-with open(args.output, 'w', encoding='utf-8') as f:
-    f.write(html)
-if args.debug:
-    print(f'已生成: {args.output}')
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())